@@ -1,107 +1,711 @@
 import os 
+import re
+import csv
+import time
+import random
 import json 
 import datetime 
 import getpass 
-from typing import Dict, List, Optional
+import argparse
+from typing import Callable, Dict, List, Optional, Iterable, Tuple
 
-class Book: 
-    def __init__(self, book_id:int, name:str, author:str, copies:int, price:float):
-        self.id = book_id
-        self.name = name
-        self.author = author
-        self.copies = copies
-        self.copies_left = copies
-        self.price = price
-        
-    def to_dict(self):
-        return{
-            'id': self.id, 
-            'name': self.name, 
-            'author': self.author, 
-            'copies': self.copies, 
-            'copies_left': self.copies_left, 
-            'price': self.price
-            
-        }
-    @classmethod
-    def from_dict(cls, data):
-        book = cls(data['id'], data['name'], data['author'], data['copies'], data['price'])
-        book.copies_left = data['copies_left']
-        return book
-    
-class User:
-    def __init__(self, user_id:int, name:str):
-        self.id = user_id
-        self.name = name 
-        self.book_id = 0 
-        self.issue_date = None
-        self.due_date = None
-        
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'book_id': self.book_id,
-            'issue_date': self.issue_date.strftime("%d-%m-%Y %H:%M:%S") if self.issue_date else None,
-            'due_date': self.due_date.strftime("%d-%m-%Y %H:%M:%S") if self.due_date else None
-        }
+# The records, indexes and storage backends live in their own modules, imported here so `from app import ...` keeps working
+from records import LibraryError, VersionConflict, BookUnavailable, Book, User, Loan, Reservation, MEMBER_TIERS
+from indexes import (LoanStore, ReservationQueue, OverdueEngine, RankedCounter, CirculationStats, BookSearchIndex,
+                     SortedIndex)
+from storage import (CirculationLog, FileLock, JsonStorage, LazyRecordMap, BinarySnapshot, BinaryRecordMap,
+                     SqliteRecordMap, SqliteStorage)
 
-        
-    @classmethod
-    def from_dict(cls, data):
-        user = cls(data['id'], data['name'])
-        user.book_id = data.get('book_id', 0)
-        user.issue_date = datetime.datetime.strptime(data['issue_date'], "%d-%m-%Y %H:%M:%S") if data.get('issue_date') else None
-        user.due_date = datetime.datetime.strptime(data['due_date'], "%d-%m-%Y %H:%M:%S") if data.get('due_date') else None
-        return user
-
-    
 
 class LibraryManager:
-    def __init__(self):
-        self.book_file = 'book.json'
-        self.users_file = 'user.json'
+    def __init__(self, storage: str = 'json', journal_mode: bool = False, journal_threshold: int = 4 * 1024 * 1024,
+                 db_file: str = 'library.db', concurrent: bool = False, snapshot_format: str = 'json',
+                 circulation_file: str = 'circulation.log'):
         self.admin_password = 'library'
         self.main_password = 'libpass'
+        self.loan_days = 15
+        self.fine_per_day = 3
+        self.max_loans = 5
+        self.hold_days = 3
+        self.cas_retries = 20
+        self.page_size = 20
+        # Rollups are written to the state store every this many new events, and on close
+        self.circulation_checkpoint = 1000
+        self.circulation_log = CirculationLog(circulation_file)
+        self.concurrent = concurrent
         self.books: Dict[int, Book] = {}
         self.users: Dict[int, User] = {}
+        self.loans = LoanStore()
+        self.reservations = ReservationQueue()
+        self.search_index = BookSearchIndex()
+        self.book_order = self.new_book_order()
+        self.user_order = self.new_user_order()
+        
+        if storage == 'sqlite':
+            self.storage = SqliteStorage(db_file, concurrent=concurrent)
+        else:
+            self.storage = JsonStorage(journal_mode=journal_mode, journal_threshold=journal_threshold, concurrent=concurrent,
+                                       snapshot_format=snapshot_format)
         self.load_data()
         
     def load_data(self):
-        """Load books and users from JSON file """
-        try: 
-            if os.path.exists(self.book_file):
-                with open(self.book_file, 'r') as f:
-                    books_data = json.load(f)
-                    self.books = {int(k): Book.from_dict(v) for k, v in books_data.items()}
-        except Exception as e:
-            print(f"Error Loading books: {e}")
-            
-        try: 
-            if os.path.exists(self.users_file):
-                with open(self.users_file, 'r') as f:
-                    users_data = json.load(f)
-                    self.users = {int(k): User.from_dict(v) for k, v in users_data.items()}
-        except Exception as e:
-            print(f"Error Loading users: {e}")
-            
-    def save_books(self):
-        """Save books to JSON file"""
-        try: 
-            books_data = {str(k): v.to_dict() for k, v in self.books.items()}
-            with open(self.book_file, 'w') as f:
-                json.dump(books_data, f, indent=2)
-        except Exception as e:
-            print(f"Error saving Books: {e}")
-            
-    def save_users(self):
-        """Save users to JSON file"""
-        try:
-            users_data = {str(k): v.to_dict() for k, v in self.users.items()}
-            with open(self.users_file, 'w') as f:
-                json.dump(users_data, f, indent=2)
-        except Exception as e:
-            print(f"Error saving users: {e}")
+        """Load books, users and loans from the configured storage"""
+        records = self.storage.load()
+        self.books, self.users = records['book'], records['user']
+        self.loans = LoanStore(records['loan'])
+        self.reservations = ReservationQueue(records['hold'])
+        overdue_state = self.storage.load_state('overdue') or {}
+        self.overdue_engine = OverdueEngine(self.loans.loans.values(), self.fine_per_day, overdue_state.get('last_run'))
+        # Only the log written since the last checkpoint is replayed
+        self.circulation = CirculationStats(self.storage.load_state('circulation'))
+        self.refresh_circulation()
+        
+        # Lazily decoded records build the index on the first search instead of reading every row at startup
+        self.search_index = BookSearchIndex()
+        if not isinstance(self.books, LazyRecordMap):
+            self.search_index.rebuild(self.books.values())
+        # Sort orders are only needed for browsing, they are built on the first page asked for
+        self.book_order, self.user_order = self.new_book_order(), self.new_user_order()
+            
+    @staticmethod
+    def new_book_order() -> SortedIndex:
+        """Sort orders for browsing the catalog"""
+        return SortedIndex({'id': lambda book: book.id, 'name': lambda book: book.name.lower(),
+                            'author': lambda book: book.author.lower(), 'copies_left': lambda book: book.copies_left})
+    
+    def new_user_order(self) -> SortedIndex:
+        """Sort orders for browsing members, the due date one follows their loans"""
+        return SortedIndex({'id': lambda user: user.id, 'name': lambda user: user.name.lower(),
+                            'due': lambda user: self.loans.next_due(user.id)})
+    
+    def reorder_user(self, user_id: int):
+        """Move a member to their place in the browse orders after their record or loans changed"""
+        if not self.user_order.built:
+            return
+        user = self.users.get(user_id)
+        if user is None:
+            self.user_order.remove(user_id)
+        else:
+            self.user_order.add(user)
+            
+    def commit_book(self, book_id: int):
+        """Persist the change made to a single book"""
+        book = self.books.get(book_id)
+        if book is None:
+            self.book_order.remove(book_id)
+            self.storage.delete('book', book_id)
+        else:
+            book.version += 1
+            self.book_order.add(book)
+            self.storage.put('book', book)
+        
+    def commit_user(self, user_id: int):
+        """Persist the change made to a single user"""
+        self.reorder_user(user_id)
+        user = self.users.get(user_id)
+        if user is None:
+            self.storage.delete('user', user_id)
+        else:
+            self.storage.put('user', user)
+            
+    def checkout(self, user_id: int, book_id: int, now: Optional[datetime.datetime] = None) -> Loan:
+        """Lend a copy of a book to a member"""
+        self.sync()
+        if user_id not in self.users:
+            raise LibraryError("User ID does not exist!")
+        if book_id not in self.books:
+            raise LibraryError("Book ID does not exist!")
+        if self.loans.count_for_user(user_id) >= self.max_loans:
+            raise LibraryError(f"User already holds the maximum of {self.max_loans} books!")
+        if self.loans.find(user_id, book_id):
+            raise LibraryError("User already holds a copy of this book!")
+        
+        issue_date = now or datetime.datetime.now()
+        loan = Loan(self.loans.new_id(), user_id, book_id, issue_date, issue_date + datetime.timedelta(days=self.loan_days))
+        # Borrowing closes the member's reservation, and a copy held for it is the one they take
+        reservation = self.reservations.find(user_id, book_id)
+        self.update_copies_left(book_id, -1, added=[loan], closed=[reservation] if reservation else [])
+        self.record_circulation('issue', loan, issue_date)
+        return loan
+    
+    def checkin(self, user_id: int, book_id: int, now: Optional[datetime.datetime] = None) -> Tuple[Loan, int, Optional[Reservation]]:
+        """Take a book back from a member, returns the closed loan, the fine due and the hold the copy went to"""
+        self.sync()
+        loan = self.loans.find(user_id, book_id)
+        if loan is None:
+            raise LibraryError("This book is not issued to this user!")
+        
+        return_date = now or datetime.datetime.now()
+        fine_amount = self.fine_for(loan, return_date)
+        hold = self.update_copies_left(book_id, 1, closed=[loan], release_at=return_date)
+        self.record_circulation('return', loan, return_date, fine_amount)
+        return loan, fine_amount, hold
+    
+    def reserve(self, user_id: int, book_id: int, now: Optional[datetime.datetime] = None) -> Reservation:
+        """Put a member on the waitlist of a book with no copy left"""
+        self.sync()
+        user = self.users.get(user_id)
+        if user is None:
+            raise LibraryError("User ID does not exist!")
+        book = self.books.get(book_id)
+        if book is None:
+            raise LibraryError("Book ID does not exist!")
+        if self.loans.find(user_id, book_id):
+            raise LibraryError("User already holds a copy of this book!")
+        if self.reservations.find(user_id, book_id):
+            raise LibraryError("User already reserved this book!")
+        if book.copies_left > 0:
+            raise LibraryError("A copy is available, issue it instead!")
+        
+        requested = (now or datetime.datetime.now()).replace(microsecond=0)
+        reservation = Reservation(self.reservations.new_id(), user_id, book_id, requested, user.tier)
+        self.update_copies_left(book_id, 0, added=[reservation])
+        return reservation
+    
+    def cancel_reservation(self, user_id: int, book_id: int, now: Optional[datetime.datetime] = None) -> Optional[Reservation]:
+        """Drop a reservation, a copy held for it goes to the next member; returns that member's hold"""
+        self.sync()
+        reservation = self.reservations.find(user_id, book_id)
+        if reservation is None:
+            raise LibraryError("No reservation of this book for this user!")
+        return self.update_copies_left(book_id, 0, closed=[reservation], release_at=now or datetime.datetime.now())
+    
+    def sweep_holds(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        """Scheduled task: pass copies from expired holds down the waitlist. Only expired holds are
+        popped from the expiry heap, so a run with nothing to do is O(1)."""
+        now = now or datetime.datetime.now()
+        self.sync()
+        report = []
+        while True:
+            hold = self.reservations.next_expired(now.timestamp())
+            if hold is None:
+                break
+            try:
+                passed_to = self.update_copies_left(hold.book_id, 0, closed=[hold], release_at=now)
+            except LibraryError:
+                # Another desk dealt with this hold first, it is gone after the sync
+                if hold.id in self.reservations:
+                    break
+                continue
+            line = f"Hold {hold.id} on book {hold.book_id} for user {hold.user_id} expired, "
+            line += f"copy now held for user {passed_to.user_id}" if passed_to else "copy back on the shelf"
+            report.append(line)
+        return report
+    
+    def update_copies_left(self, book_id: int, delta: int, added: List = (), closed: List = (),
+                           release_at: Optional[datetime.datetime] = None) -> Optional[Reservation]:
+        """Change a book's available copies together with the loans and reservations that caused it.
+        Closing a reservation that holds a copy frees that copy on top of delta. With release_at, a freed
+        copy is held for the head of the waitlist instead of going back on the shelf; that hold is returned."""
+        if book_id not in self.books:
+            if delta < 0:
+                raise LibraryError("Book ID does not exist!")
+            # The book was deleted while on loan, only the records need closing
+            self.apply_record_changes(added, closed)
+            return None
+        
+        if not self.concurrent:
+            book = self.books[book_id]
+            step, hold = self.plan_release(book_id, delta, closed, release_at)
+            if book.copies_left + step < 0:
+                raise BookUnavailable("Book is not available!")
+            book.copies_left += step
+            self.apply_record_changes(added, closed, [hold] if hold else [])
+            self.commit_book(book_id)
+            return hold
+        
+        for attempt in range(self.cas_retries):
+            book = self.books.get(book_id)
+            # A lazily read book can be newer than the loans and reservations in memory, plan on a consistent view
+            if self.sync():
+                continue
+            if book is None:
+                raise LibraryError("Book ID does not exist!")
+            # Another desk may have deleted the member meanwhile
+            if any(record.user_id not in self.users for record in added):
+                raise LibraryError("User ID does not exist!")
+            # Planned again on every attempt, another desk may have allocated or served a hold meanwhile
+            step, hold = self.plan_release(book_id, delta, closed, release_at)
+            if book.copies_left + step < 0:
+                raise BookUnavailable("Book is not available!")
+            updated = Book.from_dict(book.to_dict())
+            updated.copies_left += step
+            updated.version = book.version + 1
+            changed = [hold] if hold else []
+            if self.storage.compare_and_swap(updated, book.version, added, closed, changed):
+                self.books[book_id] = updated
+                self.book_order.add(updated)
+                self.apply_record_changes(added, closed, changed, persist=False)
+                return hold
+            
+            # Another desk changed the book or used a record ID first, retry against fresh state
+            self.sync()
+            for record in added:
+                if record.id in self.store_of(record):
+                    record.id = self.store_of(record).new_id()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        raise LibraryError("The book is busy at another desk, please try again!")
+    
+    def update_book(self, book_id: int, changes: Dict[str, object], now: Optional[datetime.datetime] = None) -> Book:
+        """Change a book's details (name, author, copies, price). Only the changed fields are written over the
+        latest stored record, so copies issued or returned at another desk meanwhile are kept. Added copies
+        are held for the members at the head of the waitlist before any goes on the shelf"""
+        now = now or datetime.datetime.now()
+        if not self.concurrent:
+            book = self.books.get(book_id)
+            if book is None:
+                raise LibraryError("Book ID does not exist!")
+            updated = self.edited_book(book, changes)
+            holds = self.hold_added_copies(book, updated, now)
+            self.books[book_id] = updated
+            self.search_index.add(updated)
+            self.apply_record_changes([], [], holds)
+            self.commit_book(book_id)
+            return updated
+
+        for attempt in range(self.cas_retries):
+            book = self.books.get(book_id)
+            if self.sync():
+                continue
+            if book is None:
+                raise LibraryError("Book ID does not exist!")
+            updated = self.edited_book(book, changes)
+            updated.version = book.version + 1
+            holds = self.hold_added_copies(book, updated, now)
+            if self.storage.compare_and_swap(updated, book.version, changed=holds):
+                self.books[book_id] = updated
+                if self.search_index.built:
+                    self.search_index.add(updated)
+                self.book_order.add(updated)
+                self.apply_record_changes([], [], holds, persist=False)
+                return updated
+            # Another desk changed the book first, apply the edit to its version
+            self.sync()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        raise LibraryError("The book is busy at another desk, please try again!")
+
+    def insert_book(self, book: Book) -> Book:
+        """Add a new book, the ID must not be taken at any desk"""
+        if not self.concurrent:
+            if book.id in self.books:
+                raise LibraryError("Book ID already exists!")
+            self.books[book.id] = book
+            self.search_index.add(book)
+            self.commit_book(book.id)
+            return book
+        
+        book.version += 1
+        for attempt in range(self.cas_retries):
+            if self.sync():
+                continue
+            if book.id in self.books:
+                raise LibraryError("Book ID already exists!")
+            if self.storage.compare_and_swap(book, None):
+                self.books[book.id] = book
+                if self.search_index.built:
+                    self.search_index.add(book)
+                self.book_order.add(book)
+                return book
+            # Another desk added a book or changed the catalog first, look again
+            self.sync()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        raise LibraryError("The book is busy at another desk, please try again!")
+    
+    def remove_book(self, book_id: int) -> List[Reservation]:
+        """Delete a book with no copies on loan, with its waitlist and held copies; returns the closed reservations"""
+        if not self.concurrent:
+            if book_id not in self.books:
+                raise LibraryError("Book ID does not exist!")
+            if self.loans.copies_out(book_id):
+                raise LibraryError("Book has copies on loan!")
+            cancelled = self.reservations.for_book(book_id)
+            self.apply_record_changes([], cancelled)
+            del self.books[book_id]
+            self.search_index.remove(book_id)
+            self.commit_book(book_id)
+            return cancelled
+        
+        for attempt in range(self.cas_retries):
+            book = self.books.get(book_id)
+            if self.sync():
+                continue
+            if book is None:
+                raise LibraryError("Book ID does not exist!")
+            # Every issue and return changes the book's version, so an unchanged version means no new loans
+            if self.loans.copies_out(book_id):
+                raise LibraryError("Book has copies on loan!")
+            cancelled = self.reservations.for_book(book_id)
+            if self.storage.compare_and_swap(book, book.version, closed=cancelled, delete=True):
+                self.apply_record_changes([], cancelled, persist=False)
+                del self.books[book_id]
+                self.search_index.remove(book_id)
+                self.book_order.remove(book_id)
+                return cancelled
+            # Another desk changed the book or its waitlist first, check again
+            self.sync()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        raise LibraryError("The book is busy at another desk, please try again!")
+
+    def change_user_id(self, user_id: int, new_id: int) -> User:
+        """Move a member with no books out to a new ID, returns the moved record"""
+        for attempt in range(self.cas_retries if self.concurrent else 1):
+            if self.sync():
+                continue
+            user = self.users.get(user_id)
+            if user is None:
+                raise LibraryError("User ID does not exist!")
+            if new_id in self.users:
+                raise LibraryError("User ID already exists!")
+            if self.loans.count_for_user(user_id):
+                raise LibraryError("Return the user's books before changing the ID!")
+            # Reservations name the member by ID, moving them would lose their place in line
+            if self.reservations.for_user(user_id):
+                raise LibraryError("Cancel the user's reservations before changing the ID!")
+            moved = User(new_id, user.name, user.tier)
+            if not self.concurrent:
+                del self.users[user_id]
+                self.users[new_id] = moved
+                self.commit_user(user_id)
+                self.commit_user(new_id)
+                return moved
+            # The old record must still exist with no loans or reservations, and the new ID must still be free
+            if self.storage.compare_and_swap(None, None, added=[moved], closed=[user]):
+                del self.users[user_id]
+                self.users[new_id] = moved
+                self.reorder_user(user_id)
+                self.reorder_user(new_id)
+                return moved
+            self.sync()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        raise LibraryError("The member is busy at another desk, please try again!")
+    
+    def remove_user(self, user_id: int):
+        """Delete a member with no books out and no reservations"""
+        for attempt in range(self.cas_retries if self.concurrent else 1):
+            if self.sync():
+                continue
+            user = self.users.get(user_id)
+            if user is None:
+                raise LibraryError("User Id does not exist")
+            if self.loans.count_for_user(user_id):
+                raise LibraryError("User still holds books!")
+            if self.reservations.for_user(user_id):
+                raise LibraryError("Cancel the user's reservations first!")
+            if not self.concurrent:
+                del self.users[user_id]
+                self.commit_user(user_id)
+                return
+            # Refused if another desk issued the member a book or reserved one meanwhile
+            if self.storage.compare_and_swap(None, None, closed=[user]):
+                del self.users[user_id]
+                self.reorder_user(user_id)
+                return
+            self.sync()
+            time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+        raise LibraryError("The member is busy at another desk, please try again!")
+
+    @staticmethod
+    def edited_book(book: Book, changes: Dict[str, object]) -> Book:
+        """Copy of a book with some fields changed, added or removed copies go on or come off the shelf"""
+        updated = Book.from_dict(book.to_dict())
+        for field, value in changes.items():
+            setattr(updated, field, value)
+        updated.copies_left += updated.copies - book.copies
+        if updated.copies_left < 0:
+            raise LibraryError("More copies than that are on loan or held!")
+        return updated
+
+    def hold_added_copies(self, book: Book, updated: Book, now: datetime.datetime) -> List[Reservation]:
+        """Holds for the members first in line, one per copy an edit added, taken off the updated book's shelf"""
+        added = min(updated.copies - book.copies, updated.copies_left)
+        if added <= 0:
+            return []
+        hold_until = (now + datetime.timedelta(days=self.hold_days)).replace(microsecond=0)
+        holds = [reservation.held_until(hold_until) for reservation in self.reservations.waitlist(book.id)[:added]]
+        updated.copies_left -= len(holds)
+        return holds
+
+    def plan_release(self, book_id: int, delta: int, closed: List, release_at: Optional[datetime.datetime]) -> Tuple[int, Optional[Reservation]]:
+        """Net change to copies_left, and the hold a freed copy goes to instead of the shelf"""
+        for record in closed:
+            current = self.store_of(record).get(record.id)
+            if current is None:
+                raise LibraryError("This book is not issued to this user!" if isinstance(record, Loan)
+                                   else "The reservation is no longer active!")
+            if isinstance(current, Reservation) and current.hold_until is not None:
+                delta += 1
+        head = self.reservations.head(book_id) if release_at is not None and delta > 0 else None
+        if head is None:
+            return delta, None
+        return delta - 1, head.held_until((release_at + datetime.timedelta(days=self.hold_days)).replace(microsecond=0))
+    
+    def store_of(self, record):
+        """The index an open loan or reservation lives in"""
+        return self.loans if isinstance(record, Loan) else self.reservations
+    
+    def apply_record_changes(self, added: List, closed: List, changed: List = (), persist: bool = True):
+        """Update the loan and reservation indexes and optionally persist the records"""
+        for record in [*added, *changed]:
+            self.store_of(record).add(record)
+            if isinstance(record, Loan):
+                self.overdue_engine.track(record)
+        for record in closed:
+            self.store_of(record).remove(record.id)
+            if isinstance(record, Loan):
+                self.overdue_engine.untrack(record)
+        for user_id in {record.user_id for record in [*added, *closed] if isinstance(record, Loan)}:
+            self.reorder_user(user_id)
+        if persist:
+            for record in [*added, *changed]:
+                self.storage.put(record.KIND, record)
+            for record in closed:
+                self.storage.delete(record.KIND, record.id)
+                
+    def record_circulation(self, event: str, loan: Loan, when: datetime.datetime, fine: int = 0):
+        """Append an issue or return to the circulation log"""
+        book = self.books.get(loan.book_id)
+        self.circulation_log.append({
+            'event': event, 'time': int(when.timestamp()), 'loan_id': loan.id, 'user_id': loan.user_id,
+            'book_id': loan.book_id, 'title': book.name if book else None, 'author': book.author if book else None,
+            'fine': fine,
+        })
+        
+    def refresh_circulation(self, checkpoint: bool = False):
+        """Bring the rollups up to date with the log and checkpoint them when enough events piled up"""
+        self.circulation.refresh(self.circulation_log)
+        if self.circulation.unsaved and (checkpoint or self.circulation.unsaved >= self.circulation_checkpoint):
+            self.storage.save_state('circulation', self.circulation.to_dict())
+            self.circulation.unsaved = 0
+            
+    def top_titles(self, limit: int = 100, year: Optional[int] = None) -> List[Tuple[int, int]]:
+        """(book ID, borrows) for the most borrowed titles, all time or in one year"""
+        self.refresh_circulation()
+        if year is None:
+            return self.circulation.titles.top(limit)
+        counter = self.circulation.titles_by_year.get(year)
+        return counter.top(limit) if counter else []
+    
+    def circulation_report(self, limit: int = 10) -> List[str]:
+        """Most borrowed titles and authors, borrows per month and fines collected"""
+        self.refresh_circulation()
+        stats = self.circulation
+        year = datetime.datetime.now().year
+        report = [f"Top {limit} titles in {year}:"]
+        for book_id, count in self.top_titles(limit, year):
+            book = self.books.get(book_id)
+            report.append(f"  {count:>6}  {book_id:<8} {book.name if book else '(deleted)'}")
+        report.append(f"Top {limit} authors (all time):")
+        for author, count in stats.authors.top(limit):
+            report.append(f"  {count:>6}  {author or '(unknown)'}")
+        report.append("Borrows and fines per month:")
+        for month in sorted(set(stats.borrows_by_month) | set(stats.fines_by_month))[-12:]:
+            report.append(f"  {month}  {stats.borrows_by_month.get(month, 0):>6} borrows  ${stats.fines_by_month.get(month, 0)} fines")
+        report.append(f"Fines collected: ${stats.fines_total}")
+        return report
+    
+    def show_circulation_report(self):
+        """Display the circulation report"""
+        self.display_header("CIRCULATION REPORT")
+        print("\n".join(self.circulation_report()))
+        input("\nPress Enter to continue...")
+                
+    def sync(self) -> bool:
+        """Pick up changes other processes made since we last looked, True if there were any"""
+        changes = self.storage.sync()
+        if changes is None:
+            self.load_data()
+            return True
+        for kind, record_id, data in changes:
+            self.apply_change(kind, record_id, data)
+        return bool(changes)
+            
+    def apply_change(self, kind: str, record_id: int, data: Optional[dict]):
+        """Apply one record written by another process, keeping the indexes in step"""
+        if kind == 'loan':
+            closed = self.loans.remove(record_id)
+            if closed:
+                self.overdue_engine.untrack(closed)
+                self.reorder_user(closed.user_id)
+            if data is not None:
+                loan = Loan.from_dict(data)
+                self.loans.add(loan)
+                self.overdue_engine.track(loan)
+                self.reorder_user(loan.user_id)
+        elif kind == 'book':
+            if data is None:
+                self.books.pop(record_id, None)
+                self.search_index.remove(record_id)
+                self.book_order.remove(record_id)
+                # The deleting desk stored the closed reservations, only our indexes still list them
+                for reservation in self.reservations.for_book(record_id):
+                    self.reservations.remove(reservation.id)
+            else:
+                book = Book.from_dict(data)
+                self.books[record_id] = book
+                if self.search_index.built:
+                    self.search_index.add(book)
+                self.book_order.add(book)
+        elif kind == 'hold':
+            self.reservations.remove(record_id)
+            if data is not None:
+                self.reservations.add(Reservation.from_dict(data))
+        else:
+            if data is None:
+                self.users.pop(record_id, None)
+            else:
+                self.users[record_id] = User.from_dict(data)
+            self.reorder_user(record_id)
+    
+    def run_overdue_batch(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        """Nightly batch: notices for newly overdue loans and fines accrued since the last run"""
+        now = now or datetime.datetime.now()
+        previous_run = self.overdue_engine.last_run
+        notices, accrued = self.overdue_engine.run(now)
+        self.storage.save_state('overdue', {'last_run': self.overdue_engine.last_run})
+        
+        since = datetime.datetime.fromtimestamp(previous_run).strftime("%d-%m-%Y %H:%M:%S") if previous_run else "the beginning"
+        report = [f"Overdue run at {now.strftime('%d-%m-%Y %H:%M:%S')} (since {since})"]
+        report.append(f"New overdue notices: {len(notices)}")
+        if notices:
+            report.append(f"{'Loan':<8} {'User ID':<8} {'Name':<20} {'Book ID':<8} {'Due Date':<12} {'Fine':<8}")
+            report.append("-" * 80)
+            for loan_id in notices:
+                loan = self.loans.loans[loan_id]
+                user = self.users.get(loan.user_id)
+                name = user.name if user else "Unknown"
+                report.append(f"{loan.id:<8} {loan.user_id:<8} {name:<20} {loan.book_id:<8} "
+                              f"{loan.due_date.strftime('%d-%m-%Y'):<12} {self.fine_for(loan, now):<8}")
+        report.append(f"Loans overdue: {len(self.overdue_engine.overdue_ids)}")
+        report.append(f"Fines accrued since last run: ${accrued}")
+        report.append(f"Outstanding fines: ${self.overdue_engine.outstanding_fines(now.timestamp())}")
+        return report
+    
+    def overdue_report(self):
+        """Run the overdue batch and display its report"""
+        self.display_header("OVERDUE REPORT")
+        print("\n".join(self.run_overdue_batch()))
+        input("\nPress Enter to continue...")
+        
+    def fine_for(self, loan: Loan, as_of: datetime.datetime) -> int:
+        """Late fine for a loan at the given time"""
+        if as_of <= loan.due_date:
+            return 0
+        return (as_of - loan.due_date).days * self.fine_per_day
+            
+    def iter_catalog_rows(self, path: str) -> Iterable[dict]:
+        """Stream raw rows from a CSV or JSONL catalog file"""
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            if path.lower().endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from csv.DictReader(f)
+                
+    @staticmethod
+    def book_from_row(row: dict) -> Book:
+        """Validate one catalog row, raises ValueError if it is unusable"""
+        book_id = int(row['id'])
+        name = str(row.get('name') or '').strip()
+        author = str(row.get('author') or '').strip()
+        copies = int(row.get('copies') or 0)
+        price = float(row.get('price') or 0)
+        if book_id <= 0 or not name or copies < 0 or price < 0:
+            raise ValueError(f"invalid book row {row!r}")
+        isbn = re.sub(r"[\s-]", "", str(row.get('isbn') or '')).upper() or None
+        book = Book(book_id, name, author, copies, price, isbn)
+        if row.get('copies_left') not in (None, ''):
+            book.copies_left = min(int(row['copies_left']), copies)
+        return book
+    
+    def catalog_conflicts(self, books: List[Book], known_isbns: Optional[set]) -> Tuple[set, set]:
+        """IDs and ISBNs from a batch that are already in the catalog"""
+        if self.storage.lazy:
+            return (self.storage.existing_values('book', 'id', [book.id for book in books]),
+                    self.storage.existing_values('book', 'isbn', [book.isbn for book in books if book.isbn]))
+        return ({book.id for book in books if book.id in self.books},
+                {book.isbn for book in books if book.isbn in known_isbns})
+    
+    def import_catalog(self, path: str, batch_size: int = 10000, progress=print) -> Dict[str, float]:
+        """Stream a CSV/JSONL catalog into the library, persisting once per batch"""
+        stats = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0}
+        # In-memory catalogs check ISBNs against a set, lazy storage asks the database per batch
+        known_isbns = None if self.storage.lazy else {book.isbn for book in self.books.values() if book.isbn}
+        batch: Dict[int, Book] = {}
+        batch_isbns = set()
+        started = time.perf_counter()
+        
+        def flush():
+            books = list(batch.values())
+            existing_ids, existing_isbns = self.catalog_conflicts(books, known_isbns)
+            fresh = [book for book in books if book.id not in existing_ids and book.isbn not in existing_isbns]
+            stats['duplicates'] += len(books) - len(fresh)
+            
+            if self.storage.lazy:
+                self.books.invalidate(book.id for book in fresh)
+            else:
+                for book in fresh:
+                    self.books[book.id] = book
+                    if book.isbn:
+                        known_isbns.add(book.isbn)
+            if fresh:
+                self.storage.put_many('book', fresh)
+            for book in fresh:
+                if self.search_index.built:
+                    self.search_index.add(book)
+                self.book_order.add(book)
+                
+            stats['imported'] += len(fresh)
+            batch.clear()
+            batch_isbns.clear()
+            elapsed = time.perf_counter() - started
+            progress(f"Imported {stats['imported']} books ({stats['read'] / elapsed:,.0f} rows/sec)")
+        
+        for row in self.iter_catalog_rows(path):
+            stats['read'] += 1
+            try:
+                book = self.book_from_row(row)
+            except (KeyError, TypeError, ValueError):
+                stats['invalid'] += 1
+                continue
+            
+            # Duplicates inside a batch are caught here, across batches by the catalog check in flush
+            if book.id in batch or (book.isbn and book.isbn in batch_isbns):
+                stats['duplicates'] += 1
+                continue
+            batch[book.id] = book
+            if book.isbn:
+                batch_isbns.add(book.isbn)
+            
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+            
+        stats['seconds'] = time.perf_counter() - started
+        stats['rows_per_sec'] = stats['read'] / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+    
+    def export_catalog(self, path: str) -> int:
+        """Stream the catalog to a CSV or JSONL file without building it in memory"""
+        count = 0
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if path.lower().endswith('.jsonl'):
+                for book in self.books.values():
+                    f.write(book.to_json() + '\n')
+                    count += 1
+            else:
+                writer = csv.writer(f)
+                writer.writerow(['id', 'name', 'author', 'copies', 'copies_left', 'price', 'isbn'])
+                for book in self.books.values():
+                    writer.writerow([book.id, book.name, book.author, book.copies, book.copies_left, book.price, book.isbn or ''])
+                    count += 1
+        return count
+            
+    def close(self):
+        """Checkpoint the rollups, then flush and release the storage"""
+        self.refresh_circulation(checkpoint=True)
+        self.storage.close()
             
     def clear_screen(self):
         """Clear the console screen"""
@@ -176,12 +780,17 @@ class LibraryManager:
             print("4. List Users")
             print("5. Issue Book")
             print("6. Collect Book")
-            print("7. Main Menu")
-            print("8. Exit")
+            print("7. Book Holders")
+            print("8. Overdue Report")
+            print("9. Circulation Report")
+            print("10. Reservations")
+            print("11. Main Menu")
+            print("12. Exit")
             
             
             try:
                 choice = int(input("\nEnter your choice: "))
+                self.sync()
                 if choice == 1: 
                     self.book_menu()
                 elif choice == 2: 
@@ -189,14 +798,22 @@ class LibraryManager:
                 elif choice == 3: 
                     self.list_book()
                 elif choice == 4: 
-                    self.list_users()
+                    self.list_user()
                 elif choice == 5:
                     self.issue_book()
                 elif choice == 6:
-                    self.collect_book
-                elif choice == 7: 
+                    self.collect_book()
+                elif choice == 7:
+                    self.book_holders()
+                elif choice == 8:
+                    self.overdue_report()
+                elif choice == 9:
+                    self.show_circulation_report()
+                elif choice == 10:
+                    self.reservation_menu()
+                elif choice == 11: 
                     self.main_menu()
-                elif choice == 8: 
+                elif choice == 12: 
                     if self.confirm_exit():
                         break
                 else:
@@ -218,6 +835,7 @@ class LibraryManager:
             
             try: 
                 choice = int(input("\nEnter your choice"))
+                self.sync()
                 
                 if choice == 1: 
                     self.add_book()
@@ -255,13 +873,14 @@ class LibraryManager:
                 copies = int(input("Enter Number of Copies: "))
                 price = float(input("Enter Price: "))
                 
-                book = Book(book_id, name, author, copies, price)
-                self.books[book_id] = book
-                self.save_books()
+                self.insert_book(Book(book_id, name, author, copies, price))
                 
                 print("Book successfully added!")
                 if input("Do you want to add another book? (y/n): ").lower() != 'y':
                     break
+            except LibraryError as e:
+                print(e)
+                input("Press Enter to continue...")
             except ValueError:
                 print("Please enter valid values!")
                 input("Press Enter to continue...")
@@ -276,34 +895,39 @@ class LibraryManager:
                 print("Book ID does not exist!")
                 input("Press Enter to continue... ")
                 return
-            book = self.books[book_id]
+            # Edits are collected and applied in one step, over whatever other desks changed meanwhile
+            changes = {}
             while True:
+                book = {**self.books[book_id].to_dict(), **changes}
                 self.display_header("EDIT BOOK DETAILS")
                 print(f"Current Book Information:")
                 print(f"Book ID: {book_id}")
-                print(f"1. Book Name: {book.name}")
-                print(f"2. Author: {book.author}")
-                print(f"3. Number of copies {book.copies}")
-                print(f"4. Price: {book.price:.2f}")
-                
+                print(f"1. Book Name: {book['name']}")
+                print(f"2. Author: {book['author']}")
+                print(f"3. Number of copies {book['copies']}")
+                print(f"4. Price: {book['price']:.2f}")
+
                 field_choice = int(input("\nEnter the field to edit: "))
                 if field_choice == 1:
-                    book.name = input("Enter new book name: ").strip()
-                elif field_choice == 2: 
-                    book.author = input("Enter Author Name: ").strip()
+                    changes['name'] = input("Enter new book name: ").strip()
+                elif field_choice == 2:
+                    changes['author'] = input("Enter Author Name: ").strip()
                 elif field_choice == 3:
-                    book.copies = int(input("Enter Number of Copies: "))
+                    changes['copies'] = int(input("Enter Number of Copies: "))
                 elif field_choice == 4:
-                    book.price = float(input("Enter Price: "))
+                    changes['price'] = float(input("Enter Price: "))
                 else:
                     print("Invalid choice!")
                     continue
                 if input("Do you want to edit anything else? (y/n): ").lower() != 'y':
                     break
-            self.save_books()
+            self.update_book(book_id, changes)
             print("Book successfully update")
             input("Press Enter to continue...")
-            
+
+        except LibraryError as e:
+            print(e)
+            input("Press Enter to continue...")
         except ValueError:
             print("Please enter valid values!")
             input("Press enter to continue...")
@@ -315,14 +939,14 @@ class LibraryManager:
         try:
             book_id = int(input("Enter Book ID to delete: "))
             
-            if book_id not in self.books:
-                print("Book ID does not exist!")
-                input("Press enter to continue")
-                return
-            del self.books[book_id]
-            self.save_books()
+            cancelled = self.remove_book(book_id)
             print("Book successfully deleted")
+            if cancelled:
+                print(f"{len(cancelled)} reservation(s) of the book were cancelled")
             input("Press enter to continue...")
+        except LibraryError as e:
+            print(e)
+            input("Press enter to continue")
         except ValueError: 
             print("Please enter a valid Book ID")
             input("press Enter to continue...")
@@ -339,6 +963,7 @@ class LibraryManager:
             
             try:
                 choice = int(input("\nEnter you choice: "))
+                self.sync()
                 
                 if choice == 1:
                     self.add_user()
@@ -372,10 +997,15 @@ class LibraryManager:
                     continue
                 
                 name = input("Enter Name: ").strip()
+                tier = input(f"Enter Tier ({'/'.join(MEMBER_TIERS)}) [standard]: ").strip().lower() or 'standard'
+                if tier not in MEMBER_TIERS:
+                    print("Unknown tier!")
+                    input("Press Enter to continue...")
+                    continue
                 
-                user = User(user_id, name)
+                user = User(user_id, name, tier)
                 self.users[user_id] = user
-                self.save_users()
+                self.commit_user(user_id)
                 
                 print("User successfully added!")
                 
@@ -405,26 +1035,33 @@ class LibraryManager:
                 print(f"Current User Information")
                 print(f"1. User ID: {user.id}")
                 print(f"2. User Name: {user.name}")
+                print(f"3. Tier: {user.tier}")
                 
                 field_choice = int(input("Enter new user ID"))
                 if field_choice == 1: 
                     new_id = int(input("Enter new user ID: "))
-                    if new_id in self.users and new_id != user_id:
-                        print("User ID already exists!")
-                        continue
-                    
-                    del self.users[user_id]
-                    user.id = new_id
-                    self.users[new_id] = user
-                    user_id = new_id
+                    if new_id != user_id:
+                        try:
+                            # Moved at once, the new ID is checked against every desk
+                            user = self.change_user_id(user_id, new_id)
+                        except LibraryError as e:
+                            print(e)
+                            continue
+                        user_id = new_id
                 elif field_choice == 2:
                     user.name = input("Enter new user name: ").strip()
+                elif field_choice == 3:
+                    tier = input(f"Enter new tier ({'/'.join(MEMBER_TIERS)}): ").strip().lower()
+                    if tier in MEMBER_TIERS:
+                        user.tier = tier
+                    else:
+                        print("Unknown tier!")
                 else:
                     print("Invalid choice")
                     
                 if input("Do you want to edit anything esle? (y/n): ").lower() != 'y':
                     break
-            self.save_users()
+            self.commit_user(user_id)
             print("User successfully updated")
             input("press Enter to continue...")
         except ValueError:
@@ -437,47 +1074,89 @@ class LibraryManager:
         try:
             user_id = int(input("Enter User Id to delete: "))
             
-            if user_id not in self.users:
-                print("User Id does not exist")
-                input("Press Enter to continue...")
-                return
-            del self.users[user_id]
-            self.save_users()
+            self.remove_user(user_id)
             print("User successfully deleted!")
             input("Press Enter to continue... ")
             
+        except LibraryError as e:
+            print(e)
+            input("Press Enter to continue...")
         except ValueError:
             print("Please Enter valid values")
             input("Press Enter to continue...")
             
+    def browse_books(self, order: str = 'id', after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[List[Book], Optional[tuple]]:
+        """One page of the catalog in a sort order (id, name, author, copies_left) and the cursor of the next page"""
+        if not self.book_order.built:
+            self.book_order.rebuild(self.books.values())
+        book_ids, cursor = self.book_order.page(order, after, limit or self.page_size)
+        return [self.books[book_id] for book_id in book_ids], cursor
+    
+    def browse_users(self, order: str = 'id', after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[List[User], Optional[tuple]]:
+        """One page of members in a sort order (id, name, due) and the cursor of the next page"""
+        if not self.user_order.built:
+            self.user_order.rebuild(self.users.values())
+        user_ids, cursor = self.user_order.page(order, after, limit or self.page_size)
+        return [self.users[user_id] for user_id in user_ids], cursor
+    
+    def choose_order(self, title: str, orders: List[Tuple[str, str]]) -> str:
+        """Ask for a sort order, the first one by default"""
+        self.display_header(title)
+        for number, (_, label) in enumerate(orders, 1):
+            print(f"{number}. By {label}")
+        choice = input("\nSort by [1]: ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(orders):
+            return orders[int(choice) - 1][0]
+        return orders[0][0]
+    
+    def page_through(self, title: str, browse: Callable, order: str, header: str, row: Callable):
+        """Show records a page at a time, each page starts after the cursor the previous one ended on"""
+        starts: List[Optional[tuple]] = [None]
+        while True:
+            self.display_header(title)
+            records, cursor = browse(order, starts[-1])
+            print(header)
+            print("-" * 80)
+            for record in records:
+                print(row(record))
+            print(f"\nPage {len(starts)}{'' if cursor else ' (last)'}")
+            choice = input("n: next page, p: previous page, Enter: back: ").strip().lower()
+            if choice == 'n':
+                if cursor is not None:
+                    starts.append(cursor)
+            elif choice == 'p':
+                if len(starts) > 1:
+                    starts.pop()
+            else:
+                return
+            
     def list_book(self):
-        """List all the books"""
-        self.display_header("LIST RECORD")
-        
+        """Browse the books a page at a time"""
         if not self.books:
+            self.display_header("LIST RECORD")
             print("No book found")
-        else:
-            print(f"{'ID': <5} {'Book Name':<25} {'Author': <20} {'Price':<8}{"Copies":<8} {'Left':<8}")
-            print("-" * 80)
-            for book in self.books.values():
-                print(f"{book.id: <5} {book.name: <25} {book.author: <20} {book.price: <8.2f} {book.copies:<8} {book.copies_left:<8}")
-                
-        input("\nPress Enter to continue...")
+            input("\nPress Enter to continue...")
+            return
+        order = self.choose_order("LIST RECORD", [('id', "ID"), ('name', "Name"), ('author', "Author"), ('copies_left', "Copies Left")])
+        self.page_through("LIST RECORD", self.browse_books, order,
+                          f"{'ID': <5} {'Book Name':<25} {'Author': <20} {'Price':<8}{"Copies":<8} {'Left':<8}",
+                          lambda book: f"{book.id: <5} {book.name: <25} {book.author: <20} {book.price: <8.2f} {book.copies:<8} {book.copies_left:<8}")
         
     def list_user(self):
-        """Display all users"""
-        self.display_header("USER RECORD")
-        
+        """Browse the users a page at a time"""
         if not self.users:
+            self.display_header("USER RECORD")
             print("No users found!")
-        else:
-            print(f"{'ID':<5} {'Name':<20} {'Book ID':<8} {'Issue Date':<12} {'Due Date':<12}")
-            print("-" * 80)
-            for user in self.users.values():
-                issue_date = user.issue_date.strftime("%d-%m-%Y") if user.issue_date else "None"
-                due_date = user.due_date.strftime("%d-%m-%Y") if user.due_date else "None"
-                print(f"{user.id:<5} {user.name:<20} {user.book_id:<8} {issue_date:<12} {due_date:<12}")
-        input("\nPress Enter to continue...")
+            input("\nPress Enter to continue...")
+            return
+        
+        def row(user: User) -> str:
+            loans = self.loans.for_user(user.id)
+            due_date = loans[0].due_date.strftime("%d-%m-%Y") if loans else "None"
+            return f"{user.id:<5} {user.name:<20} {len(loans):<8} {due_date:<12}"
+        
+        order = self.choose_order("USER RECORD", [('id', "ID"), ('name', "Name"), ('due', "Next Due Date")])
+        self.page_through("USER RECORD", self.browse_users, order, f"{'ID':<5} {'Name':<20} {'Books':<8} {'Next Due':<12}", row)
         
     def issue_book(self):
         """Issue a book to a user"""
@@ -491,37 +1170,25 @@ class LibraryManager:
                 input("Press Enter to continue...")
                 return
             
-            user = self.users[user_id]
-            
-            if user.book_id > 0:
-                print("User has already been issued a book!")
-                input("Press Enter to continue...")
-                return
-            
             book_id = int(input("Enter Book ID to issue: "))
-            if book_id not in self.books:
-                print("Book ID does not exist!")
-            
-            book = self.books[book_id]
-            
-            if book.copies_left == 0:
-                print("Book is not available!")
-                input("Press Enter to continue...")
-                return
-            
-            # Issue the book 
-            issue_date = datetime.datetime.now()
-            due_date = issue_date + datetime.timedelta(days=15)
-            
-            user.book_id = book_id
-            user.issue_date = issue_date
-            user.due_date = due_date
-            
-            book.copies_left -= 1
+            loan = self.checkout(user_id, book_id)
             
             print(f"Book issued successfully!")
-            print(f"Issue Date: {issue_date.strftime('%d-%m-%Y')}")
-            print(f"Due Date: {due_date.strftime('%d-%m-%Y')}")
+            print(f"Issue Date: {loan.issue_date.strftime('%d-%m-%Y')}")
+            print(f"Due Date: {loan.due_date.strftime('%d-%m-%Y')}")
+            input("Press Enter to continue...")
+        except BookUnavailable as e:
+            print(e)
+            if input("Reserve it for this user? (y/n): ").lower() == 'y':
+                try:
+                    position = len(self.reservations.waitlist(book_id)) + 1
+                    self.reserve(user_id, book_id)
+                    print(f"Reserved, position {position} in the waitlist")
+                except LibraryError as e:
+                    print(e)
+            input("Press Enter to continue...")
+        except LibraryError as e:
+            print(e)
             input("Press Enter to continue...")
         except ValueError:
             print("Please enter valid values!")
@@ -539,43 +1206,114 @@ class LibraryManager:
                 input("Press Enter to continue...")
                 return
             
-            user = self.users[user_id]
+            loans = self.loans.for_user(user_id)
             
-            if user.book_id == 0:
+            if not loans:
                 print("No book issued to this user!")
                 input("Press Enter to continue...")
                 return
             
-            return_date = datetime.datetime.now()
-            
-            # Calculate fine 
-            fine_amount = 0 
-            if return_date > user.due_date:
-                days_late = (return_date - user.due_date).days
-                fine_amount = days_late * 3
-                
+            if len(loans) == 1:
+                book_id = loans[0].book_id
+            else:
+                print("Books held: " + ", ".join(str(loan.book_id) for loan in loans))
+                book_id = int(input("Enter Book ID to collect: "))
                 
-            # Return the book 
-            book = self.books[user.book_id]
-            book.copies_left += 1
-            
-            user.book_id = 0 
-            user.issue_date = None
-            user.due_date = None
-            
-            self.save_users()
-            self.save_books()
+            _, fine_amount, hold = self.checkin(user_id, book_id)
             
             print("Book returned successfully!")
             if fine_amount > 0 :
                 print(f"Fine amount: ${fine_amount}")
+            if hold:
+                print(f"Keep this copy aside: held for user {hold.user_id} until {hold.hold_until.strftime('%d-%m-%Y %H:%M')}")
             input("Press Enter to continue...")
             
+        except LibraryError as e:
+            print(e)
+            input("Press Enter to continue...")
         except ValueError:
             print("Please enter a valid User ID!")
             input("Press Enter to continue...")
             
+    def book_holders(self):
+        """Show who holds the copies of a book"""
+        self.display_header("BOOK HOLDERS")
+        
+        try:
+            book_id = int(input("Enter Book ID: "))
             
+            if book_id not in self.books:
+                print("Book ID does not exist!")
+                input("Press Enter to continue...")
+                return
+            
+            book = self.books[book_id]
+            loans = self.loans.for_book(book_id)
+            print(f"\n{book.name}: {len(loans)} of {book.copies} copies out")
+            if loans:
+                print(f"{'User ID':<8} {'Name':<20} {'Issue Date':<12} {'Due Date':<12}")
+                print("-" * 80)
+                for loan in sorted(loans, key=lambda loan: loan.due_date):
+                    user = self.users.get(loan.user_id)
+                    name = user.name if user else "Unknown"
+                    print(f"{loan.user_id:<8} {name:<20} {loan.issue_date.strftime('%d-%m-%Y'):<12} {loan.due_date.strftime('%d-%m-%Y'):<12}")
+            self.print_waitlist(book_id)
+            input("\nPress Enter to continue...")
+            
+        except ValueError:
+            print("Please enter a valid Book ID!")
+            input("Press Enter to continue...")
+            
+            
+    def print_waitlist(self, book_id: int):
+        """Print the held copies and the waitlist of a book"""
+        for hold in self.reservations.held(book_id):
+            print(f"Copy held for user {hold.user_id} until {hold.hold_until.strftime('%d-%m-%Y %H:%M')}")
+        waitlist = self.reservations.waitlist(book_id)
+        if waitlist:
+            print(f"\n{'Position':<10} {'User ID':<8} {'Tier':<10} {'Requested':<18}")
+            print("-" * 80)
+            for position, reservation in enumerate(waitlist, 1):
+                print(f"{position:<10} {reservation.user_id:<8} {reservation.tier:<10} {reservation.requested.strftime('%d-%m-%Y %H:%M'):<18}")
+                
+    def reservation_menu(self):
+        """Reservations menu"""
+        while True:
+            self.display_header("RESERVATIONS")
+            print("1. Reserve Book")
+            print("2. Cancel Reservation")
+            print("3. Waitlist")
+            print("4. Sweep Expired Holds")
+            print("5. Administrator Menu")
+            
+            try:
+                choice = int(input("\nEnter your choice: "))
+                self.sync()
+                if choice == 1:
+                    reservation = self.reserve(int(input("Enter User ID: ")), int(input("Enter Book ID: ")))
+                    print(f"Reserved, position {len(self.reservations.waitlist(reservation.book_id))} in the waitlist")
+                elif choice == 2:
+                    hold = self.cancel_reservation(int(input("Enter User ID: ")), int(input("Enter Book ID: ")))
+                    print("Reservation cancelled")
+                    if hold:
+                        print(f"The held copy now goes to user {hold.user_id}")
+                elif choice == 3:
+                    book_id = int(input("Enter Book ID: "))
+                    self.print_waitlist(book_id)
+                elif choice == 4:
+                    print("\n".join(self.sweep_holds()) or "No expired holds")
+                elif choice == 5:
+                    return
+                else:
+                    print("Invalid choice!")
+                input("Press Enter to continue...")
+            except LibraryError as e:
+                print(e)
+                input("Press Enter to continue...")
+            except ValueError:
+                print("Please enter a valid number!")
+                input("Press Enter to continue...")
+                
     def user_menu(self):
         """User Menu"""
         while True:
@@ -587,6 +1325,7 @@ class LibraryManager:
             
             try:
                 choice = int(input("\nEnter your choice: "))
+                self.sync()
                 
                 if choice == 1:
                     self.search_book()
@@ -602,17 +1341,33 @@ class LibraryManager:
                 print("Please enter a valid Number!")
                 input("Press Enter to continue...")
                 
+    def build_search_index(self):
+        """Index the catalog for the first search. A binary snapshot carries the index saved with it, only the
+        books touched since it was read are indexed again"""
+        books = self.books
+        if isinstance(books, BinaryRecordMap) and books.snapshot.search:
+            self.search_index.open(books.snapshot.search, books.snapshot.records('book', BookSearchIndex.decode_entry))
+            for book_id in books.touched_keys():
+                if book_id in books:
+                    self.search_index.add(books[book_id])
+                else:
+                    self.search_index.remove(book_id)
+        else:
+            self.search_index.rebuild(books.values())
+            
+    def find_books(self, query: str, limit: int = 50) -> List[Book]:
+        """Ranked, typo tolerant search over titles and authors"""
+        if not self.search_index.built:
+            self.build_search_index()
+        return [self.books[book_id] for book_id in self.search_index.search(query, limit)]
+    
     def search_book(self):
         """Search for books"""
         while True:
             self.display_header("BOOK SEARCH")
             
             search_name = input("Enter the name of the book to search: ").strip().lower()
-            found_books = []
-            
-            for book in self.books.values():
-                if search_name in book.name.lower():
-                    found_books.append(book)
+            found_books = self.find_books(search_name)
                     
             if found_books:
                 print(f"\nSearch Results: {len(found_books)} book(s) found")
@@ -648,14 +1403,23 @@ class LibraryManager:
                     print("\nUser Information:")
                     print(f"user ID: {user.id}")
                     print(f"Name: {user.name}")
-                    print(f"Book ID: {user.book_id}")
                     
-                    if user.issue_date:
-                        print(f"Issue Date: {user.issue_date.strftime('%d-%m-%Y')}")
-                        print(f"Due Date: {user.due_date.strftime('%d-%m-%Y')}")
+                    loans = self.loans.for_user(user_id)
+                    if loans:
+                        for loan in loans:
+                            print(f"\nBook ID: {loan.book_id}")
+                            print(f"Issue Date: {loan.issue_date.strftime('%d-%m-%Y')}")
+                            print(f"Due Date: {loan.due_date.strftime('%d-%m-%Y')}")
                         
                     else:
                         print("No book currently issued")
+                        
+                    for reservation in self.reservations.for_user(user_id):
+                        if reservation.hold_until:
+                            print(f"\nBook ID {reservation.book_id} is held for you until {reservation.hold_until.strftime('%d-%m-%Y %H:%M')}")
+                        else:
+                            position = self.reservations.waitlist(reservation.book_id).index(reservation) + 1
+                            print(f"\nBook ID {reservation.book_id} reserved, position {position} in the waitlist")
                 else:
                     print("No such user found!")
                     
@@ -672,7 +1436,58 @@ class LibraryManager:
     
 def main():
     """Main function"""
-    library = LibraryManager()
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument("--journal", action="store_true", help="Append changes to a journal instead of rewriting the JSON files")
+    parser.add_argument("--storage", choices=['json', 'sqlite'], default=os.environ.get('LIBRARY_STORAGE', 'json'),
+                        help="Storage backend (default: $LIBRARY_STORAGE or json)")
+    parser.add_argument("--db-file", default='library.db', help="SQLite database file")
+    parser.add_argument("--snapshot-format", choices=['json', 'binary'], default='json',
+                        help="Keep JSON storage snapshots as JSON files or as one memory-mapped binary file")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="Share the data files with other running copies (implies --journal for JSON storage)")
+    parser.add_argument("--migrate", action="store_true", help="Copy book.json and user.json into the SQLite database and exit")
+    parser.add_argument("--overdue-report", action="store_true", help="Run the overdue notice and fine batch and exit")
+    parser.add_argument("--circulation-report", action="store_true", help="Print the circulation rollups and exit")
+    parser.add_argument("--sweep-holds", action="store_true", help="Pass copies from expired holds down the waitlist and exit")
+    parser.add_argument("--import", dest="import_path", metavar="FILE", help="Import books from a .csv or .jsonl catalog and exit")
+    parser.add_argument("--export", dest="export_path", metavar="FILE", help="Export books to a .csv or .jsonl catalog and exit")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Books persisted per batch during --import")
+    args = parser.parse_args()
+    
+    if args.migrate:
+        database = SqliteStorage(args.db_file)
+        counts = database.migrate_from_json(JsonStorage(journal_mode=args.journal, snapshot_format=args.snapshot_format))
+        database.close()
+        print(f"Migrated {counts['book']} books, {counts['user']} users and {counts['loan']} loans into {args.db_file}")
+        return
+    
+    library = LibraryManager(storage=args.storage, journal_mode=args.journal, db_file=args.db_file, concurrent=args.concurrent,
+                             snapshot_format=args.snapshot_format)
+    
+    if args.overdue_report:
+        print("\n".join(library.run_overdue_batch()))
+        library.close()
+        return
+    
+    if args.circulation_report:
+        print("\n".join(library.circulation_report()))
+        library.close()
+        return
+    
+    if args.sweep_holds:
+        print("\n".join(library.sweep_holds()) or "No expired holds")
+        library.close()
+        return
+    
+    if args.import_path or args.export_path:
+        if args.import_path:
+            stats = library.import_catalog(args.import_path, args.batch_size)
+            print(f"Read {stats['read']} rows: {stats['imported']} imported, {stats['duplicates']} duplicates, "
+                  f"{stats['invalid']} invalid in {stats['seconds']:.1f}s ({stats['rows_per_sec']:,.0f} rows/sec)")
+        if args.export_path:
+            print(f"Exported {library.export_catalog(args.export_path)} books to {args.export_path}")
+        library.close()
+        return
     print("Welcome to Library Managment System")
     print("Press Enter to continue...")
     
@@ -680,6 +1495,8 @@ def main():
         library.main_menu()
     except KeyboardInterrupt:
         print("\n\nExiting program....")
+    finally:
+        library.close()
         
     print("Thank you for using Library Management System!")
     
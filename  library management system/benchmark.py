@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Library Management System
+
+    python benchmark.py memory --books 100000
+    python benchmark.py startup --books 10000 100000 1000000
+    python benchmark.py generate --books 100000 --users 10000 --dir data/
+    python benchmark.py suite --books 100000 --ops 500 --output results.json
+    python benchmark.py compare baseline.json results.json
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import datetime
+import platform
+import subprocess
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Peak RSS is only reported where the platform exposes it
+    resource = None
+
+from app import Book, User, Loan, JsonStorage, BinarySnapshot, SqliteStorage, LibraryManager, LibraryError
+
+
+class DictBook:
+    """Book laid out the way it was before __slots__, with a per-instance __dict__"""
+
+    def __init__(self, book_id: int, name: str, author: str, copies: int, price: float, isbn=None):
+        self.id = book_id
+        self.name = name
+        self.author = author
+        self.copies = copies
+        self.copies_left = copies
+        self.price = price
+        self.isbn = isbn
+        self.version = 0
+
+    def to_dict(self) -> dict:
+        """Convert book to dictionary"""
+        return {'id': self.id, 'name': self.name, 'author': self.author, 'copies': self.copies,
+                'copies_left': self.copies_left, 'price': self.price, 'isbn': self.isbn, 'version': self.version}
+
+
+def synthetic_rows(count: int) -> List[Tuple]:
+    """Deterministic catalog rows, strings built up front so they are not counted per layout"""
+    return [(i, f"Book Title {i}", f"Author {i % 5000}", 1 + i % 7, float(100 + i % 900), f"978{i:010d}")
+            for i in range(1, count + 1)]
+
+
+def measure(func: Callable):
+    """Run func under tracemalloc and return (result, retained bytes, peak bytes)"""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def legacy_save(path: str, books: dict):
+    """The previous save: a dict of dicts dumped with indent=2"""
+    data = {str(k): v.to_dict() for k, v in books.items()}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def memory_benchmark(count: int) -> dict:
+    """Compare per-book memory and save peak between the dict layout and the slotted layout"""
+    rows = synthetic_rows(count)
+    legacy, legacy_bytes, _ = measure(lambda: {row[0]: DictBook(*row) for row in rows})
+    slotted, slotted_bytes, _ = measure(lambda: {row[0]: Book(*row) for row in rows})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'book.json')
+        _, _, legacy_save_peak = measure(lambda: legacy_save(path, legacy))
+        _, _, stream_save_peak = measure(lambda: JsonStorage.write_records(path, ((k, v.to_json()) for k, v in slotted.items())))
+
+    return {
+        'books': count,
+        'dict_layout_bytes_per_book': legacy_bytes / count,
+        'slots_layout_bytes_per_book': slotted_bytes / count,
+        'legacy_save_peak_mb': legacy_save_peak / 1e6,
+        'streaming_save_peak_mb': stream_save_peak / 1e6,
+    }
+
+
+# Runs in a fresh interpreter so nothing is warm: time from constructing the manager to the first record read
+# and the first search. JSON storage builds the search index while loading and the binary snapshot on the first
+# search, so both formats pay for it
+COLD_START = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from app import LibraryManager
+started = time.perf_counter()
+library = LibraryManager(snapshot_format=sys.argv[2])
+name = library.books[int(sys.argv[3])].name
+assert library.find_books(name, 1)
+print(time.perf_counter() - started)
+"""
+
+
+def write_catalog(directory: str, count: int, snapshot_format: str, users: Optional[int] = None, storage: str = 'json'):
+    """Write a synthetic library with one member per ten books (unless given) and one loan per hundred books"""
+    now = datetime.datetime.now().replace(microsecond=0)
+    books = {row[0]: Book(*row) for row in synthetic_rows(count)}
+    members = {i: User(i, f"Member {i}", ('standard', 'standard', 'premium', 'staff')[i % 4])
+               for i in range(1, (users or max(1, count // 10)) + 1)}
+    loans = {i: Loan(i, 1 + i % len(members), i, now, now + datetime.timedelta(days=15))
+             for i in range(1, min(count // 100, len(members)) + 1)}
+    for loan in loans.values():
+        books[loan.book_id].copies_left -= 1
+    records = {'book': books, 'user': members, 'loan': loans}
+    if storage == 'sqlite':
+        database = SqliteStorage(os.path.join(directory, 'library.db'))
+        for kind, items in records.items():
+            database.put_many(kind, list(items.values()))
+        database.close()
+    elif snapshot_format == 'binary':
+        BinarySnapshot.write(os.path.join(directory, 'library.snap'),
+                             {kind: {k: v.to_bytes() for k, v in items.items()} for kind, items in records.items()})
+    else:
+        for kind, items in records.items():
+            JsonStorage.write_records(os.path.join(directory, f"{kind}.json"), ((k, v.to_json()) for k, v in items.items()))
+
+
+def startup_benchmark(counts: List[int], repeat: int) -> List[dict]:
+    """Cold-start time to the first search of the JSON files against the binary snapshot"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for count in counts:
+        result = {'books': count}
+        for snapshot_format in ('json', 'binary'):
+            with tempfile.TemporaryDirectory() as tmp:
+                write_catalog(tmp, count, snapshot_format)
+                timings = [float(subprocess.run([sys.executable, '-c', COLD_START, here, snapshot_format, str(count // 2)],
+                                                cwd=tmp, capture_output=True, text=True, check=True).stdout)
+                           for _ in range(repeat)]
+                result[f'{snapshot_format}_seconds'] = min(timings)
+        result['speedup'] = result['json_seconds'] / result['binary_seconds']
+        results.append(result)
+    return results
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency distribution of timed calls in milliseconds"""
+    if not samples:
+        return {'ops': 0}
+    ordered = sorted(samples)
+    
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    
+    return {'ops': len(ordered), 'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99), 'max_ms': ordered[-1] * 1000,
+            'mean_ms': sum(ordered) / len(ordered) * 1000}
+
+
+def timed(samples: List[float], func: Callable, *args):
+    """Call func and append its wall time to samples, circulation rule refusals still count"""
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    except LibraryError:
+        return None
+    finally:
+        samples.append(time.perf_counter() - started)
+
+
+def search_queries(count: int, books: int, seed: int) -> List[str]:
+    """A mix of exact titles, authors, misspelt authors and bare catalog numbers"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        i = rng.randint(1, books)
+        queries.append(rng.choice([f"Title {i}", f"Author {i % 5000}", f"Autor {i % 5000}", str(i)]))
+    return queries
+
+
+def suite_benchmark(books: int, users: Optional[int], ops: int, storage: str, journal: bool,
+                    snapshot_format: str, repeat: int, seed: int) -> dict:
+    """Drive load, search, browse, issue, collect and save on a synthetic library and time every call"""
+    rng = random.Random(seed)
+    results: Dict[str, dict] = {}
+    here = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_catalog(tmp, books, snapshot_format, users, storage)
+        # The manager keeps its files in the working directory
+        os.chdir(tmp)
+        try:
+            def open_library() -> LibraryManager:
+                return LibraryManager(storage=storage, journal_mode=journal, snapshot_format=snapshot_format)
+            
+            samples: List[float] = []
+            for _ in range(repeat):
+                timed(samples, open_library).close()
+            library, _, load_peak = measure(open_library)
+            results['load'] = {**percentiles(samples), 'peak_mb': load_peak / 1e6}
+            
+            samples = []
+            for query in search_queries(ops, books, seed):
+                timed(samples, library.find_books, query, 20)
+            results['search'] = percentiles(samples)
+            
+            samples, cursor = [], None
+            for _ in range(ops):
+                page = timed(samples, library.browse_books, 'name', cursor)
+                cursor = page[1] if page else None
+            results['browse'] = percentiles(samples)
+            
+            member_ids = list(library.users.keys())
+            issued, samples = [], []
+            for _ in range(ops):
+                user_id, book_id = rng.choice(member_ids), rng.randint(1, books)
+                if timed(samples, library.checkout, user_id, book_id):
+                    issued.append((user_id, book_id))
+            results['issue'] = percentiles(samples)
+            
+            samples = []
+            for user_id, book_id in issued:
+                timed(samples, library.checkin, user_id, book_id)
+            results['collect'] = percentiles(samples)
+            
+            if storage == 'json':
+                samples = []
+                for _ in range(repeat):
+                    timed(samples, library.storage.write_snapshot, library.storage.snapshot())
+                _, _, save_peak = measure(lambda: library.storage.write_snapshot(library.storage.snapshot()))
+                results['save'] = {**percentiles(samples), 'peak_mb': save_peak / 1e6}
+            library.close()
+        finally:
+            os.chdir(here)
+            
+    peak_rss_mb = None
+    if resource is not None:
+        # Linux reports kilobytes, macOS bytes
+        scale = 1 if sys.platform == 'darwin' else 1024
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    return {'results': results, 'peak_rss_mb': peak_rss_mb}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> Tuple[List[str], bool]:
+    """Table of every shared metric and whether any got worse by more than threshold percent"""
+    lines = []
+    differences = [f"{key} {baseline['config'].get(key)} -> {value}" for key, value in current['config'].items()
+                   if key not in ('label', 'python') and baseline['config'].get(key) != value]
+    if differences:
+        lines.append(f"Configurations differ: {', '.join(differences)}")
+    lines.append(f"{'Phase':<10} {'Metric':<10} {'Baseline':>12} {'Current':>12} {'Change':>9}")
+    regressed = False
+    for phase, metrics in current['results'].items():
+        before = baseline['results'].get(phase, {})
+        for metric in ('p50_ms', 'p99_ms', 'peak_mb'):
+            if metric not in metrics or not before.get(metric):
+                continue
+            change = (metrics[metric] - before[metric]) / before[metric] * 100
+            flag = " !" if change > threshold else ""
+            regressed = regressed or bool(flag)
+            lines.append(f"{phase:<10} {metric:<10} {before[metric]:>12.3f} {metrics[metric]:>12.3f} {change:>+8.1f}%{flag}")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library Management System benchmarks")
+    sub = parser.add_subparsers(dest='command', required=True)
+    memory = sub.add_parser('memory', help="memory footprint of the in-memory catalog and of saving it")
+    memory.add_argument('--books', type=int, default=100000)
+    memory.add_argument('--json', action='store_true', help="print machine-readable output")
+    startup = sub.add_parser('startup', help="cold-start time to the first search, JSON files against the binary snapshot")
+    startup.add_argument('--books', type=int, nargs='+', default=[10000, 100000, 1000000])
+    startup.add_argument('--repeat', type=int, default=3, help="runs per size, the fastest is reported")
+    startup.add_argument('--json', action='store_true', help="print machine-readable output")
+    generate = sub.add_parser('generate', help="write a synthetic library to a directory")
+    generate.add_argument('--books', type=int, default=100000)
+    generate.add_argument('--users', type=int, help="members to create (default: one per ten books)")
+    generate.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    generate.add_argument('--snapshot-format', choices=['json', 'binary'], default='json')
+    generate.add_argument('--dir', default='.', help="directory to write the library files to")
+    suite = sub.add_parser('suite', help="latency percentiles and memory peak of the main library operations")
+    suite.add_argument('--books', type=int, default=100000)
+    suite.add_argument('--users', type=int, help="members to create (default: one per ten books)")
+    suite.add_argument('--ops', type=int, default=500, help="calls per operation")
+    suite.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    suite.add_argument('--journal', action='store_true', help="run JSON storage in journal mode")
+    suite.add_argument('--snapshot-format', choices=['json', 'binary'], default='json')
+    suite.add_argument('--repeat', type=int, default=3, help="timed loads and full saves")
+    suite.add_argument('--seed', type=int, default=1)
+    suite.add_argument('--label', default='', help="name recorded with the results, e.g. a commit hash")
+    suite.add_argument('--output', help="also write the results as JSON to this file")
+    suite.add_argument('--json', action='store_true', help="print machine-readable output")
+    compare = sub.add_parser('compare', help="compare two suite result files")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=10, help="percent slowdown or growth reported as a regression")
+    args = parser.parse_args()
+
+    if args.command == 'memory':
+        result = memory_benchmark(args.books)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            for key, value in result.items():
+                print(f"{key:<30} {value:,.1f}" if isinstance(value, float) else f"{key:<30} {value:,}")
+    elif args.command == 'startup':
+        results = startup_benchmark(args.books, args.repeat)
+        if args.json:
+            print(json.dumps(results))
+        else:
+            print(f"{'Books':>10} {'JSON (s)':>10} {'Binary (s)':>11} {'Speedup':>8}")
+            for result in results:
+                print(f"{result['books']:>10,} {result['json_seconds']:>10.3f} {result['binary_seconds']:>11.4f} {result['speedup']:>7.0f}x")
+    elif args.command == 'generate':
+        os.makedirs(args.dir, exist_ok=True)
+        write_catalog(args.dir, args.books, args.snapshot_format, args.users, args.storage)
+        print(f"Wrote {args.books:,} books to {args.dir}")
+    elif args.command == 'suite':
+        config = {key: getattr(args, key) for key in ('books', 'users', 'ops', 'storage', 'journal', 'snapshot_format', 'repeat', 'seed', 'label')}
+        config['python'] = platform.python_version()
+        report = {'config': config, **suite_benchmark(args.books, args.users, args.ops, args.storage, args.journal,
+                                                      args.snapshot_format, args.repeat, args.seed)}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print(f"{'Operation':<10} {'Ops':>6} {'p50 (ms)':>10} {'p90 (ms)':>10} {'p99 (ms)':>10} {'Max (ms)':>10} {'Peak (MB)':>10}")
+            for phase, metrics in report['results'].items():
+                peak = f"{metrics['peak_mb']:>10.1f}" if 'peak_mb' in metrics else f"{'':>10}"
+                print(f"{phase:<10} {metrics['ops']:>6} {metrics.get('p50_ms', 0):>10.3f} {metrics.get('p90_ms', 0):>10.3f} "
+                      f"{metrics.get('p99_ms', 0):>10.3f} {metrics.get('max_ms', 0):>10.3f} {peak}")
+            if report['peak_rss_mb'] is not None:
+                print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        lines, regressed = compare_results(baseline, current, args.threshold)
+        print("\n".join(lines))
+        if regressed:
+            print(f"\nRegressions beyond {args.threshold:g}% are marked with !")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,818 @@
+"""In-memory indexes over the library records: loans, waitlists, overdue loans, rollups, search and paging"""
+
+import re
+import bisect
+import heapq
+import datetime
+from array import array
+from collections import defaultdict
+from collections.abc import MutableMapping
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Iterable, Tuple
+
+from records import Book, Loan, Reservation
+
+if TYPE_CHECKING:
+    # storage imports this module to index the books it writes into a binary snapshot
+    from storage import CirculationLog
+
+
+class LoanStore:
+    """Active loans indexed by ID, member, book and due date"""
+    
+    def __init__(self, loans: Optional[Dict[int, Loan]] = None):
+        # The loans dict is shared with the storage so full-file saves see every change
+        self.loans: Dict[int, Loan] = loans if loans is not None else {}
+        self.by_user: Dict[int, set] = defaultdict(set)
+        self.by_book: Dict[int, set] = defaultdict(set)
+        # Sorted (due timestamp, loan id) pairs so overdue queries are a bisect, not a scan
+        self.due_index: List[tuple] = []
+        self.next_id = 1
+        for loan in self.loans.values():
+            self.by_user[loan.user_id].add(loan.id)
+            self.by_book[loan.book_id].add(loan.id)
+            self.next_id = max(self.next_id, loan.id + 1)
+        self.due_index = sorted((loan.due_date.timestamp(), loan.id) for loan in self.loans.values())
+        
+    def __len__(self) -> int:
+        return len(self.loans)
+    
+    def __contains__(self, loan_id: int) -> bool:
+        return loan_id in self.loans
+    
+    def get(self, loan_id: int) -> Optional[Loan]:
+        """An active loan by ID"""
+        return self.loans.get(loan_id)
+    
+    def new_id(self) -> int:
+        """Reserve the next loan ID"""
+        loan_id = self.next_id
+        self.next_id += 1
+        return loan_id
+        
+    def add(self, loan: Loan):
+        """Record an active loan"""
+        self.loans[loan.id] = loan
+        self.by_user[loan.user_id].add(loan.id)
+        self.by_book[loan.book_id].add(loan.id)
+        bisect.insort(self.due_index, (loan.due_date.timestamp(), loan.id))
+        self.next_id = max(self.next_id, loan.id + 1)
+        
+    def remove(self, loan_id: int) -> Optional[Loan]:
+        """Close a loan and drop it from every index"""
+        loan = self.loans.pop(loan_id, None)
+        if loan is None:
+            return None
+        self._discard(self.by_user, loan.user_id, loan_id)
+        self._discard(self.by_book, loan.book_id, loan_id)
+        key = (loan.due_date.timestamp(), loan_id)
+        position = bisect.bisect_left(self.due_index, key)
+        if position < len(self.due_index) and self.due_index[position] == key:
+            del self.due_index[position]
+        return loan
+    
+    @staticmethod
+    def _discard(index: Dict[int, set], key: int, loan_id: int):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(loan_id)
+            if not ids:
+                del index[key]
+                
+    def for_user(self, user_id: int) -> List[Loan]:
+        """Loans held by a member, earliest due first"""
+        return sorted((self.loans[i] for i in self.by_user.get(user_id, ())), key=lambda loan: loan.due_date)
+    
+    def for_book(self, book_id: int) -> List[Loan]:
+        """Loans of every copy of a book that is out"""
+        return [self.loans[i] for i in self.by_book.get(book_id, ())]
+    
+    def copies_out(self, book_id: int) -> int:
+        """Number of copies of a book currently on loan"""
+        return len(self.by_book.get(book_id, ()))
+    
+    def count_for_user(self, user_id: int) -> int:
+        """Number of books a member currently holds"""
+        return len(self.by_user.get(user_id, ()))
+    
+    def next_due(self, user_id: int) -> float:
+        """Timestamp of a member's earliest due date, infinity when they hold nothing"""
+        return min((self.loans[i].due_date.timestamp() for i in self.by_user.get(user_id, ())), default=float('inf'))
+    
+    def find(self, user_id: int, book_id: int) -> Optional[Loan]:
+        """The loan of a book to a member, if any"""
+        ids = self.by_user.get(user_id, set()) & self.by_book.get(book_id, set())
+        return self.loans[min(ids)] if ids else None
+    
+    def overdue(self, as_of: datetime.datetime) -> List[Loan]:
+        """Loans whose due date is before the given time, most overdue first"""
+        end = bisect.bisect_left(self.due_index, (as_of.timestamp(),))
+        return [self.loans[loan_id] for _, loan_id in self.due_index[:end]]
+    
+    
+class ReservationQueue:
+    """Per-book waitlists as heaps keyed by member tier and request time, plus a heap of hold expiries.
+    Closed or allocated reservations stay in the heaps and are skipped when they reach the top."""
+    
+    def __init__(self, reservations: Optional[Dict[int, Reservation]] = None):
+        # Shared with the storage like the loans dict
+        self.reservations: Dict[int, Reservation] = reservations if reservations is not None else {}
+        self.waiting: Dict[int, List[tuple]] = defaultdict(list)
+        self.expiries: List[tuple] = []
+        self.by_user: Dict[int, set] = defaultdict(set)
+        self.by_book: Dict[int, set] = defaultdict(set)
+        self.next_id = 1
+        for reservation in list(self.reservations.values()):
+            self._index(reservation)
+            
+    def __len__(self) -> int:
+        return len(self.reservations)
+    
+    def __contains__(self, reservation_id: int) -> bool:
+        return reservation_id in self.reservations
+    
+    def get(self, reservation_id: int) -> Optional[Reservation]:
+        """An open reservation by ID"""
+        return self.reservations.get(reservation_id)
+    
+    def _index(self, reservation: Reservation):
+        """Push a reservation onto its waitlist, or onto the expiry heap once a copy is held"""
+        self.by_user[reservation.user_id].add(reservation.id)
+        self.by_book[reservation.book_id].add(reservation.id)
+        if reservation.hold_until is None:
+            heapq.heappush(self.waiting[reservation.book_id], reservation.priority())
+        else:
+            heapq.heappush(self.expiries, (reservation.hold_until.timestamp(), reservation.id))
+        self.next_id = max(self.next_id, reservation.id + 1)
+        
+    def new_id(self) -> int:
+        """Reserve the next reservation ID"""
+        reservation_id = self.next_id
+        self.next_id += 1
+        return reservation_id
+    
+    def add(self, reservation: Reservation):
+        """Record a new reservation or a changed one, O(log n)"""
+        self.reservations[reservation.id] = reservation
+        self._index(reservation)
+        
+    def remove(self, reservation_id: int) -> Optional[Reservation]:
+        """Close a reservation, its heap entries are dropped lazily"""
+        reservation = self.reservations.pop(reservation_id, None)
+        if reservation is not None:
+            ids = self.by_user.get(reservation.user_id)
+            if ids is not None:
+                ids.discard(reservation_id)
+                if not ids:
+                    del self.by_user[reservation.user_id]
+            ids = self.by_book.get(reservation.book_id)
+            if ids is not None:
+                ids.discard(reservation_id)
+                if not ids:
+                    # Whatever is left on the book's waitlist heap is closed
+                    del self.by_book[reservation.book_id]
+                    self.waiting.pop(reservation.book_id, None)
+        return reservation
+    
+    def _waiting(self, book_id: int, entry: tuple) -> Optional[Reservation]:
+        """The reservation a waitlist entry stands for, None once it was closed, allocated or its ID reused"""
+        reservation = self.reservations.get(entry[2])
+        if reservation is None or reservation.hold_until is not None:
+            return None
+        if reservation.book_id != book_id or reservation.priority() != entry:
+            return None
+        return reservation
+    
+    def head(self, book_id: int) -> Optional[Reservation]:
+        """The member next in line for a book, amortized O(log n)"""
+        heap = self.waiting.get(book_id)
+        while heap:
+            reservation = self._waiting(book_id, heap[0])
+            if reservation is not None:
+                return reservation
+            heapq.heappop(heap)
+        if heap is not None:
+            del self.waiting[book_id]
+        return None
+    
+    def next_expired(self, now: float) -> Optional[Reservation]:
+        """The earliest held copy whose hold ran out, without looking at holds still running"""
+        while self.expiries and self.expiries[0][0] <= now:
+            hold_until, reservation_id = self.expiries[0]
+            reservation = self.reservations.get(reservation_id)
+            if reservation is not None and reservation.hold_until and reservation.hold_until.timestamp() == hold_until:
+                return reservation
+            heapq.heappop(self.expiries)
+        return None
+    
+    def find(self, user_id: int, book_id: int) -> Optional[Reservation]:
+        """A member's reservation of a book, if any"""
+        for reservation_id in self.by_user.get(user_id, ()):
+            if self.reservations[reservation_id].book_id == book_id:
+                return self.reservations[reservation_id]
+        return None
+    
+    def for_user(self, user_id: int) -> List[Reservation]:
+        """A member's reservations, oldest first"""
+        return sorted((self.reservations[i] for i in self.by_user.get(user_id, ())), key=lambda r: r.requested)
+    
+    def waitlist(self, book_id: int) -> List[Reservation]:
+        """Members waiting for a book in the order copies will go to them"""
+        entries = sorted(set(self.waiting.get(book_id, ())))
+        reservations = (self._waiting(book_id, entry) for entry in entries)
+        return [reservation for reservation in reservations if reservation is not None]
+    
+    def for_book(self, book_id: int) -> List[Reservation]:
+        """A book's reservations, waiting or held, oldest first"""
+        return sorted((self.reservations[i] for i in self.by_book.get(book_id, ())), key=lambda r: r.requested)
+    
+    def held(self, book_id: int) -> List[Reservation]:
+        """Copies of a book currently held for members"""
+        return [r for r in self.for_book(book_id) if r.hold_until is not None]
+    
+    
+class OverdueEngine:
+    """Incremental overdue notices and fine accrual driven by a due-date heap"""
+    
+    DAY = 86400
+    
+    def __init__(self, loans: Iterable[Loan], fine_per_day: int, last_run: Optional[float] = None):
+        self.fine_per_day = fine_per_day
+        self.last_run = last_run
+        self.active: Dict[int, int] = {}
+        # Loans not yet reported overdue, popped in due order as their due date passes
+        self.pending: List[tuple] = []
+        # Aggregates over reported loans: due = day * DAY + second, so the sum of whole days
+        # late is count * today - sum(days) - (loans whose second of day is after now's)
+        self.overdue_days_sum = 0
+        self.overdue_seconds: List[int] = []
+        self.overdue_ids: set = set()
+        self.baseline_fines = 0
+        
+        for loan in loans:
+            due = int(loan.due_date.timestamp())
+            self.active[loan.id] = due
+            if last_run is not None and self.is_overdue(due, last_run):
+                self._mark_overdue(loan.id, due)
+            else:
+                self.pending.append((due, loan.id))
+        heapq.heapify(self.pending)
+        if last_run is not None:
+            self.baseline_fines = self.outstanding_fines(last_run)
+            
+    @staticmethod
+    def is_overdue(due: float, as_of: float) -> bool:
+        """A loan is overdue once its due second has passed, a loan due exactly at a run is reported by the next one"""
+        return due < as_of
+    
+    def _mark_overdue(self, loan_id: int, due: int):
+        """Add a loan to the overdue aggregates"""
+        self.overdue_ids.add(loan_id)
+        self.overdue_days_sum += due // self.DAY
+        bisect.insort(self.overdue_seconds, due % self.DAY)
+        
+    def _fine(self, due: int, as_of: float) -> int:
+        """Fine for one loan due at the given epoch second"""
+        return max(0, int((as_of - due) // self.DAY)) * self.fine_per_day
+        
+    def track(self, loan: Loan):
+        """Start watching a new loan"""
+        due = int(loan.due_date.timestamp())
+        self.active[loan.id] = due
+        heapq.heappush(self.pending, (due, loan.id))
+        
+    def untrack(self, loan: Loan):
+        """Stop watching a closed loan, its heap entry is skipped when popped"""
+        due = self.active.pop(loan.id, None)
+        if due is None or loan.id not in self.overdue_ids:
+            return
+        self.overdue_ids.discard(loan.id)
+        self.overdue_days_sum -= due // self.DAY
+        position = bisect.bisect_left(self.overdue_seconds, due % self.DAY)
+        del self.overdue_seconds[position]
+        if self.last_run is not None:
+            self.baseline_fines -= self._fine(due, self.last_run)
+            
+    def outstanding_fines(self, as_of: float) -> int:
+        """Fines owed on reported overdue loans at the given time"""
+        count = len(self.overdue_ids)
+        if not count:
+            return 0
+        now = int(as_of)
+        later_in_day = count - bisect.bisect_right(self.overdue_seconds, now % self.DAY)
+        days_late = count * (now // self.DAY) - self.overdue_days_sum - later_in_day
+        return days_late * self.fine_per_day
+    
+    def run(self, as_of: datetime.datetime) -> Tuple[List[int], int]:
+        """Report loans that fell overdue since the last run and the fines accrued meanwhile"""
+        now = as_of.timestamp()
+        notices = []
+        while self.pending and self.is_overdue(self.pending[0][0], now):
+            due, loan_id = heapq.heappop(self.pending)
+            if self.active.get(loan_id) != due or loan_id in self.overdue_ids:
+                continue
+            self._mark_overdue(loan_id, due)
+            notices.append(loan_id)
+            
+        total = self.outstanding_fines(now)
+        accrued = total - self.baseline_fines
+        self.baseline_fines = total
+        self.last_run = now
+        return notices, accrued
+    
+    
+class RankedCounter:
+    """Counts that only ever go up by one, grouped by count so the top k come out in O(k).
+    Non-empty counts form a circular linked list through the sentinel 0."""
+    
+    def __init__(self, counts: Optional[Dict] = None):
+        self.counts: Dict[object, int] = {}
+        # count -> keys with that count, a dict used as an insertion ordered set
+        self.buckets: Dict[int, dict] = {}
+        self.lower: Dict[int, int] = {0: 0}
+        self.higher: Dict[int, int] = {0: 0}
+        for key, count in sorted((counts or {}).items(), key=lambda item: item[1]):
+            if count not in self.buckets:
+                self._link(count, self.lower[0], 0)
+            self.buckets[count][key] = None
+            self.counts[key] = count
+            
+    def _link(self, count: int, below: int, above: int):
+        """Insert an empty bucket between two neighbouring counts"""
+        self.buckets[count] = {}
+        self.lower[count], self.higher[count] = below, above
+        self.higher[below] = count
+        self.lower[above] = count
+        
+    def _unlink(self, count: int):
+        """Drop an empty bucket from the list"""
+        below, above = self.lower.pop(count), self.higher.pop(count)
+        self.higher[below] = above
+        self.lower[above] = below
+        del self.buckets[count]
+        
+    def increment(self, key):
+        """Add one to a key in O(1)"""
+        count = self.counts.get(key, 0)
+        if count + 1 not in self.buckets:
+            self._link(count + 1, count, self.higher[count])
+        self.buckets[count + 1][key] = None
+        self.counts[key] = count + 1
+        if count:
+            del self.buckets[count][key]
+            if not self.buckets[count]:
+                self._unlink(count)
+                
+    def top(self, limit: int) -> List[Tuple[object, int]]:
+        """The highest counts, ties in the order they reached that count"""
+        result = []
+        count = self.lower[0]
+        while count and len(result) < limit:
+            for key in self.buckets[count]:
+                result.append((key, count))
+                if len(result) == limit:
+                    break
+            count = self.lower[count]
+        return result
+    
+    def get(self, key) -> int:
+        """Current count of a key"""
+        return self.counts.get(key, 0)
+
+
+class CirculationStats:
+    """Rollups over the circulation log, updated incrementally from the last offset read"""
+    
+    def __init__(self, state: Optional[dict] = None):
+        state = state or {}
+        self.offset = state.get('offset', 0)
+        self.titles = RankedCounter({int(k): v for k, v in state.get('titles', {}).items()})
+        self.titles_by_year = {int(year): RankedCounter({int(k): v for k, v in counts.items()})
+                               for year, counts in state.get('titles_by_year', {}).items()}
+        self.authors = RankedCounter(state.get('authors'))
+        self.borrows_by_month: Dict[str, int] = state.get('borrows_by_month', {})
+        self.fines_by_month: Dict[str, int] = state.get('fines_by_month', {})
+        self.fines_total = state.get('fines_total', 0)
+        self.unsaved = 0
+        
+    def apply(self, event: dict):
+        """Fold one event into the rollups"""
+        when = datetime.datetime.fromtimestamp(event['time'])
+        month = when.strftime("%Y-%m")
+        if event['event'] == 'issue':
+            self.titles.increment(event['book_id'])
+            self.titles_by_year.setdefault(when.year, RankedCounter()).increment(event['book_id'])
+            self.authors.increment(event['author'])
+            self.borrows_by_month[month] = self.borrows_by_month.get(month, 0) + 1
+        elif event['event'] == 'return' and event.get('fine'):
+            self.fines_by_month[month] = self.fines_by_month.get(month, 0) + event['fine']
+            self.fines_total += event['fine']
+            
+    def refresh(self, log: 'CirculationLog') -> int:
+        """Apply events appended since the last refresh, from any desk, and return how many"""
+        applied = 0
+        for event, offset in log.read_from(self.offset):
+            self.apply(event)
+            self.offset = offset
+            applied += 1
+        self.unsaved += applied
+        return applied
+    
+    def to_dict(self) -> dict:
+        """Rollups and the log offset they cover, for the state store"""
+        return {
+            'offset': self.offset,
+            'titles': self.titles.counts,
+            'titles_by_year': {year: counter.counts for year, counter in self.titles_by_year.items()},
+            'authors': self.authors.counts,
+            'borrows_by_month': self.borrows_by_month,
+            'fines_by_month': self.fines_by_month,
+            'fines_total': self.fines_total,
+        }
+    
+    
+class MappedSets(MutableMapping):
+    """Sets saved in a snapshot table, decoded the first time a key is reached and kept in memory after.
+    Like a defaultdict, reading a key that is not stored starts it as an empty set."""
+
+    def __init__(self, table, decode: Callable):
+        self.table = table
+        self.decode = decode
+        self._cache: Dict[str, set] = {}
+        self._deleted: set = set()
+
+    def __getitem__(self, key: str) -> set:
+        if key in self._cache:
+            return self._cache[key]
+        value = None if key in self._deleted else self.table.get(key)
+        items = set() if value is None else self.decode(value)
+        self[key] = items
+        return items
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key: str, items: set):
+        self._cache[key] = items
+        self._deleted.discard(key)
+
+    def __delitem__(self, key: str):
+        self._cache.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key) -> bool:
+        if key in self._cache:
+            return True
+        return key not in self._deleted and self.table.get(key) is not None
+
+    def __iter__(self):
+        for key, _ in self.table.items():
+            if key not in self._cache and key not in self._deleted:
+                yield key
+        yield from list(self._cache)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class BookSearchIndex:
+    """Token postings and trigram index over book titles and authors"""
+    
+    NAME_WEIGHT = 2.0
+    AUTHOR_WEIGHT = 1.0
+    FUZZY_THRESHOLD = 0.4
+    # Query tokens are matched rarest first. Once this many books are candidates, or the next token is in more
+    # than COMMON_SHARE of the catalog, the remaining tokens only add to the scores of books already found
+    MAX_CANDIDATES = 5000
+    COMMON_SHARE = 0.05
+    
+    def __init__(self):
+        self.name_postings: Dict[str, set] = defaultdict(set)
+        self.author_postings: Dict[str, set] = defaultdict(set)
+        # Trigrams map to distinct tokens, not books, so fuzzy lookups scale with the vocabulary
+        self.trigrams: Dict[str, set] = defaultdict(set)
+        self.entries: Dict[int, tuple] = {}
+        self.size = 0
+        self.built = False
+        
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Split text into lowercase alphanumeric tokens"""
+        return re.findall(r"[a-z0-9]+", text.lower())
+    
+    @staticmethod
+    def trigrams_of(token: str) -> set:
+        """Padded character trigrams of a token"""
+        padded = f"  {token} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    @classmethod
+    def entry(cls, name: str, author: str) -> tuple:
+        """What the index keeps per book: its title tokens, author tokens and lowercase title"""
+        return set(cls.tokenize(name)), set(cls.tokenize(author)), name.lower()
+    
+    @classmethod
+    def decode_entry(cls, payload) -> tuple:
+        """The entry of a binary snapshot book record, read without building the book"""
+        return cls.entry(*Book.text_from_bytes(payload))
+    
+    def rebuild(self, books: Iterable[Book]):
+        """Index a whole catalog from scratch"""
+        self.name_postings = defaultdict(set)
+        self.author_postings = defaultdict(set)
+        self.trigrams = defaultdict(set)
+        self.entries = {}
+        self.size = 0
+        for book in books:
+            self.add(book)
+        self.built = True
+        
+    def open(self, tables: dict, entries: MutableMapping):
+        """Start from the index saved with a binary snapshot. Postings and trigrams are decoded per token as
+        searches reach them and entries per book, so opening reads nothing up front"""
+        self.name_postings = MappedSets(tables['name'], self.decode_ids)
+        self.author_postings = MappedSets(tables['author'], self.decode_ids)
+        self.trigrams = MappedSets(tables['trigram'], self.decode_tokens)
+        self.entries = entries
+        self.size = len(entries)
+        self.built = True
+            
+    def add(self, book: Book):
+        """Index a book, replacing any previous entry for its ID"""
+        self.remove(book.id)
+        name_tokens, author_tokens, name = self.entry(book.name, book.author)
+        for token in name_tokens:
+            self._add_token(self.name_postings, token, book.id)
+        for token in author_tokens:
+            self._add_token(self.author_postings, token, book.id)
+        self.entries[book.id] = (name_tokens, author_tokens, name)
+        self.size += 1
+        
+    def remove(self, book_id: int):
+        """Drop a book from the index"""
+        entry = self.entries.pop(book_id, None)
+        if entry is None:
+            return
+        self.size -= 1
+        name_tokens, author_tokens, _ = entry
+        for token in name_tokens:
+            self._remove_token(self.name_postings, token, book_id)
+        for token in author_tokens:
+            self._remove_token(self.author_postings, token, book_id)
+            
+    def _add_token(self, postings: Dict[str, set], token: str, book_id: int):
+        if token not in self.name_postings and token not in self.author_postings:
+            for trigram in self.trigrams_of(token):
+                self.trigrams[trigram].add(token)
+        postings[token].add(book_id)
+        
+    def _remove_token(self, postings: Dict[str, set], token: str, book_id: int):
+        ids = postings.get(token)
+        if ids is None:
+            return
+        ids.discard(book_id)
+        if ids:
+            return
+        del postings[token]
+        if token in self.name_postings or token in self.author_postings:
+            return
+        for trigram in self.trigrams_of(token):
+            tokens = self.trigrams.get(trigram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.trigrams[trigram]
+                    
+    def _matching_tokens(self, query_token: str) -> Dict[str, float]:
+        """Indexed tokens similar to a query token with their match score"""
+        query_trigrams = self.trigrams_of(query_token)
+        overlap: Dict[str, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for token in self.trigrams.get(trigram, ()):
+                overlap[token] += 1
+                
+        matches = {}
+        for token, shared in overlap.items():
+            if token == query_token:
+                matches[token] = 1.0
+            elif query_token in token:
+                matches[token] = 0.8
+            elif shared < self.FUZZY_THRESHOLD * len(query_trigrams):
+                # The similarity is at most shared / len(query_trigrams), too low before counting the token's trigrams
+                continue
+            else:
+                similarity = shared / (len(query_trigrams) + len(self.trigrams_of(token)) - shared)
+                if similarity >= self.FUZZY_THRESHOLD:
+                    matches[token] = similarity * 0.6
+        return matches
+    
+    def _weighted_postings(self, matches: Dict[str, float]) -> List[Tuple[float, set]]:
+        """(score, book IDs) for every field a query token's matches are indexed in, best score first"""
+        weighted = []
+        for token, score in matches.items():
+            for postings, weight in ((self.name_postings, self.NAME_WEIGHT), (self.author_postings, self.AUTHOR_WEIGHT)):
+                ids = postings.get(token)
+                if ids:
+                    weighted.append((score * weight, ids))
+        weighted.sort(key=lambda item: -item[0])
+        return weighted
+    
+    def search(self, query: str, limit: int = 50) -> List[int]:
+        """Return book IDs ranked by how well they match the query"""
+        query_tokens = self.tokenize(query)
+        if not query_tokens:
+            return []
+        
+        matched = []
+        for query_token in query_tokens:
+            matches = self._matching_tokens(query_token)
+            weighted = self._weighted_postings(matches)
+            matched.append((sum(len(ids) for _, ids in weighted), matches, weighted))
+        matched.sort(key=lambda item: item[0])
+        
+        scores: Dict[int, float] = defaultdict(float)
+        common = self.COMMON_SHARE * self.size
+        for reach, matches, weighted in matched:
+            candidates_only = len(scores) >= limit and (len(scores) >= self.MAX_CANDIDATES or reach > common)
+            if candidates_only and reach > 4 * len(scores):
+                # Far fewer candidates than postings: score them through their own tokens
+                for book_id in scores:
+                    name_tokens, author_tokens, _ = self.entries[book_id]
+                    best = 0.0
+                    for token in name_tokens:
+                        best = max(best, matches.get(token, 0.0) * self.NAME_WEIGHT)
+                    for token in author_tokens:
+                        best = max(best, matches.get(token, 0.0) * self.AUTHOR_WEIGHT)
+                    scores[book_id] += best
+                continue
+            # Best match first, so each book keeps the first score it is given
+            token_scores: Dict[int, float] = {}
+            for score, ids in weighted:
+                for book_id in ids:
+                    if book_id not in token_scores and (not candidates_only or book_id in scores):
+                        token_scores[book_id] = score
+            for book_id, score in token_scores.items():
+                scores[book_id] += score
+                
+        # The whole phrase appearing in the title is the strongest signal
+        phrase = query.strip().lower()
+        for book_id in scores:
+            if phrase in self.entries[book_id][2]:
+                scores[book_id] += self.NAME_WEIGHT * len(query_tokens)
+                
+        return heapq.nsmallest(limit, scores, key=lambda book_id: (-scores[book_id], self.entries[book_id][2], book_id))
+
+    # A binary snapshot saves the index as sorted tables: each token to the IDs of the books with it in their
+    # title or author, and each trigram to the tokens that contain it
+    TABLES = ('name', 'author', 'trigram')
+
+    @staticmethod
+    def encode_ids(ids: Iterable[int]) -> bytes:
+        return array('q', sorted(ids)).tobytes()
+
+    @staticmethod
+    def decode_ids(value) -> set:
+        return set(memoryview(value).cast('q'))
+
+    @staticmethod
+    def encode_tokens(tokens: Iterable[str]) -> bytes:
+        # Tokens are lowercase ASCII letters and digits, so a space separates them
+        return ' '.join(sorted(tokens)).encode('ascii')
+
+    @staticmethod
+    def decode_tokens(value) -> set:
+        return set(str(value, 'ascii').split())
+
+    @classmethod
+    def tables(cls, books: Dict[int, bytes]) -> Dict[str, dict]:
+        """Index a whole catalog of binary snapshot book records for the snapshot, without building the books"""
+        postings = {'name': defaultdict(list), 'author': defaultdict(list)}
+        for book_id, payload in books.items():
+            for field, text in zip(('name', 'author'), Book.text_from_bytes(payload)):
+                for token in set(cls.tokenize(text)):
+                    postings[field][token].append(book_id)
+        trigrams = defaultdict(list)
+        for token in postings['name'].keys() | postings['author'].keys():
+            for trigram in cls.trigrams_of(token):
+                trigrams[trigram].append(token)
+        tables = {field: {token: cls.encode_ids(ids) for token, ids in tokens.items()} for field, tokens in postings.items()}
+        tables['trigram'] = {trigram: cls.encode_tokens(tokens) for trigram, tokens in trigrams.items()}
+        return tables
+
+    @classmethod
+    def updated_tables(cls, base: dict, stored_book: Callable, books: Dict[int, bytes], changed: Iterable[int]) -> dict:
+        """The tables saved with an earlier snapshot brought up to date with the books changed since it was
+        written. stored_book gives a book's record in that snapshot. A table nothing changed in is returned as
+        it is, so it is copied across without decoding"""
+        added = {'name': defaultdict(set), 'author': defaultdict(set)}
+        removed = {'name': defaultdict(set), 'author': defaultdict(set)}
+        for book_id in changed:
+            before, after = stored_book(book_id), books.get(book_id)
+            old = Book.text_from_bytes(before) if before is not None else ('', '')
+            new = Book.text_from_bytes(after) if after is not None else ('', '')
+            for field, old_text, new_text in zip(('name', 'author'), old, new):
+                if old_text == new_text:
+                    continue
+                old_tokens, new_tokens = set(cls.tokenize(old_text)), set(cls.tokenize(new_text))
+                for token in old_tokens - new_tokens:
+                    removed[field][token].add(book_id)
+                for token in new_tokens - old_tokens:
+                    added[field][token].add(book_id)
+
+        tables = dict(base)
+        touched = set()
+        for field in ('name', 'author'):
+            tokens = added[field].keys() | removed[field].keys()
+            if not tokens:
+                continue
+            items = dict(base[field].items())
+            for token in tokens:
+                value = items.get(token)
+                ids = cls.decode_ids(value) if value is not None else set()
+                ids = (ids - removed[field].get(token, set())) | added[field].get(token, set())
+                if ids:
+                    items[token] = cls.encode_ids(ids)
+                else:
+                    items.pop(token, None)
+            tables[field] = items
+            touched |= tokens
+
+        # Tokens no book has any more leave the trigram table, tokens new to the catalog join it
+        trigram_tokens: Dict[str, set] = {}
+        for token in touched:
+            was = base['name'].get(token) is not None or base['author'].get(token) is not None
+            now = tables['name'].get(token) is not None or tables['author'].get(token) is not None
+            if was == now:
+                continue
+            for trigram in cls.trigrams_of(token):
+                if trigram not in trigram_tokens:
+                    value = base['trigram'].get(trigram)
+                    trigram_tokens[trigram] = cls.decode_tokens(value) if value is not None else set()
+                if now:
+                    trigram_tokens[trigram].add(token)
+                else:
+                    trigram_tokens[trigram].discard(token)
+        if trigram_tokens:
+            items = dict(base['trigram'].items())
+            for trigram, tokens in trigram_tokens.items():
+                if tokens:
+                    items[trigram] = cls.encode_tokens(tokens)
+                else:
+                    items.pop(trigram, None)
+            tables['trigram'] = items
+        return tables
+
+
+class SortedIndex:
+    """Record IDs kept in several sort orders as sorted (key, id) lists, so a page is a bisect and a slice.
+    A cursor is the entry of the last row shown, it keeps its place while records are added or removed."""
+    
+    def __init__(self, orders: Dict[str, Callable]):
+        self.orders = orders
+        self.entries: Dict[str, List[tuple]] = {order: [] for order in orders}
+        self.keys: Dict[str, Dict[int, tuple]] = {order: {} for order in orders}
+        self.built = False
+        
+    def rebuild(self, records: Iterable):
+        """Sort a whole record set from scratch"""
+        records = list(records)
+        for order, key in self.orders.items():
+            self.keys[order] = {record.id: (key(record), record.id) for record in records}
+            self.entries[order] = sorted(self.keys[order].values())
+        self.built = True
+        
+    def add(self, record):
+        """Place a new or changed record in every order, nothing to do before the first rebuild"""
+        if not self.built:
+            return
+        for order, key in self.orders.items():
+            entry = (key(record), record.id)
+            previous = self.keys[order].get(record.id)
+            if previous == entry:
+                continue
+            if previous is not None:
+                self._drop(order, previous)
+            self.keys[order][record.id] = entry
+            bisect.insort(self.entries[order], entry)
+            
+    def remove(self, record_id: int):
+        """Drop a record from every order"""
+        if not self.built:
+            return
+        for order in self.orders:
+            previous = self.keys[order].pop(record_id, None)
+            if previous is not None:
+                self._drop(order, previous)
+                
+    def _drop(self, order: str, entry: tuple):
+        entries = self.entries[order]
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+            
+    def page(self, order: str, after: Optional[tuple] = None, limit: int = 20) -> Tuple[List[int], Optional[tuple]]:
+        """IDs of up to limit records following a cursor, and the cursor of the next page (None on the last)"""
+        entries = self.entries[order]
+        start = 0 if after is None else bisect.bisect_right(entries, after)
+        rows = entries[start:start + limit]
+        more = start + limit < len(entries)
+        return [record_id for _, record_id in rows], rows[-1] if rows and more else None
@@ -0,0 +1,269 @@
+"""Library records and their JSON and binary encodings"""
+
+import struct
+import datetime
+from json.encoder import encode_basestring_ascii as json_string
+from typing import Optional, Tuple
+
+
+class LibraryError(Exception):
+    """A circulation rule was violated"""
+    
+    
+class VersionConflict(Exception):
+    """Another process changed a record after we read it"""
+    
+    
+class BookUnavailable(LibraryError):
+    """Every copy of a book is out or held, the member can join the waitlist"""
+    
+    
+def json_optional(value: Optional[str]) -> str:
+    """JSON text for an optional string field"""
+    return 'null' if value is None else json_string(value)
+
+
+TEXT_LENGTH = struct.Struct('<I')
+NO_TEXT = 0xFFFFFFFF
+
+
+def pack_text(value: Optional[str]) -> bytes:
+    """Length-prefixed UTF-8 for the binary snapshot, None has its own marker"""
+    if value is None:
+        return TEXT_LENGTH.pack(NO_TEXT)
+    data = value.encode('utf-8')
+    return TEXT_LENGTH.pack(len(data)) + data
+
+
+def unpack_text(buffer, offset: int) -> Tuple[Optional[str], int]:
+    """Read a length-prefixed string and return it with the offset after it"""
+    (length,) = TEXT_LENGTH.unpack_from(buffer, offset)
+    offset += TEXT_LENGTH.size
+    if length == NO_TEXT:
+        return None, offset
+    return str(buffer[offset:offset + length], 'utf-8'), offset + length
+
+
+class Book: 
+    # Slots drop the per-instance __dict__, which dominates memory on large catalogs
+    __slots__ = ('id', 'name', 'author', 'copies', 'copies_left', 'price', 'isbn', 'version')
+    
+    KIND = 'book'
+    # id, copies, copies_left, price, version, followed by name, author and isbn
+    BINARY = struct.Struct('<qqqdq')
+    
+    def __init__(self, book_id:int, name:str, author:str, copies:int, price:float, isbn:Optional[str] = None):
+        self.id = book_id
+        self.name = name
+        self.author = author
+        self.copies = copies
+        self.copies_left = copies
+        self.price = price
+        self.isbn = isbn
+        self.version = 0
+        
+    def to_dict(self):
+        return{
+            'id': self.id, 
+            'name': self.name, 
+            'author': self.author, 
+            'copies': self.copies, 
+            'copies_left': self.copies_left, 
+            'price': self.price,
+            'isbn': self.isbn,
+            'version': self.version
+            
+        }
+    
+    def to_json(self) -> str:
+        """Compact JSON written straight from the attributes, no intermediate dict"""
+        return (f'{{"id":{self.id},"name":{json_string(self.name)},"author":{json_string(self.author)},'
+                f'"copies":{self.copies},"copies_left":{self.copies_left},"price":{float(self.price)!r},'
+                f'"isbn":{json_optional(self.isbn)},"version":{self.version}}}')
+    
+    def to_bytes(self) -> bytes:
+        """Binary snapshot record"""
+        return (self.BINARY.pack(self.id, self.copies, self.copies_left, float(self.price), self.version)
+                + pack_text(self.name) + pack_text(self.author) + pack_text(self.isbn))
+    
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Decode a binary snapshot record"""
+        book_id, copies, copies_left, price, version = cls.BINARY.unpack_from(buffer, 0)
+        name, offset = unpack_text(buffer, cls.BINARY.size)
+        author, offset = unpack_text(buffer, offset)
+        isbn, _ = unpack_text(buffer, offset)
+        book = cls(book_id, name, author, copies, price, isbn)
+        book.copies_left = copies_left
+        book.version = version
+        return book
+
+    @classmethod
+    def text_from_bytes(cls, buffer) -> Tuple[str, str]:
+        """Only the name and author of a binary snapshot record, for indexing without building the book"""
+        name, offset = unpack_text(buffer, cls.BINARY.size)
+        author, _ = unpack_text(buffer, offset)
+        return name or '', author or ''
+
+    @classmethod
+    def from_dict(cls, data):
+        book = cls(data['id'], data['name'], data['author'], data['copies'], data['price'], data.get('isbn'))
+        book.copies_left = data['copies_left']
+        book.version = data.get('version', 0)
+        return book
+    
+# Waitlist priority: lower ranks are served first, then earlier requests
+MEMBER_TIERS = {'staff': 0, 'premium': 1, 'standard': 2}
+
+
+class User:
+    __slots__ = ('id', 'name', 'tier')
+    
+    KIND = 'user'
+    BINARY = struct.Struct('<q')
+    
+    def __init__(self, user_id:int, name:str, tier:str = 'standard'):
+        self.id = user_id
+        self.name = name 
+        self.tier = tier
+        
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'tier': self.tier
+        }
+    
+    def to_json(self) -> str:
+        """Compact JSON written straight from the attributes, no intermediate dict"""
+        return f'{{"id":{self.id},"name":{json_string(self.name)},"tier":{json_string(self.tier)}}}'
+    
+    def to_bytes(self) -> bytes:
+        """Binary snapshot record"""
+        return self.BINARY.pack(self.id) + pack_text(self.name) + pack_text(self.tier)
+    
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Decode a binary snapshot record"""
+        (user_id,) = cls.BINARY.unpack_from(buffer, 0)
+        name, offset = unpack_text(buffer, cls.BINARY.size)
+        # Snapshots written before tiers existed end after the name
+        tier = unpack_text(buffer, offset)[0] if offset < len(buffer) else 'standard'
+        return cls(user_id, name, tier)
+
+        
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['name'], data.get('tier', 'standard'))
+
+    
+class Loan:
+    __slots__ = ('id', 'user_id', 'book_id', 'issue_date', 'due_date')
+    
+    KIND = 'loan'
+    # id, user_id, book_id, then issue and due dates as epoch seconds
+    BINARY = struct.Struct('<qqqqq')
+    
+    def __init__(self, loan_id:int, user_id:int, book_id:int, issue_date:datetime.datetime, due_date:datetime.datetime):
+        self.id = loan_id
+        self.user_id = user_id
+        self.book_id = book_id
+        self.issue_date = issue_date
+        self.due_date = due_date
+        
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'book_id': self.book_id,
+            'issue_date': self.issue_date.strftime("%d-%m-%Y %H:%M:%S"),
+            'due_date': self.due_date.strftime("%d-%m-%Y %H:%M:%S")
+        }
+    
+    def to_json(self) -> str:
+        """Compact JSON written straight from the attributes, no intermediate dict"""
+        return (f'{{"id":{self.id},"user_id":{self.user_id},"book_id":{self.book_id},'
+                f'"issue_date":"{self.issue_date.strftime("%d-%m-%Y %H:%M:%S")}",'
+                f'"due_date":"{self.due_date.strftime("%d-%m-%Y %H:%M:%S")}"}}')
+    
+    def to_bytes(self) -> bytes:
+        """Binary snapshot record"""
+        return self.BINARY.pack(self.id, self.user_id, self.book_id,
+                                int(self.issue_date.timestamp()), int(self.due_date.timestamp()))
+    
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Decode a binary snapshot record"""
+        loan_id, user_id, book_id, issued, due = cls.BINARY.unpack_from(buffer, 0)
+        return cls(loan_id, user_id, book_id, datetime.datetime.fromtimestamp(issued), datetime.datetime.fromtimestamp(due))
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['user_id'], data['book_id'],
+                   datetime.datetime.strptime(data['issue_date'], "%d-%m-%Y %H:%M:%S"),
+                   datetime.datetime.strptime(data['due_date'], "%d-%m-%Y %H:%M:%S"))
+    
+    
+class Reservation:
+    """A member's place in a book's waitlist, or a copy held for them once hold_until is set"""
+    
+    __slots__ = ('id', 'user_id', 'book_id', 'requested', 'tier', 'hold_until')
+    
+    KIND = 'hold'
+    # id, user_id, book_id, requested and hold_until as epoch seconds (-1 while waiting), followed by the tier
+    BINARY = struct.Struct('<qqqqq')
+    
+    def __init__(self, reservation_id:int, user_id:int, book_id:int, requested:datetime.datetime, tier:str = 'standard',
+                 hold_until:Optional[datetime.datetime] = None):
+        self.id = reservation_id
+        self.user_id = user_id
+        self.book_id = book_id
+        self.requested = requested
+        self.tier = tier
+        self.hold_until = hold_until
+        
+    def priority(self) -> tuple:
+        """Waitlist order: member tier, then request time"""
+        return (MEMBER_TIERS.get(self.tier, len(MEMBER_TIERS)), self.requested.timestamp(), self.id)
+    
+    def held_until(self, hold_until: datetime.datetime) -> 'Reservation':
+        """Copy of this reservation with a copy held for the member"""
+        return Reservation(self.id, self.user_id, self.book_id, self.requested, self.tier, hold_until)
+        
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'book_id': self.book_id,
+            'requested': self.requested.strftime("%d-%m-%Y %H:%M:%S"),
+            'tier': self.tier,
+            'hold_until': self.hold_until.strftime("%d-%m-%Y %H:%M:%S") if self.hold_until else None
+        }
+    
+    def to_json(self) -> str:
+        """Compact JSON written straight from the attributes, no intermediate dict"""
+        hold_until = f'"{self.hold_until.strftime("%d-%m-%Y %H:%M:%S")}"' if self.hold_until else 'null'
+        return (f'{{"id":{self.id},"user_id":{self.user_id},"book_id":{self.book_id},'
+                f'"requested":"{self.requested.strftime("%d-%m-%Y %H:%M:%S")}","tier":{json_string(self.tier)},'
+                f'"hold_until":{hold_until}}}')
+    
+    def to_bytes(self) -> bytes:
+        """Binary snapshot record"""
+        hold_until = int(self.hold_until.timestamp()) if self.hold_until else -1
+        return (self.BINARY.pack(self.id, self.user_id, self.book_id, int(self.requested.timestamp()), hold_until)
+                + pack_text(self.tier))
+    
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Decode a binary snapshot record"""
+        reservation_id, user_id, book_id, requested, hold_until = cls.BINARY.unpack_from(buffer, 0)
+        return cls(reservation_id, user_id, book_id, datetime.datetime.fromtimestamp(requested),
+                   unpack_text(buffer, cls.BINARY.size)[0],
+                   datetime.datetime.fromtimestamp(hold_until) if hold_until >= 0 else None)
+    
+    @classmethod
+    def from_dict(cls, data):
+        hold_until = data.get('hold_until')
+        return cls(data['id'], data['user_id'], data['book_id'],
+                   datetime.datetime.strptime(data['requested'], "%d-%m-%Y %H:%M:%S"), data.get('tier', 'standard'),
+                   datetime.datetime.strptime(hold_until, "%d-%m-%Y %H:%M:%S") if hold_until else None)
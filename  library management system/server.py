@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+HTTP service for the Library Management System
+
+    python server.py --port 8080 [--storage sqlite] [--snapshot-format binary]
+
+    GET  /books?q=potter&limit=20    ranked catalog search
+    GET  /users/<id>                 member details, current loans and reservations
+    POST /issue    {"user_id": 1, "book_id": 2}
+    POST /collect  {"user_id": 1, "book_id": 2}
+    POST /reserve  {"user_id": 1, "book_id": 2}
+"""
+
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from app import CirculationLog, LibraryError, LibraryManager
+
+
+class QueuedStorage:
+    """Storage wrapper that hands writes to a background thread, so callers never wait on disk"""
+
+    WRITES = ('put', 'put_many', 'delete', 'save_state')
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.writes: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self.persist, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name: str):
+        if name in self.WRITES:
+            return lambda *args: self.writes.put((getattr(self.storage, name), args))
+        return getattr(self.storage, name)
+
+    def queue(self, write: Callable, *args):
+        """Queue any other disk write, it runs in order with the storage writes"""
+        self.writes.put((write, args))
+
+    def persist(self):
+        """Apply queued writes in order until the stop marker arrives"""
+        while True:
+            write, args = self.writes.get()
+            try:
+                if write is None:
+                    return
+                write(*args)
+            except Exception as e:
+                print(f"Error persisting {write.__name__}: {e}")
+            finally:
+                self.writes.task_done()
+
+    def flush(self):
+        """Block until every queued write has reached the storage"""
+        self.writes.join()
+
+    def close(self):
+        """Finish the queued writes and close the storage"""
+        self.writes.put((None, ()))
+        self.thread.join()
+        self.storage.close()
+
+
+class QueuedCirculationLog:
+    """Circulation log whose appends go to the storage writer thread. Events are kept in memory until they are
+    written, so reads never wait for the queue"""
+
+    def __init__(self, log: CirculationLog, storage: QueuedStorage):
+        self.log = log
+        self.storage = storage
+        self.lock = threading.Lock()
+        # The service is the only writer, so the offset each queued line will end at is known up front
+        self.end = os.path.getsize(log.path) if os.path.exists(log.path) else 0
+        self.unwritten: Deque[Tuple[dict, int, int]] = deque()
+
+    def __getattr__(self, name: str):
+        return getattr(self.log, name)
+
+    def append(self, event: dict):
+        with self.lock:
+            start, self.end = self.end, self.end + len(CirculationLog.encode(event))
+            self.unwritten.append((event, start, self.end))
+        self.storage.queue(self.write, event)
+
+    def write(self, event: dict):
+        """Runs on the storage writer thread"""
+        try:
+            self.log.append(event)
+        finally:
+            with self.lock:
+                self.unwritten.popleft()
+
+    def read_from(self, offset: int) -> Iterable[Tuple[dict, int]]:
+        """(event, offset after it) past an offset: the file up to the first unwritten event, then the queue"""
+        with self.lock:
+            unwritten = list(self.unwritten)
+            written_end = unwritten[0][1] if unwritten else self.end
+        if offset < written_end:
+            for event, end in self.log.read_from(offset):
+                if end > written_end:
+                    break
+                yield event, end
+        for event, start, end in unwritten:
+            if start >= offset:
+                yield event, end
+
+
+class LibraryService:
+    """In-memory library shared by the HTTP threads: reads run directly, mutations go through one writer"""
+
+    def __init__(self, library: LibraryManager):
+        self.library = library
+        if library.storage.lazy:
+            # Database-backed maps read rows on demand, the service keeps every record resident instead
+            library.books, library.users = dict(library.books.items()), dict(library.users.items())
+        if not library.search_index.built:
+            library.search_index.rebuild(library.books.values())
+        library.storage = QueuedStorage(library.storage)
+        library.circulation_log = QueuedCirculationLog(library.circulation_log, library.storage)
+
+        # Held only while touching memory, never across disk I/O
+        self.state_lock = threading.Lock()
+        self.mutations: queue.Queue = queue.Queue()
+        self.writer = threading.Thread(target=self.apply_mutations, daemon=True)
+        self.writer.start()
+
+    def apply_mutations(self):
+        """Single writer: run queued mutations one at a time and resolve their futures"""
+        while True:
+            func, args, future = self.mutations.get()
+            if func is None:
+                return
+            try:
+                with self.state_lock:
+                    result = func(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, func: Callable, *args) -> Future:
+        """Queue a mutation for the writer thread"""
+        future = Future()
+        self.mutations.put((func, args, future))
+        return future
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """Books ranked against the query"""
+        with self.state_lock:
+            return [book.to_dict() for book in self.library.find_books(query, limit)]
+
+    def user_info(self, user_id: int) -> Optional[dict]:
+        """A member with their current loans and reservations, None if unknown"""
+        with self.state_lock:
+            user = self.library.users.get(user_id)
+            if user is None:
+                return None
+            loans = [loan.to_dict() for loan in self.library.loans.for_user(user_id)]
+            reservations = [reservation.to_dict() for reservation in self.library.reservations.for_user(user_id)]
+        return {'user': user.to_dict(), 'loans': loans, 'reservations': reservations}
+
+    def issue(self, user_id: int, book_id: int) -> dict:
+        """Lend a book, waits for the writer but not for the disk"""
+        loan = self.submit(self.library.checkout, user_id, book_id).result()
+        return {'loan': loan.to_dict()}
+
+    def collect(self, user_id: int, book_id: int) -> dict:
+        """Take a book back and report the fine and who the copy is now held for"""
+        loan, fine, hold = self.submit(self.library.checkin, user_id, book_id).result()
+        return {'loan': loan.to_dict(), 'fine': fine, 'hold': hold.to_dict() if hold else None}
+
+    def reserve(self, user_id: int, book_id: int) -> dict:
+        """Join the waitlist of a book with no copy left"""
+        reservation = self.submit(self.library.reserve, user_id, book_id).result()
+        return {'reservation': reservation.to_dict()}
+
+    def sweep_holds(self, interval: float):
+        """Scheduled task: queue an expired-hold sweep for the writer every interval seconds"""
+        while True:
+            time.sleep(interval)
+            try:
+                for line in self.submit(self.library.sweep_holds).result():
+                    print(line)
+            except Exception as e:
+                print(f"Error sweeping holds: {e}")
+
+    def close(self):
+        """Stop the writer and persist everything still queued"""
+        self.mutations.put((None, (), None))
+        self.writer.join()
+        self.library.close()
+
+
+class LibraryRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over a LibraryService"""
+
+    service: LibraryService = None
+
+    def send_json(self, status: int, payload):
+        """Write a JSON response"""
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        try:
+            if url.path == '/books':
+                limit = int(params.get('limit', ['20'])[0])
+                self.send_json(200, {'books': self.service.search(params.get('q', [''])[0], limit)})
+            elif url.path.startswith('/users/'):
+                info = self.service.user_info(int(url.path[len('/users/'):]))
+                if info is None:
+                    self.send_json(404, {'error': "User ID does not exist!"})
+                else:
+                    self.send_json(200, info)
+            else:
+                self.send_json(404, {'error': f"Unknown path {url.path}"})
+        except ValueError:
+            self.send_json(400, {'error': "IDs and limit must be integers"})
+        except Exception as e:
+            print(f"Error handling {self.path}: {e}")
+            self.send_json(500, {'error': "Internal error"})
+
+    def do_POST(self):
+        actions: Dict[str, Callable] = {'/issue': self.service.issue, '/collect': self.service.collect,
+                                        '/reserve': self.service.reserve}
+        action = actions.get(urlparse(self.path).path)
+        if action is None:
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length) or b'{}')
+            self.send_json(200, action(int(data['user_id']), int(data['book_id'])))
+        except (KeyError, TypeError, ValueError):
+            self.send_json(400, {'error': "Body must be JSON with integer user_id and book_id"})
+        except LibraryError as e:
+            self.send_json(409, {'error': str(e)})
+        except Exception as e:
+            print(f"Error handling {self.path}: {e}")
+            self.send_json(500, {'error': "Internal error"})
+
+
+def main():
+    """Run the HTTP service"""
+    parser = argparse.ArgumentParser(description="Library Management System HTTP service")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--storage", choices=['json', 'sqlite'], default=os.environ.get('LIBRARY_STORAGE', 'json'),
+                        help="Storage backend (default: $LIBRARY_STORAGE or json)")
+    parser.add_argument("--db-file", default='library.db', help="SQLite database file")
+    parser.add_argument("--snapshot-format", choices=['json', 'binary'], default='json',
+                        help="Keep JSON storage snapshots as JSON files or as one memory-mapped binary file")
+    parser.add_argument("--sweep-interval", type=float, default=60, help="Seconds between expired-hold sweeps")
+    args = parser.parse_args()
+
+    # JSON storage always journals here: each write is one appended line instead of a full file rewrite
+    library = LibraryManager(storage=args.storage, journal_mode=True, db_file=args.db_file,
+                             snapshot_format=args.snapshot_format)
+    service = LibraryService(library)
+    threading.Thread(target=service.sweep_holds, args=(args.sweep_interval,), daemon=True).start()
+    LibraryRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), LibraryRequestHandler)
+    print(f"Serving {len(library.books)} books on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1100 @@
+"""Storage backends for the library: JSON files with an optional journal, a binary snapshot, and SQLite"""
+
+import os
+import json
+import mmap
+import struct
+import bisect
+import datetime
+import sqlite3
+import threading
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, List, Optional, Iterable, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from records import VersionConflict, Book, User, Loan, Reservation
+from indexes import BookSearchIndex
+
+
+class CirculationLog:
+    """Append-only JSON-lines history of issues and returns, shared by every desk"""
+    
+    def __init__(self, path: str = 'circulation.log'):
+        self.path = path
+        
+    @staticmethod
+    def encode(event: dict) -> bytes:
+        """One event as a log line"""
+        return (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        
+    def append(self, event: dict):
+        """Append one event with a single write, so lines from several processes never interleave"""
+        line = self.encode(event)
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Error writing circulation log: {e}")
+            
+    def read_from(self, offset: int) -> Iterable[Tuple[dict, int]]:
+        """Yield (event, offset after it) for complete lines past an offset"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for entry, size in JsonStorage.read_entries(f):
+                offset += size
+                yield entry, offset
+
+
+class FileLock:
+    """Advisory lock on a file, shared by every process that opens the same path"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._handle = None
+        self._depth = 0
+        
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._handle = open(self.path, 'a+b')
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_LOCK, 1)
+        self._depth += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+            self._handle.close()
+            self._handle = None
+        self._thread_lock.release()
+        
+        
+class JsonStorage:
+    """Books, users and loans kept in JSON files or a binary snapshot, optionally with an append-only journal"""
+    
+    lazy = False
+    
+    RECORD_TYPES = {'book': Book, 'user': User, 'loan': Loan, 'hold': Reservation}
+    
+    def __init__(self, book_file: str = 'book.json', users_file: str = 'user.json', loans_file: str = 'loan.json',
+                 holds_file: str = 'hold.json',
+                 journal_file: str = 'library.journal', journal_mode: bool = False, journal_threshold: int = 4 * 1024 * 1024,
+                 state_file: str = 'state.json', concurrent: bool = False, snapshot_format: str = 'json',
+                 snapshot_file: str = 'library.snap'):
+        self.files = {'book': book_file, 'user': users_file, 'loan': loans_file, 'hold': holds_file}
+        # The binary snapshot replaces the three JSON files and is memory-mapped on load,
+        # whichever format is configured an existing snapshot file is always read first
+        self.snapshot_format = snapshot_format
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.state_file = state_file
+        self.records: Dict[str, dict] = {kind: {} for kind in self.RECORD_TYPES}
+        
+        # Journal mode appends one record per change instead of rewriting the JSON files
+        self.journal_mode = journal_mode or concurrent
+        self.journal_threshold = journal_threshold
+        self._journal_lock = threading.Lock()
+        self._journal_handle = None
+        self._compaction_thread: Optional[threading.Thread] = None
+        
+        # Concurrent mode shares the journal between processes: appends happen under a file lock,
+        # and records other processes appended are read from the tail past our offset
+        self.concurrent = concurrent
+        self.file_lock = FileLock(journal_file + '.lock')
+        self._offset = 0
+        self._inode = None
+        self._pending: List[tuple] = []
+        self._needs_reload = False
+        
+    def load(self) -> Dict[str, dict]:
+        """Load books, users and loans from JSON files"""
+        if self.concurrent:
+            with self.file_lock:
+                return self._load()
+        return self._load()
+    
+    def _load(self) -> Dict[str, dict]:
+        """Read the snapshot files and replay the journal"""
+        self.records = {kind: {} for kind in self.RECORD_TYPES}
+        legacy_loans = []
+        if os.path.exists(self.snapshot_file):
+            try:
+                snapshot = BinarySnapshot(self.snapshot_file)
+                self.records = {kind: snapshot.records(kind, cls.from_bytes) for kind, cls in self.RECORD_TYPES.items()}
+            except Exception as e:
+                print(f"Error loading snapshot: {e}")
+        for kind, cls in self.RECORD_TYPES.items():
+            try: 
+                if isinstance(self.records[kind], BinaryRecordMap):
+                    continue
+                if os.path.exists(self.files[kind]):
+                    with open(self.files[kind], 'r') as f:
+                        data = json.load(f)
+                        self.records[kind] = {int(k): cls.from_dict(v) for k, v in data.items()}
+                    if kind == 'user':
+                        legacy_loans = [v for v in data.values() if v.get('book_id')]
+            except Exception as e:
+                print(f"Error Loading {kind}s: {e}")
+                
+        # A journal left by a journaling process (the server, or an earlier run in journal mode) is replayed in
+        # every mode, otherwise the changes it holds are lost now and replayed over newer saves later
+        if self.replay_journal() and not self.journal_mode:
+            # Fold it into the snapshot files that this mode saves to, and start over without it
+            self.write_snapshot(self.snapshot())
+            os.remove(self.journal_file)
+            
+        if legacy_loans:
+            self.migrate_legacy_loans(legacy_loans)
+        elif self.snapshot_format == 'binary' and not os.path.exists(self.snapshot_file):
+            # First start with the binary format, convert the JSON files once
+            self.write_snapshot(self.snapshot())
+        return self.records
+    
+    def migrate_legacy_loans(self, legacy_users: List[dict]):
+        """Turn the single book_id/issue_date/due_date of old user records into loans"""
+        loans = self.records['loan']
+        next_id = max(loans, default=0) + 1
+        for data in legacy_users:
+            loan = Loan.from_dict({'id': next_id, 'user_id': data['id'], 'book_id': data['book_id'],
+                                   'issue_date': data['issue_date'], 'due_date': data['due_date']})
+            loans[loan.id] = loan
+            next_id += 1
+        # Rewrite both files at once so the old fields are never converted twice
+        self.save('loan')
+        self.save('user')
+            
+    def save(self, kind: str):
+        """Save one record type to its JSON file"""
+        if self.snapshot_format == 'binary' or os.path.exists(self.snapshot_file):
+            # The binary snapshot holds every record type in one file, and moving off it rewrites every JSON file
+            self.write_snapshot(self.snapshot())
+            return
+        try:
+            self.write_records(self.files[kind], ((k, v.to_json()) for k, v in list(self.records[kind].items())))
+        except Exception as e:
+            print(f"Error saving {kind}s: {e}")
+            
+    @staticmethod
+    def write_records(path: str, items: Iterable[Tuple[object, str]]):
+        """Stream (id, record JSON) pairs into a JSON object file, one record per line"""
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            separator = '{\n'
+            for key, text in items:
+                f.write(f'{separator}"{key}": {text}')
+                separator = ',\n'
+            f.write('{}' if separator == '{\n' else '\n}\n')
+        os.replace(path + '.tmp', path)
+            
+    def put(self, kind: str, record):
+        """Persist a new or changed record"""
+        if self.journal_mode:
+            self.append_journal(kind, record.id, record.to_json())
+        else:
+            self.save(kind)
+            
+    def put_many(self, kind: str, records: List):
+        """Persist a batch of new or changed records with a single write"""
+        if self.journal_mode:
+            self.append_journal_entries([(kind, record.id, record.to_json()) for record in records])
+        else:
+            self.save(kind)
+            
+    def delete(self, kind: str, record_id: int):
+        """Persist the removal of a record"""
+        if self.journal_mode:
+            self.append_journal(kind, record_id, None)
+        else:
+            self.save(kind)
+        
+    def load_state(self, name: str) -> Optional[dict]:
+        """Read a named piece of bookkeeping state"""
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r') as f:
+                    return json.load(f).get(name)
+        except Exception as e:
+            print(f"Error loading state: {e}")
+        return None
+    
+    def save_state(self, name: str, data: dict):
+        """Store a named piece of bookkeeping state"""
+        try:
+            state = {}
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r') as f:
+                    state = json.load(f)
+            state[name] = data
+            with open(self.state_file + '.tmp', 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(self.state_file + '.tmp', self.state_file)
+        except Exception as e:
+            print(f"Error saving state: {e}")
+        
+    def append_journal(self, kind: str, record_id: int, data: Optional[str]):
+        """Append one compact record to the journal, data is the record JSON or None when deleted"""
+        self.append_journal_entries([(kind, record_id, data)])
+        
+    def append_journal_entries(self, entries: List[tuple]):
+        """Append (kind, id, record JSON) entries to the journal with one write and fsync"""
+        if self.concurrent:
+            with self.file_lock:
+                self.read_journal_tail()
+                journal_size = self._write_journal(entries)
+                if journal_size >= self.journal_threshold and not self._needs_reload:
+                    self.compact_shared_journal()
+            return
+        
+        journal_size = self._write_journal(entries)
+        if journal_size >= self.journal_threshold:
+            self.compact_journal()
+            
+    def _write_journal(self, entries: List[tuple]) -> int:
+        """Write journal lines and return the journal size afterwards"""
+        lines = ''.join(f'{{"type":"{kind}","id":{record_id},"data":{data or "null"}}}\n' for kind, record_id, data in entries)
+        try:
+            with self._journal_lock:
+                # Another process may have compacted and replaced the journal file
+                if (self._journal_handle and self.concurrent and
+                        os.fstat(self._journal_handle.fileno()).st_ino != os.stat(self.journal_file).st_ino):
+                    self._journal_handle.close()
+                    self._journal_handle = None
+                if self._journal_handle is None:
+                    self._journal_handle = open(self.journal_file, 'ab')
+                    if self._inode is None:
+                        self._inode = os.fstat(self._journal_handle.fileno()).st_ino
+                self._journal_handle.write(lines.encode('utf-8'))
+                self._journal_handle.flush()
+                os.fsync(self._journal_handle.fileno())
+                journal_size = self._journal_handle.tell()
+        except Exception as e:
+            print(f"Error writing journal: {e}")
+            return 0
+        
+        # Our own lines are already applied in memory, so reading resumes after them
+        self._offset = journal_size
+        return journal_size
+    
+    @staticmethod
+    def read_entries(f) -> Iterable[Tuple[dict, int]]:
+        """Yield (entry, size in bytes) for each complete journal line"""
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                # A torn last line from a crash mid-append, nothing after it was acknowledged
+                return
+            try:
+                entry = json.loads(raw)
+            except json.JSONDecodeError:
+                return
+            yield entry, len(raw)
+            
+    def replay_journal(self) -> bool:
+        """Apply journal records written since the last snapshot, True if there is a journal"""
+        rotated_file = self.journal_file + '.old'
+        self._offset, self._inode, self._pending, self._needs_reload = 0, None, [], False
+        for path in (rotated_file, self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                for entry, size in self.read_entries(f):
+                    self.apply_journal_entry(entry)
+                    if path == self.journal_file:
+                        self._offset += size
+                if path == self.journal_file:
+                    self._inode = os.fstat(f.fileno()).st_ino
+                    
+        # A compaction was interrupted, fold its journal into the snapshot before writing more
+        if os.path.exists(rotated_file):
+            self.write_snapshot(self.snapshot())
+        return os.path.exists(self.journal_file)
+            
+    def read_journal_tail(self):
+        """Queue records other processes appended since we last read the journal"""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_ino != self._inode:
+                if self._inode is None and self._offset == 0:
+                    self._inode = os.fstat(f.fileno()).st_ino
+                else:
+                    # The journal was compacted into a new snapshot by another process
+                    self._needs_reload = True
+                    return
+            f.seek(self._offset)
+            for entry, size in self.read_entries(f):
+                self._pending.append((entry['type'], entry['id'], entry['data']))
+                self._offset += size
+                
+    def sync(self) -> Optional[List[tuple]]:
+        """Changes made by other processes as (kind, id, data), or None if a full reload is needed"""
+        if not self.concurrent:
+            return []
+        with self.file_lock:
+            self.read_journal_tail()
+        if self._needs_reload:
+            return None
+        changes, self._pending = self._pending, []
+        return changes
+    
+    def member_is_active(self, user_id: int) -> bool:
+        """Whether a member has any loan or reservation, counting those other processes wrote that are not
+        synced yet"""
+        for kind in ('loan', 'hold'):
+            pending = {record_id: data for pending_kind, record_id, data in self._pending if pending_kind == kind}
+            if any(data is not None and data['user_id'] == user_id for data in pending.values()):
+                return True
+            if any(record.user_id == user_id for record in self.records[kind].values() if record.id not in pending):
+                return True
+        return False
+    
+    def latest(self, kind: str, record_id: int) -> Optional[dict]:
+        """Newest stored version of a record, including changes not yet synced"""
+        for pending_kind, pending_id, data in reversed(self._pending):
+            if pending_kind == kind and pending_id == record_id:
+                return data
+        record = self.records[kind].get(record_id)
+        return record.to_dict() if record else None
+    
+    def compare_and_swap(self, book: Optional[Book], expected_version: Optional[int], added: Iterable = (),
+                         closed: Iterable = (), changed: Iterable = (), delete: bool = False) -> bool:
+        """Write a book only if its stored version is still the expected one, or insert it if expected_version
+        is None and the ID is free, or delete it with delete; together with the loans, reservations and members
+        it affects: added records must not exist yet, closed and changed ones must, a closed member must not
+        have open loans or reservations and an added loan or reservation's member must still exist. Without a
+        book only the records are swapped"""
+        with self.file_lock:
+            self.read_journal_tail()
+            if self._needs_reload:
+                return False
+            entries = []
+            if book is not None:
+                current = self.latest('book', book.id)
+                if expected_version is None:
+                    if current is not None:
+                        return False
+                elif current is None or current.get('version', 0) != expected_version:
+                    return False
+                entries.append(('book', book.id, None if delete else book.to_json()))
+            if any(self.latest(record.KIND, record.id) is not None for record in added):
+                return False
+            if any(self.latest(record.KIND, record.id) is None for record in [*closed, *changed]):
+                return False
+            if any(self.member_is_active(record.id) for record in closed if record.KIND == 'user'):
+                return False
+            if any(self.latest('user', record.user_id) is None for record in added if record.KIND in ('loan', 'hold')):
+                return False
+            entries += [(record.KIND, record.id, record.to_json()) for record in [*added, *changed]]
+            entries += [(record.KIND, record.id, None) for record in closed]
+            self._write_journal(entries)
+            return True
+            
+    def apply_journal_entry(self, entry: dict):
+        """Apply a single journal record to the in-memory data"""
+        kind, record_id, data = entry['type'], entry['id'], entry['data']
+        if data is None:
+            self.records[kind].pop(record_id, None)
+        else:
+            self.records[kind][record_id] = self.RECORD_TYPES[kind].from_dict(data)
+            
+    def snapshot(self, records: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+        """Copy of every record (or of a copy_records() copy) encoded for the snapshot format, safe to write
+        from another thread"""
+        records = self.records if records is None else records
+        # list() copies the items in one step, so a writer thread adding records cannot break the iteration
+        if self.snapshot_format == 'binary':
+            return {kind: dict(kind_records.encoded_items()) if isinstance(kind_records, BinaryRecordMap)
+                    else {k: v.to_bytes() for k, v in list(kind_records.items())}
+                    for kind, kind_records in records.items()}
+        return {kind: {k: v.to_json() for k, v in list(kind_records.items())} for kind, kind_records in records.items()}
+    
+    def copy_records(self) -> Dict[str, dict]:
+        """Shallow copy of every record map, nothing is encoded and untouched snapshot records are not read"""
+        return {kind: records.copy() if isinstance(records, BinaryRecordMap) else dict(records)
+                for kind, records in self.records.items()}
+            
+    def compact_journal(self):
+        """Rotate the journal and write a fresh snapshot in the background"""
+        if self._compaction_thread and self._compaction_thread.is_alive():
+            return
+        with self._journal_lock:
+            if self._journal_handle:
+                self._journal_handle.close()
+                self._journal_handle = None
+            # Appends from now on start a new journal, the rotated one is covered by this snapshot
+            os.replace(self.journal_file, self.journal_file + '.old')
+            # Only the maps are copied here, the records are encoded on the compaction thread. A record changed
+            # meanwhile may be written in its newer state, which is harmless: the change is also in the new
+            # journal as the whole record, and replaying it over the snapshot gives the same result
+            records = self.copy_records()
+        self._compaction_thread = threading.Thread(target=lambda: self.write_snapshot(self.snapshot(records), records),
+                                                   daemon=True)
+        self._compaction_thread.start()
+        
+    def compact_shared_journal(self):
+        """Compact while holding the file lock, other processes notice the new journal and reload"""
+        snapshot = self.snapshot()
+        for kind, record_id, data in self._pending:
+            if data is None:
+                snapshot[kind].pop(record_id, None)
+            else:
+                record = self.RECORD_TYPES[kind].from_dict(data)
+                snapshot[kind][record_id] = record.to_bytes() if self.snapshot_format == 'binary' else record.to_json()
+        self.write_snapshot(snapshot, changed=[record_id for kind, record_id, _ in self._pending if kind == 'book'])
+        with self._journal_lock:
+            if self._journal_handle:
+                self._journal_handle.close()
+            with open(self.journal_file + '.tmp', 'wb'):
+                pass
+            os.replace(self.journal_file + '.tmp', self.journal_file)
+            self._journal_handle = open(self.journal_file, 'ab')
+            self._inode = os.fstat(self._journal_handle.fileno()).st_ino
+            self._offset = 0
+        
+    def write_snapshot(self, snapshot: Dict[str, dict], records: Optional[Dict[str, dict]] = None,
+                       changed: Iterable[int] = ()):
+        """Atomically replace the snapshot files and drop the rotated journal. records are the maps the snapshot
+        was encoded from (our own by default), changed any further books the snapshot differs from them in"""
+        try:
+            books = (self.records if records is None else records)['book']
+            if self.snapshot_format == 'binary' and isinstance(books, BinaryRecordMap):
+                # Only the books touched since the mapped snapshot was read can change the search index saved in it
+                BinarySnapshot.write(self.snapshot_file, snapshot, books.snapshot, books.touched_keys() | set(changed))
+            elif self.snapshot_format == 'binary':
+                BinarySnapshot.write(self.snapshot_file, snapshot)
+            else:
+                for kind, records in snapshot.items():
+                    self.write_records(self.files[kind], records.items())
+                # A binary snapshot left from an earlier run would otherwise shadow the new JSON files
+                if os.path.exists(self.snapshot_file):
+                    os.remove(self.snapshot_file)
+            if os.path.exists(self.journal_file + '.old'):
+                os.remove(self.journal_file + '.old')
+        except Exception as e:
+            print(f"Error writing snapshot: {e}")
+            
+    def close(self):
+        """Wait for a running compaction and close the journal"""
+        if self._compaction_thread:
+            self._compaction_thread.join()
+        with self._journal_lock:
+            if self._journal_handle:
+                self._journal_handle.close()
+                self._journal_handle = None
+                
+
+class LazyRecordMap(MutableMapping):
+    """Dict-like view over stored records that decodes rows only when they are touched"""
+    
+    def __init__(self):
+        self._cache: Dict[int, object] = {}
+        self._deleted: set = set()
+        
+    def _fetch(self, key: int):
+        """Decode one stored record, None if it does not exist"""
+        raise NotImplementedError
+    
+    def _stored_keys(self) -> Iterable[int]:
+        """Keys of every stored record in order"""
+        raise NotImplementedError
+    
+    def _stored_records(self) -> Iterable:
+        """Decode every stored record in key order"""
+        for key in self._stored_keys():
+            yield self._fetch(key)
+    
+    def __getitem__(self, key: int):
+        if key in self._cache:
+            return self._cache[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        record = self._fetch(key)
+        if record is None:
+            raise KeyError(key)
+        self._cache[key] = record
+        return record
+    
+    def __setitem__(self, key: int, record):
+        self._cache[key] = record
+        self._deleted.discard(key)
+        
+    def __delitem__(self, key: int):
+        if key not in self:
+            raise KeyError(key)
+        self._cache.pop(key, None)
+        self._deleted.add(key)
+        
+    def __contains__(self, key) -> bool:
+        if key in self._cache:
+            return True
+        if key in self._deleted:
+            return False
+        try:
+            return self[key] is not None
+        except KeyError:
+            return False
+        
+    def __iter__(self):
+        stored = set()
+        for key in self._stored_keys():
+            stored.add(key)
+            if key not in self._deleted:
+                yield key
+        for key in list(self._cache):
+            if key not in stored:
+                yield key
+                
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+    
+    def __bool__(self) -> bool:
+        return next(iter(self), None) is not None
+    
+    def values(self):
+        """Stream records without caching the ones that were never touched"""
+        stored = set()
+        for record in self._stored_records():
+            stored.add(record.id)
+            if record.id in self._deleted:
+                continue
+            yield self._cache.get(record.id, record)
+        for key, record in list(self._cache.items()):
+            if key not in stored:
+                yield record
+                
+    def touched_keys(self) -> set:
+        """Keys read, changed or deleted since loading, every other key still holds the stored record"""
+        return set(self._cache) | self._deleted
+    
+    def invalidate(self, keys: Iterable[int]):
+        """Forget cached state so the next access reads the stored record"""
+        for key in keys:
+            self._cache.pop(key, None)
+            self._deleted.discard(key)
+            
+    def items(self):
+        """Stream (id, record) pairs"""
+        for record in self.values():
+            yield record.id, record
+            
+
+class SnapshotTable:
+    """Sorted ASCII keys mapped to byte strings, read in place from a snapshot by binary search"""
+    
+    COUNT = struct.Struct('<q')
+    
+    def __init__(self, view: memoryview):
+        self.view = view
+        (self.count,) = self.COUNT.unpack_from(view, 0)
+        # Key and value offsets from the start of the table, one more than there are keys
+        start = self.COUNT.size
+        self.key_offsets = view[start:start + 8 * (self.count + 1)].cast('q')
+        start += 8 * (self.count + 1)
+        self.value_offsets = view[start:start + 8 * (self.count + 1)].cast('q')
+        
+    def _key(self, position: int) -> bytes:
+        return bytes(self.view[self.key_offsets[position]:self.key_offsets[position + 1]])
+    
+    def _value(self, position: int) -> memoryview:
+        return self.view[self.value_offsets[position]:self.value_offsets[position + 1]]
+    
+    def get(self, key: str) -> Optional[memoryview]:
+        """The value stored for a key, without copying it"""
+        target = key.encode('ascii')
+        position = bisect.bisect_left(range(self.count), target, key=self._key)
+        if position < self.count and self._key(position) == target:
+            return self._value(position)
+        return None
+    
+    def items(self) -> Iterable[Tuple[str, memoryview]]:
+        """(key, value) pairs in key order"""
+        for position in range(self.count):
+            yield self._key(position).decode('ascii'), self._value(position)
+            
+    @classmethod
+    def encode(cls, items: Dict[str, bytes]) -> bytes:
+        """A table of {key: value}. Values start 8-byte aligned when their lengths are multiples of 8"""
+        keys = sorted(items)
+        key_offsets, value_offsets = array('q'), array('q')
+        position = cls.COUNT.size + 16 * (len(keys) + 1)
+        for key in keys:
+            key_offsets.append(position)
+            position += len(key)
+        key_offsets.append(position)
+        padding = bytes(-position % 8)
+        position += len(padding)
+        for key in keys:
+            value_offsets.append(position)
+            position += len(items[key])
+        value_offsets.append(position)
+        return b''.join([cls.COUNT.pack(len(keys)), key_offsets.tobytes(), value_offsets.tobytes(),
+                         ''.join(keys).encode('ascii'), padding, *(items[key] for key in keys)])
+    
+    
+class BinarySnapshot:
+    """Every record in one file: length-prefixed records followed by a sorted ID index per record type, then
+    the search index over the books. The file is memory-mapped, so opening it costs the same for ten books
+    or a million."""
+    
+    MAGIC = b'LIBSNAP3'
+    KINDS = ('book', 'user', 'loan', 'hold')
+    # Snapshots written before reservations existed carry only the first three sections, and snapshots
+    # written before the search index was saved carry no search tables
+    LEGACY_MAGIC = {b'LIBSNAP1': 3, b'LIBSNAP2': 4}
+    # record count and index offset for each record type, then offset and size of each search table
+    SECTION = struct.Struct('<QQ')
+    RECORD_LENGTH = struct.Struct('<I')
+    
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.map[:len(self.MAGIC)]
+        if magic != self.MAGIC and magic not in self.LEGACY_MAGIC:
+            raise ValueError(f"{path} is not a library snapshot")
+        self.view = memoryview(self.map)
+        self.sections = {kind: (memoryview(b'').cast('q'), memoryview(b'').cast('q')) for kind in self.KINDS}
+        for position, kind in enumerate(self.KINDS[:self.LEGACY_MAGIC.get(magic, len(self.KINDS))]):
+            count, index_offset = self.SECTION.unpack_from(self.map, len(self.MAGIC) + position * self.SECTION.size)
+            ids = self.view[index_offset:index_offset + 8 * count].cast('q')
+            offsets = self.view[index_offset + 8 * count:index_offset + 16 * count].cast('q')
+            self.sections[kind] = (ids, offsets)
+        self.search: Dict[str, SnapshotTable] = {}
+        if magic == self.MAGIC:
+            start = len(self.MAGIC) + len(self.KINDS) * self.SECTION.size
+            for position, table in enumerate(BookSearchIndex.TABLES):
+                offset, size = self.SECTION.unpack_from(self.map, start + position * self.SECTION.size)
+                self.search[table] = SnapshotTable(self.view[offset:offset + size])
+            
+    def records(self, kind: str, decode) -> 'BinaryRecordMap':
+        """Lazy mapping over one record type"""
+        ids, offsets = self.sections[kind]
+        return BinaryRecordMap(self, ids, offsets, decode)
+    
+    def payload(self, offset: int) -> memoryview:
+        """The encoded record stored at an offset, without copying it"""
+        (length,) = self.RECORD_LENGTH.unpack_from(self.map, offset)
+        start = offset + self.RECORD_LENGTH.size
+        return self.view[start:start + length]
+    
+    def find(self, kind: str, record_id: int) -> Optional[memoryview]:
+        """The encoded record of an ID, None if the snapshot does not have it"""
+        ids, offsets = self.sections[kind]
+        position = bisect.bisect_left(ids, record_id)
+        if position < len(ids) and ids[position] == record_id:
+            return self.payload(offsets[position])
+        return None
+    
+    @classmethod
+    def write(cls, path: str, snapshot: Dict[str, Dict[int, bytes]], base: Optional['BinarySnapshot'] = None,
+              changed: Optional[Iterable[int]] = None):
+        """Atomically write {kind: {id: encoded record}} as a new snapshot file with the search index of its
+        books. Given the snapshot the books were read from and the IDs of the books changed since, the index
+        saved there is updated instead of indexing every book again"""
+        books = snapshot.get('book', {})
+        if base is not None and base.search and changed is not None:
+            search = BookSearchIndex.updated_tables(base.search, lambda book_id: base.find('book', book_id), books,
+                                                    changed)
+        else:
+            search = BookSearchIndex.tables(books)
+        header_size = len(cls.MAGIC) + (len(cls.KINDS) + len(BookSearchIndex.TABLES)) * cls.SECTION.size
+        sections = []
+        with open(path + '.tmp', 'wb') as f:
+            f.write(bytes(header_size))
+            indexes = []
+            for kind in cls.KINDS:
+                records = snapshot.get(kind, {})
+                ids, offsets = array('q'), array('q')
+                for record_id in sorted(records):
+                    payload = records[record_id]
+                    ids.append(record_id)
+                    offsets.append(f.tell())
+                    f.write(cls.RECORD_LENGTH.pack(len(payload)))
+                    f.write(payload)
+                indexes.append((ids, offsets))
+            # Indexes go after the records, 8-byte aligned so they can be read as int64 arrays in place
+            f.write(bytes(-f.tell() % 8))
+            for ids, offsets in indexes:
+                sections.append((len(ids), f.tell()))
+                f.write(ids.tobytes())
+                f.write(offsets.tobytes())
+            for table in BookSearchIndex.TABLES:
+                # A table nothing changed in is copied from the earlier snapshot as it is
+                data = search[table].view if isinstance(search[table], SnapshotTable) else SnapshotTable.encode(search[table])
+                f.write(bytes(-f.tell() % 8))
+                sections.append((f.tell(), len(data)))
+                f.write(data)
+            f.seek(0)
+            f.write(cls.MAGIC)
+            for section in sections:
+                f.write(cls.SECTION.pack(*section))
+        os.replace(path + '.tmp', path)
+        
+        
+class BinaryRecordMap(LazyRecordMap):
+    """Lazy mapping over one record type of a binary snapshot, records are decoded on first access"""
+    
+    def __init__(self, snapshot: BinarySnapshot, ids: memoryview, offsets: memoryview, decode):
+        super().__init__()
+        self.snapshot = snapshot
+        self.ids = ids
+        self.offsets = offsets
+        self.decode = decode
+        
+    def _position(self, key: int) -> Optional[int]:
+        """Index of a stored ID, found by binary search over the mapped ID array"""
+        position = bisect.bisect_left(self.ids, key)
+        if position < len(self.ids) and self.ids[position] == key:
+            return position
+        return None
+    
+    def _fetch(self, key: int):
+        position = self._position(key)
+        if position is None:
+            return None
+        return self.decode(self.snapshot.payload(self.offsets[position]))
+    
+    def _stored_keys(self) -> Iterable[int]:
+        return iter(self.ids)
+    
+    def _stored_records(self) -> Iterable:
+        for offset in self.offsets:
+            yield self.decode(self.snapshot.payload(offset))
+            
+    def __len__(self) -> int:
+        deleted = sum(1 for key in self._deleted if self._position(key) is not None)
+        added = sum(1 for key in self._cache if self._position(key) is None)
+        return len(self.ids) - deleted + added
+    
+    def encoded_items(self) -> Iterable[Tuple[int, bytes]]:
+        """(id, encoded record) pairs, records that were never touched are copied without decoding"""
+        for position, key in enumerate(self.ids):
+            if key in self._cache or key in self._deleted:
+                continue
+            yield key, bytes(self.snapshot.payload(self.offsets[position]))
+        for key, record in list(self._cache.items()):
+            yield key, record.to_bytes()
+            
+    def copy(self) -> 'BinaryRecordMap':
+        """Independent map over the same snapshot, only the changed and decoded records are copied"""
+        copy = BinaryRecordMap(self.snapshot, self.ids, self.offsets, self.decode)
+        copy._cache = dict(self._cache)
+        copy._deleted = set(self._deleted)
+        return copy
+            
+
+class SqliteRecordMap(LazyRecordMap):
+    """Lazy mapping over one SQLite table"""
+    
+    def __init__(self, storage: 'SqliteStorage', kind: str):
+        super().__init__()
+        self.storage = storage
+        self.table = storage.TABLES[kind]
+        self.decode = storage.decoders[kind]
+        
+    def _fetch(self, key: int):
+        row = self.storage.query_one(f"SELECT * FROM {self.table} WHERE id = ?", (key,))
+        return self.decode(row) if row else None
+    
+    def _stored_keys(self) -> Iterable[int]:
+        for (key,) in self.storage.query_iter(f"SELECT id FROM {self.table} ORDER BY id"):
+            yield key
+            
+    def _stored_records(self) -> Iterable:
+        for row in self.storage.query_iter(f"SELECT * FROM {self.table} ORDER BY id"):
+            yield self.decode(row)
+            
+    def __len__(self) -> int:
+        (count,) = self.storage.query_one(f"SELECT COUNT(*) FROM {self.table}")
+        return count
+    
+    
+class SqliteStorage:
+    """Books, users and loans kept in a SQLite database, rows are read only when needed"""
+    
+    lazy = True
+    
+    TABLES = {'book': 'books', 'user': 'users', 'loan': 'loans', 'hold': 'holds'}
+    COLUMNS = {'book': 8, 'user': 3, 'loan': 5, 'hold': 6}
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            author TEXT NOT NULL,
+            copies INTEGER NOT NULL,
+            copies_left INTEGER NOT NULL,
+            price REAL NOT NULL,
+            isbn TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            tier TEXT NOT NULL DEFAULT 'standard'
+        );
+        CREATE TABLE IF NOT EXISTS loans (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            issue_date REAL NOT NULL,
+            due_date REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS holds (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            requested REAL NOT NULL,
+            tier TEXT NOT NULL,
+            hold_until REAL
+        );
+        CREATE TABLE IF NOT EXISTS state (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_books_name ON books (name);
+        CREATE INDEX IF NOT EXISTS idx_books_author ON books (author);
+        CREATE INDEX IF NOT EXISTS idx_loans_user ON loans (user_id);
+        CREATE INDEX IF NOT EXISTS idx_loans_book ON loans (book_id);
+        CREATE INDEX IF NOT EXISTS idx_loans_due_date ON loans (due_date);
+        CREATE INDEX IF NOT EXISTS idx_holds_book ON holds (book_id);
+        CREATE INDEX IF NOT EXISTS idx_holds_user ON holds (user_id);
+    """
+    
+    def __init__(self, db_file: str = 'library.db', concurrent: bool = False):
+        self.db_file = db_file
+        self.concurrent = concurrent
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.upgrade_schema()
+        self.encoders = {'book': self.book_row, 'user': self.user_row, 'loan': self.loan_row, 'hold': self.hold_row}
+        self.decoders = {'book': self.decode_book, 'user': self.decode_user, 'loan': self.decode_loan, 'hold': self.decode_hold}
+        self._data_version = self.data_version()
+        
+    def upgrade_schema(self):
+        """Add columns introduced after a database was created"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(books)")}
+        with self.conn:
+            if 'isbn' not in columns:
+                self.conn.execute("ALTER TABLE books ADD COLUMN isbn TEXT")
+            if 'version' not in columns:
+                self.conn.execute("ALTER TABLE books ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (isbn)")
+            if 'tier' not in {row[1] for row in self.conn.execute("PRAGMA table_info(users)")}:
+                self.conn.execute("ALTER TABLE users ADD COLUMN tier TEXT NOT NULL DEFAULT 'standard'")
+        
+    @staticmethod
+    def encode_date(value: Optional[datetime.datetime]) -> Optional[float]:
+        """Dates are stored as epoch seconds so they sort and need no parsing"""
+        return value.timestamp() if value else None
+    
+    @staticmethod
+    def decode_date(value: Optional[float]) -> Optional[datetime.datetime]:
+        """Convert stored epoch seconds back to a datetime"""
+        return datetime.datetime.fromtimestamp(value) if value is not None else None
+    
+    @staticmethod
+    def decode_book(row) -> Book:
+        """Build a Book from a books row"""
+        book = Book(row[0], row[1], row[2], row[3], row[5], row[6])
+        book.copies_left = row[4]
+        book.version = row[7]
+        return book
+    
+    @staticmethod
+    def decode_user(row) -> User:
+        """Build a User from a users row"""
+        return User(row[0], row[1], row[2])
+    
+    @classmethod
+    def decode_loan(cls, row) -> Loan:
+        """Build a Loan from a loans row"""
+        return Loan(row[0], row[1], row[2], cls.decode_date(row[3]), cls.decode_date(row[4]))
+    
+    @classmethod
+    def decode_hold(cls, row) -> Reservation:
+        """Build a Reservation from a holds row"""
+        return Reservation(row[0], row[1], row[2], cls.decode_date(row[3]), row[4], cls.decode_date(row[5]))
+    
+    def book_row(self, book: Book) -> tuple:
+        """Column values for a book"""
+        return (book.id, book.name, book.author, book.copies, book.copies_left, book.price, book.isbn, book.version)
+    
+    def user_row(self, user: User) -> tuple:
+        """Column values for a user"""
+        return (user.id, user.name, user.tier)
+    
+    def loan_row(self, loan: Loan) -> tuple:
+        """Column values for a loan"""
+        return (loan.id, loan.user_id, loan.book_id, self.encode_date(loan.issue_date), self.encode_date(loan.due_date))
+    
+    def hold_row(self, hold: Reservation) -> tuple:
+        """Column values for a reservation"""
+        return (hold.id, hold.user_id, hold.book_id, self.encode_date(hold.requested), hold.tier, self.encode_date(hold.hold_until))
+    
+    def query_one(self, sql: str, params: tuple = ()):
+        """Run a query and return its first row"""
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+        
+    def query_all(self, sql: str, params: tuple = ()):
+        """Run a query and return all rows"""
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return rows
+    
+    def query_iter(self, sql: str, params: tuple = (), size: int = 1000):
+        """Run a query and stream its rows in chunks"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(sql, params)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(size)
+            if not rows:
+                return
+            yield from rows
+            
+    def existing_values(self, kind: str, column: str, values: List) -> set:
+        """Which of the given values already appear in an indexed column"""
+        found = set()
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(values), 900):
+            chunk = values[start:start + 900]
+            sql = f"SELECT {column} FROM {self.TABLES[kind]} WHERE {column} IN ({', '.join('?' * len(chunk))})"
+            found.update(row[0] for row in self.query_all(sql, tuple(chunk)))
+        return found
+    
+    def load(self) -> Dict[str, dict]:
+        """Return lazy mappings for books and users, nothing is read until a record is accessed.
+        Active loans and reservations are few and back in-memory indexes, so they are read up front."""
+        loans = {row[0]: self.decode_loan(row) for row in self.query_all("SELECT * FROM loans")}
+        holds = {row[0]: self.decode_hold(row) for row in self.query_all("SELECT * FROM holds")}
+        return {'book': SqliteRecordMap(self, 'book'), 'user': SqliteRecordMap(self, 'user'), 'loan': loans, 'hold': holds}
+    
+    def insert_sql(self, kind: str) -> str:
+        """INSERT OR REPLACE statement for a record type"""
+        return f"INSERT OR REPLACE INTO {self.TABLES[kind]} VALUES ({', '.join('?' * self.COLUMNS[kind])})"
+    
+    def put(self, kind: str, record):
+        """Persist a new or changed record"""
+        with self._lock, self.conn:
+            self.conn.execute(self.insert_sql(kind), self.encoders[kind](record))
+            
+    def put_many(self, kind: str, records: List):
+        """Persist a batch of new or changed records in one transaction"""
+        with self._lock, self.conn:
+            self.conn.executemany(self.insert_sql(kind), [self.encoders[kind](record) for record in records])
+            
+    def delete(self, kind: str, record_id: int):
+        """Persist the removal of a record"""
+        with self._lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self.TABLES[kind]} WHERE id = ?", (record_id,))
+            
+    def data_version(self) -> int:
+        """Changes whenever another connection commits to the database"""
+        return self.query_one("PRAGMA data_version")[0]
+    
+    def sync(self) -> Optional[List[tuple]]:
+        """None when another process committed since we last looked, so cached rows must be dropped"""
+        if not self.concurrent:
+            return []
+        version = self.data_version()
+        if version == self._data_version:
+            return []
+        self._data_version = version
+        return None
+    
+    def compare_and_swap(self, book: Optional[Book], expected_version: Optional[int], added: Iterable = (),
+                         closed: Iterable = (), changed: Iterable = (), delete: bool = False) -> bool:
+        """Write a book only if its stored version is still the expected one, or insert it if expected_version
+        is None and the ID is free, or delete it with delete; together with the loans, reservations and members
+        it affects: added records must not exist yet, closed and changed ones must, a closed member must not
+        have open loans or reservations and an added loan or reservation's member must still exist. Without a
+        book only the records are swapped"""
+        with self._lock:
+            try:
+                with self.conn:
+                    if book is None:
+                        pass
+                    elif expected_version is None:
+                        self.conn.execute(f"INSERT INTO books VALUES ({', '.join('?' * self.COLUMNS['book'])})",
+                                          self.encoders['book'](book))
+                    elif delete:
+                        if self.conn.execute("DELETE FROM books WHERE id = ? AND version = ?",
+                                             (book.id, expected_version)).rowcount != 1:
+                            raise VersionConflict(book.id)
+                    elif self.conn.execute(
+                            "UPDATE books SET name = ?, author = ?, copies = ?, copies_left = ?, price = ?, isbn = ?, version = ? "
+                            "WHERE id = ? AND version = ?",
+                            (book.name, book.author, book.copies, book.copies_left, book.price, book.isbn, book.version, book.id,
+                             expected_version)).rowcount != 1:
+                        raise VersionConflict(book.id)
+                    # A plain INSERT fails if another desk already used the record ID
+                    for record in added:
+                        self.conn.execute(f"INSERT INTO {self.TABLES[record.KIND]} VALUES ({', '.join('?' * self.COLUMNS[record.KIND])})",
+                                          self.encoders[record.KIND](record))
+                    for record in changed:
+                        if self.conn.execute(f"DELETE FROM {self.TABLES[record.KIND]} WHERE id = ?", (record.id,)).rowcount != 1:
+                            raise VersionConflict(record.id)
+                        self.conn.execute(self.insert_sql(record.KIND), self.encoders[record.KIND](record))
+                    for record in closed:
+                        if self.conn.execute(f"DELETE FROM {self.TABLES[record.KIND]} WHERE id = ?", (record.id,)).rowcount != 1:
+                            raise VersionConflict(record.id)
+                    # Checked after the writes, which hold the write lock, so no desk can add a loan or hold in between
+                    for record in closed:
+                        if record.KIND == 'user' and self.conn.execute(
+                                "SELECT 1 FROM loans WHERE user_id = ? UNION ALL SELECT 1 FROM holds WHERE user_id = ? LIMIT 1",
+                                (record.id, record.id)).fetchone():
+                            raise VersionConflict(record.id)
+                    for record in added:
+                        if record.KIND in ('loan', 'hold') and not self.conn.execute(
+                                "SELECT 1 FROM users WHERE id = ?", (record.user_id,)).fetchone():
+                            raise VersionConflict(record.id)
+            except (VersionConflict, sqlite3.IntegrityError):
+                return False
+        return True
+        
+    def load_state(self, name: str) -> Optional[dict]:
+        """Read a named piece of bookkeeping state"""
+        row = self.query_one("SELECT data FROM state WHERE name = ?", (name,))
+        return json.loads(row[0]) if row else None
+    
+    def save_state(self, name: str, data: dict):
+        """Store a named piece of bookkeeping state"""
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, json.dumps(data)))
+            
+    def migrate_from_json(self, json_storage: JsonStorage) -> Dict[str, int]:
+        """One-shot copy of the JSON files (and pending journal) into the database"""
+        records = json_storage.load()
+        with self._lock, self.conn:
+            for kind, items in records.items():
+                self.conn.executemany(self.insert_sql(kind), (self.encoders[kind](r) for r in items.values()))
+        return {kind: len(items) for kind, items in records.items()}
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self.conn.close()
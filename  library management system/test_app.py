@@ -0,0 +1,938 @@
+"""
+Tests for the Library Management System
+
+    python -m pytest -q test_app.py
+"""
+
+import os
+import csv
+import json
+import random
+import datetime
+
+import pytest
+
+from app import (Book, User, Loan, Reservation, LoanStore, ReservationQueue, OverdueEngine, RankedCounter,
+                 BookSearchIndex, BinarySnapshot, JsonStorage, SqliteStorage, LibraryManager, LibraryError, MEMBER_TIERS)
+
+NOW = datetime.datetime(2025, 3, 10, 12, 0, 0)
+DAY = datetime.timedelta(days=1)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """The manager keeps its files in the working directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def random_loans(rng: random.Random, count: int) -> list:
+    """Loans spread over a few members and books, due up to a month either side of NOW"""
+    loans = []
+    for loan_id in range(1, count + 1):
+        due = NOW + datetime.timedelta(seconds=rng.randint(-30 * 86400, 30 * 86400))
+        loans.append(Loan(loan_id, rng.randint(1, 10), rng.randint(1, 20), due - 15 * DAY, due))
+    return loans
+
+
+def stocked_library(storage: str = 'json', **options) -> LibraryManager:
+    """A library with one three-copy book and three members"""
+    library = LibraryManager(storage=storage, **options)
+    library.books[1] = Book(1, "The Hobbit", "J. R. R. Tolkien", 3, 10.0)
+    library.search_index.add(library.books[1])
+    library.commit_book(1)
+    for user_id in (1, 2, 3):
+        library.users[user_id] = User(user_id, f"Member {user_id}")
+        library.commit_user(user_id)
+    return library
+
+
+# LoanStore
+
+def test_loan_store_indexes_follow_adds_and_removes():
+    rng = random.Random(1)
+    loans = random_loans(rng, 300)
+    store = LoanStore({loan.id: loan for loan in loans[:100]})
+    for loan in loans[100:]:
+        store.add(loan)
+    open_loans = {loan.id: loan for loan in loans}
+    for loan_id in rng.sample(sorted(open_loans), 150):
+        assert store.remove(loan_id) is open_loans.pop(loan_id)
+    assert store.remove(loans[0].id if loans[0].id not in open_loans else -1) is None
+
+    assert store.due_index == sorted((loan.due_date.timestamp(), loan.id) for loan in open_loans.values())
+    expected_overdue = sorted((loan for loan in open_loans.values() if loan.due_date < NOW),
+                              key=lambda loan: (loan.due_date, loan.id))
+    assert store.overdue(NOW) == expected_overdue
+    for user_id in range(1, 11):
+        held = [loan for loan in open_loans.values() if loan.user_id == user_id]
+        assert [loan.due_date for loan in store.for_user(user_id)] == sorted(loan.due_date for loan in held)
+        assert store.count_for_user(user_id) == len(held)
+        assert store.next_due(user_id) == min((loan.due_date.timestamp() for loan in held), default=float('inf'))
+    for book_id in range(1, 21):
+        assert store.copies_out(book_id) == sum(loan.book_id == book_id for loan in open_loans.values())
+    assert store.new_id() == 301
+
+
+def test_loan_store_find():
+    store = LoanStore()
+    store.add(Loan(1, 7, 3, NOW, NOW + DAY))
+    store.add(Loan(2, 7, 4, NOW, NOW + DAY))
+    assert store.find(7, 4).id == 2
+    assert store.find(7, 5) is None
+    store.remove(2)
+    assert store.find(7, 4) is None
+
+
+# ReservationQueue
+
+def reservation(reservation_id: int, user_id: int, book_id: int, minutes: int, tier: str = 'standard',
+                hold_until: datetime.datetime = None) -> Reservation:
+    return Reservation(reservation_id, user_id, book_id, NOW + datetime.timedelta(minutes=minutes), tier, hold_until)
+
+
+def test_waitlist_serves_tiers_then_request_time():
+    rng = random.Random(2)
+    queue = ReservationQueue()
+    waiting = []
+    for reservation_id in range(1, 61):
+        entry = reservation(reservation_id, reservation_id, 1, rng.randint(0, 20), rng.choice(list(MEMBER_TIERS)))
+        queue.add(entry)
+        waiting.append(entry)
+    expected = sorted(waiting, key=lambda r: (MEMBER_TIERS[r.tier], r.requested, r.id))
+    assert queue.waitlist(1) == expected
+
+    served = []
+    while queue.head(1) is not None:
+        head = queue.head(1)
+        served.append(head)
+        # Alternate between allocating a copy and cancelling, both take the member off the waitlist
+        if len(served) % 2:
+            queue.add(head.held_until(NOW + DAY))
+        else:
+            queue.remove(head.id)
+    assert served == expected
+    assert queue.waitlist(1) == []
+
+
+def test_waitlist_skips_entries_of_reused_ids():
+    queue = ReservationQueue()
+    queue.add(reservation(1, 1, 1, 0, 'staff'))
+    queue.add(reservation(2, 2, 1, 5))
+    queue.remove(1)
+    # Same ID, another book: the stale heap entry on book 1 must not resolve to it
+    queue.add(reservation(1, 3, 2, 10, 'staff'))
+    assert queue.head(1).id == 2
+    assert queue.head(2).user_id == 3
+
+
+def test_expired_holds_come_out_in_expiry_order_only_once_expired():
+    queue = ReservationQueue()
+    for reservation_id, hours in ((1, 5), (2, -3), (3, -1), (4, 2)):
+        queue.add(reservation(reservation_id, reservation_id, reservation_id, 0,
+                              hold_until=NOW + datetime.timedelta(hours=hours)))
+    expired = []
+    while True:
+        hold = queue.next_expired(NOW.timestamp())
+        if hold is None:
+            break
+        expired.append(hold.id)
+        queue.remove(hold.id)
+    assert expired == [2, 3]
+    assert [hold.id for hold in queue.held(1)] == [1]
+
+
+
+def test_held_and_for_book_follow_the_per_book_index():
+    rng = random.Random(6)
+    queue = ReservationQueue()
+    for reservation_id in range(1, 201):
+        held = NOW + datetime.timedelta(hours=rng.randint(1, 48)) if rng.random() < 0.3 else None
+        queue.add(reservation(reservation_id, reservation_id, rng.randint(1, 8), rng.randint(0, 100), hold_until=held))
+    for reservation_id in rng.sample(range(1, 201), 80):
+        queue.remove(reservation_id)
+    for book_id in range(1, 9):
+        by_scan = [r for r in queue.reservations.values() if r.book_id == book_id]
+        listed = queue.for_book(book_id)
+        assert [r.requested for r in listed] == sorted(r.requested for r in by_scan)
+        assert sorted(listed, key=lambda r: r.id) == by_scan
+        assert sorted(queue.held(book_id), key=lambda r: r.id) == [r for r in by_scan if r.hold_until is not None]
+    for closed in queue.for_book(3):
+        queue.remove(closed.id)
+    assert queue.for_book(3) == [] and queue.head(3) is None and 3 not in queue.waiting
+
+# OverdueEngine
+
+def fines_by_scan(loans: dict, overdue_ids: set, as_of: datetime.datetime, fine_per_day: int) -> int:
+    """Outstanding fines worked out loan by loan"""
+    return sum(max(0, (as_of - loans[loan_id].due_date).days) * fine_per_day for loan_id in overdue_ids)
+
+
+def test_outstanding_fines_match_a_loan_by_loan_scan():
+    rng = random.Random(3)
+    loans = {loan.id: loan for loan in random_loans(rng, 200)}
+    engine = OverdueEngine(list(loans.values())[:120], fine_per_day=3)
+    for loan in list(loans.values())[120:]:
+        engine.track(loan)
+    active = dict(loans)
+    reported = set()
+    accrued_total = 0
+
+    as_of = NOW - 20 * DAY
+    for step in range(12):
+        as_of += datetime.timedelta(seconds=rng.randint(3600, 4 * 86400))
+        for loan_id in rng.sample(sorted(active), 8):
+            engine.untrack(active.pop(loan_id))
+            reported.discard(loan_id)
+        notices, accrued = engine.run(as_of)
+        newly_overdue = {loan_id for loan_id, loan in active.items() if loan.due_date < as_of} - reported
+        assert set(notices) == newly_overdue
+        reported |= newly_overdue
+        accrued_total += accrued
+
+        assert engine.overdue_ids == reported
+        expected = fines_by_scan(loans, reported, as_of, 3)
+        assert engine.outstanding_fines(as_of.timestamp()) == expected
+        # Between runs too, at every second of the day
+        later = as_of + datetime.timedelta(seconds=rng.randint(0, 3 * 86400))
+        assert engine.outstanding_fines(later.timestamp()) == fines_by_scan(loans, reported, later, 3)
+
+    # Rebuilt from the persisted last run, the engine carries on with the same totals
+    restored = OverdueEngine(active.values(), 3, engine.last_run)
+    assert restored.overdue_ids == reported
+    assert restored.outstanding_fines(as_of.timestamp()) == expected
+
+
+def test_a_loan_due_exactly_at_a_run_is_reported_by_the_next_run_even_after_a_restart():
+    due = Loan(1, 1, 1, NOW - 15 * DAY, NOW)
+    engine = OverdueEngine([due], fine_per_day=3)
+    assert engine.run(NOW) == ([], 0)
+    # Restored from the persisted last run, the loan is still waiting for its notice
+    restored = OverdueEngine([due], 3, engine.last_run)
+    assert restored.overdue_ids == set()
+    assert restored.run(NOW + datetime.timedelta(seconds=1)) == ([1], 0)
+    assert restored.run(NOW + DAY) == ([], 3)
+
+
+def test_overdue_batch_reports_new_notices_and_accrued_fines(workdir):
+    library = stocked_library()
+    library.checkout(1, 1, NOW - 20 * DAY)
+    library.checkout(2, 1, NOW - 10 * DAY)
+    first = library.run_overdue_batch(NOW)
+    assert first[0] == f"Overdue run at {NOW.strftime('%d-%m-%Y %H:%M:%S')} (since the beginning)"
+    assert first[1] == "New overdue notices: 1"
+    assert first[4].split()[:2] == ['1', '1']
+    assert first[-3:] == ["Loans overdue: 1", "Fines accrued since last run: $15", "Outstanding fines: $15"]
+    library.close()
+
+    # The last run is persisted, the next batch only reports what changed since
+    reopened = LibraryManager()
+    second = reopened.run_overdue_batch(NOW + 7 * DAY)
+    assert second[0].endswith(f"(since {NOW.strftime('%d-%m-%Y %H:%M:%S')})")
+    assert second[1] == "New overdue notices: 1"
+    assert second[4].split()[:2] == ['2', '2']
+    assert second[-3:] == ["Loans overdue: 2", "Fines accrued since last run: $27", "Outstanding fines: $42"]
+    reopened.close()
+
+
+# RankedCounter
+
+def test_ranked_counter_top_matches_a_full_sort():
+    rng = random.Random(4)
+    counter = RankedCounter()
+    counts, reached = {}, {}
+    for step in range(3000):
+        key = rng.randint(1, 150) if rng.random() < 0.7 else rng.randint(1, 10)
+        counter.increment(key)
+        counts[key] = counts.get(key, 0) + 1
+        reached[key] = step
+    expected = sorted(counts.items(), key=lambda item: (-item[1], reached[item[0]]))
+    for limit in (1, 10, 100, 1000):
+        assert counter.top(limit) == expected[:limit]
+    assert counter.get(10 ** 6) == 0
+
+    restored = RankedCounter(counter.counts)
+    assert [count for _, count in restored.top(1000)] == [count for _, count in expected]
+    restored.increment(expected[-1][0])
+    assert restored.get(expected[-1][0]) == expected[-1][1] + 1
+
+
+# BookSearchIndex
+
+WORDS = ["the", "of", "garden", "secret", "river", "king", "shadow", "winter", "stone", "silver", "tale"]
+
+
+def random_catalog(rng: random.Random, count: int) -> list:
+    """Titles drawn from a few common words and many rare ones, so postings range from a handful to most books"""
+    words = WORDS + [f"rare{i}" for i in range(200)]
+    return [Book(book_id, ' '.join(rng.choice(WORDS if rng.random() < 0.6 else words) for _ in range(rng.randint(1, 5))),
+                 f"Author {rng.randint(1, 50)}", 1, 1.0) for book_id in range(1, count + 1)]
+
+
+def ranked_by_scan(index: BookSearchIndex, query: str, limit: int) -> list:
+    """Score every indexed book against every query token"""
+    tokens = index.tokenize(query)
+    matches = [index._matching_tokens(token) for token in tokens]
+    scores = {}
+    for book_id, (name_tokens, author_tokens, name) in index.entries.items():
+        score = sum(max([token_matches.get(token, 0.0) * index.NAME_WEIGHT for token in name_tokens] +
+                        [token_matches.get(token, 0.0) * index.AUTHOR_WEIGHT for token in author_tokens])
+                    for token_matches in matches)
+        if score:
+            scores[book_id] = score + (index.NAME_WEIGHT * len(tokens) if query.strip().lower() in name else 0.0)
+    return sorted(scores, key=lambda book_id: (-scores[book_id], index.entries[book_id][2], book_id))[:limit]
+
+
+QUERIES = ["the secret garden", "silver river", "tales", "rare7 of the", "kng shadw", "author 12 winter", "stone rare150"]
+
+
+def test_search_without_pruning_matches_a_full_scan(monkeypatch):
+    monkeypatch.setattr(BookSearchIndex, 'COMMON_SHARE', 1.0)
+    monkeypatch.setattr(BookSearchIndex, 'MAX_CANDIDATES', 10 ** 9)
+    index = BookSearchIndex()
+    index.rebuild(random_catalog(random.Random(4), 3000))
+    for query in QUERIES:
+        for limit in (1, 20, 5000):
+            assert index.search(query, limit) == ranked_by_scan(index, query, limit)
+
+
+def test_common_tokens_only_rank_the_books_rarer_tokens_found():
+    index = BookSearchIndex()
+    catalog = random_catalog(random.Random(5), 3000)
+    hobbits = [Book(3000 + i, f"The {word} hobbit", "J. R. R. Tolkien", 1, 1.0) for i, word in enumerate(WORDS[:8], 1)]
+    index.rebuild(catalog + hobbits)
+    # "the" is in most titles, so it is not walked once "hobbit" has found enough books
+    results = index.search("the hobbit", 5)
+    assert results == [book_id for book_id in ranked_by_scan(index, "the hobbit", 3000) if book_id > 3000][:5]
+    # Too few books for the limit, the common token fills the rest
+    results = index.search("the hobbit", 50)
+    assert sorted(results[:8]) == [book.id for book in hobbits]
+    assert len(results) == 50
+
+# BinarySnapshot
+
+def snapshot_records() -> dict:
+    books = {1: Book(1, "Café au lait: ünïcode & \"quotes\"", "", 2, 9.5), 7: Book(7, "Dune", "Frank Herbert", 4, 0.0, "9780441013593")}
+    books[1].copies_left, books[1].version = 0, 12
+    users = {3: User(3, "Ada"), 4: User(4, "Grace", 'staff')}
+    loans = {5: Loan(5, 3, 1, NOW, NOW + 15 * DAY)}
+    holds = {2: Reservation(2, 4, 1, NOW, 'staff'), 9: Reservation(9, 3, 7, NOW, 'standard', NOW + 3 * DAY)}
+    return {'book': books, 'user': users, 'loan': loans, 'hold': holds}
+
+
+def test_binary_snapshot_round_trip(tmp_path):
+    records = snapshot_records()
+    path = str(tmp_path / 'library.snap')
+    BinarySnapshot.write(path, {kind: {k: v.to_bytes() for k, v in items.items()} for kind, items in records.items()})
+
+    snapshot = BinarySnapshot(path)
+    for kind, cls in JsonStorage.RECORD_TYPES.items():
+        loaded = snapshot.records(kind, cls.from_bytes)
+        assert list(loaded) == sorted(records[kind])
+        assert len(loaded) == len(records[kind])
+        assert {k: v.to_dict() for k, v in loaded.items()} == {k: v.to_dict() for k, v in records[kind].items()}
+    assert 6 not in snapshot.records('book', Book.from_bytes)
+
+
+def test_binary_record_map_tracks_changes_over_the_snapshot(tmp_path):
+    records = snapshot_records()
+    path = str(tmp_path / 'library.snap')
+    BinarySnapshot.write(path, {kind: {k: v.to_bytes() for k, v in items.items()} for kind, items in records.items()})
+    books = BinarySnapshot(path).records('book', Book.from_bytes)
+    books[7].copies_left = 1
+    books[8] = Book(8, "Emma", "Jane Austen", 1, 4.0)
+    del books[1]
+    assert len(books) == 2 and 1 not in books
+    rewritten = {key: Book.from_bytes(data).to_dict() for key, data in books.encoded_items()}
+    assert rewritten == {7: books[7].to_dict(), 8: books[8].to_dict()}
+
+
+def test_binary_snapshot_storage_reloads_what_was_saved(workdir):
+    library = stocked_library(snapshot_format='binary')
+    library.checkout(1, 1, NOW)
+    library.close()
+    reopened = LibraryManager(snapshot_format='binary')
+    assert reopened.books[1].copies_left == 2
+    assert [loan.book_id for loan in reopened.loans.for_user(1)] == [1]
+    assert sorted(reopened.users) == [1, 2, 3]
+
+
+def test_search_index_saved_with_the_binary_snapshot_follows_every_save(workdir):
+    rng = random.Random(6)
+    library = LibraryManager(snapshot_format='binary')
+    for book in random_catalog(rng, 2000):
+        library.books[book.id] = book
+    library.storage.save('book')
+    library.close()
+
+    words = WORDS + [f"rare{i}" for i in range(200)]
+    for step in range(3):
+        library = LibraryManager(snapshot_format='binary')
+        for book_id in rng.sample(sorted(library.books), 60):
+            if rng.random() < 0.3:
+                del library.books[book_id]
+            elif rng.random() < 0.5:
+                library.books[book_id].name = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+            else:
+                library.books[book_id].copies_left = 0
+        for book_id in range(3000 + 10 * step, 3010 + 10 * step):
+            library.books[book_id] = Book(book_id, f"Fresh{step} {rng.choice(WORDS)}", f"Author {step}", 1, 1.0)
+        expected = BookSearchIndex()
+        expected.rebuild(library.books.values())
+        queries = QUERIES + [f"fresh{step}", f"fresh{step} the", "rare3"]
+        # The saved index is opened under the books changed since loading, then written forward by the save
+        assert [[book.id for book in library.find_books(query, 20)] for query in queries] == \
+            [expected.search(query, 20) for query in queries]
+        library.storage.save('book')
+        library.close()
+
+        reopened = LibraryManager(snapshot_format='binary')
+        assert [[book.id for book in reopened.find_books(query, 20)] for query in queries] == \
+            [expected.search(query, 20) for query in queries]
+        assert not isinstance(reopened.search_index.entries, dict)
+        assert reopened.search_index.size == len(expected.entries)
+        reopened.close()
+
+
+
+# Journal
+
+@pytest.mark.parametrize('snapshot_format', ['json', 'binary'])
+def test_journal_is_folded_in_by_a_process_that_does_not_journal(workdir, snapshot_format):
+    server = stocked_library(journal_mode=True, snapshot_format=snapshot_format)
+    server.checkout(1, 1, NOW)
+    server.close()
+    assert (workdir / 'library.journal').exists()
+
+    desk = LibraryManager(snapshot_format=snapshot_format)
+    assert desk.books[1].copies_left == 2
+    assert [loan.user_id for loan in desk.loans.for_book(1)] == [1]
+    assert not (workdir / 'library.journal').exists()
+    desk.checkin(1, 1, NOW)
+    desk.close()
+
+    # The folded journal is not replayed over the return saved after it
+    reopened = LibraryManager(snapshot_format=snapshot_format)
+    assert reopened.books[1].copies_left == 3
+    assert list(reopened.loans.for_book(1)) == []
+
+
+@pytest.mark.parametrize('snapshot_format', ['json', 'binary'])
+def test_background_compaction_keeps_every_change(workdir, snapshot_format):
+    library = stocked_library(journal_mode=True, journal_threshold=2048, snapshot_format=snapshot_format)
+    for book_id in range(2, 60):
+        library.books[book_id] = Book(book_id, f"Book {book_id}", "Author", 2, 5.0)
+        library.commit_book(book_id)
+        if book_id % 7 == 0:
+            library.checkout(book_id % 3 + 1, book_id, NOW)
+    library.close()
+    assert os.path.getsize('library.journal') < 2048
+    assert not os.path.exists('library.journal.old')
+
+    reopened = LibraryManager(journal_mode=True, snapshot_format=snapshot_format)
+    assert sorted(reopened.books) == list(range(1, 60))
+    assert [reopened.books[book_id].copies_left for book_id in (7, 8, 14)] == [1, 2, 1]
+    assert sum(1 for _ in reopened.loans.loans) == 8
+
+# Browsing
+
+@pytest.mark.parametrize('order', ['id', 'name', 'copies_left'])
+def test_pages_stay_in_place_while_books_are_added_and_removed(workdir, order):
+    rng = random.Random(9)
+    library = LibraryManager()
+    for book in random_catalog(rng, 300):
+        book.copies = book.copies_left = rng.randint(0, 5)
+        library.insert_book(book)
+    key = library.book_order.orders[order]
+    seen, untouched, added_ahead = [], set(library.books), set()
+    cursor, next_id = None, 1000
+    while True:
+        books, cursor = library.browse_books(order, cursor, 17)
+        seen.extend((key(book), book.id) for book in books)
+        if cursor is None:
+            break
+        # Other desks change the catalog between two pages
+        for _ in range(5):
+            book = Book(next_id, ' '.join(rng.choice(WORDS) for _ in range(2)), "New author", 1, 1.0)
+            next_id += 1
+            library.insert_book(book)
+            if (key(book), book.id) > cursor:
+                added_ahead.add(book.id)
+        for book_id in rng.sample(sorted(library.books), 3):
+            library.remove_book(book_id)
+            untouched.discard(book_id)
+            added_ahead.discard(book_id)
+        # Edits that leave the sort key alone keep the row where it is
+        for book_id in rng.sample(sorted(library.books), 3):
+            library.update_book(book_id, {'price': rng.uniform(1, 30)})
+        # The book the cursor stands on may go too, the next page starts after its place
+        if cursor[1] in library.books:
+            library.remove_book(cursor[1])
+            untouched.discard(cursor[1])
+
+    ids = [book_id for _, book_id in seen]
+    assert len(ids) == len(set(ids))
+    assert seen == sorted(seen)
+    assert untouched <= set(ids)
+    assert added_ahead <= set(ids)
+
+
+def test_members_by_due_date_follow_their_loans(workdir):
+    library = stocked_library()
+    library.books[1].copies = library.books[1].copies_left = 10
+    library.commit_book(1)
+    for user_id in range(4, 8):
+        library.users[user_id] = User(user_id, f"Member {user_id}")
+        library.commit_user(user_id)
+    assert [user.id for user in library.browse_users('due', limit=3)[0]] == [1, 2, 3]
+    for user_id, days in ((5, 3), (2, 1), (7, 2)):
+        library.checkout(user_id, 1, NOW + days * DAY)
+    users, cursor = library.browse_users('due', limit=3)
+    assert [user.id for user in users] == [2, 7, 5]
+    library.checkin(7, 1, NOW + 5 * DAY)
+    assert [user.id for user in library.browse_users('due', cursor, 3)[0]] == [1, 3, 4]
+    assert [user.id for user in library.browse_users('due', limit=3)[0]] == [2, 5, 1]
+
+
+# SQLite storage
+
+def records_of(library: LibraryManager) -> dict:
+    """Every record of a library as dicts, keyed by kind and ID"""
+    return {'book': {k: v.to_dict() for k, v in library.books.items()},
+            'user': {k: v.to_dict() for k, v in library.users.items()},
+            'loan': {k: v.to_dict() for k, v in library.loans.loans.items()},
+            'hold': {k: v.to_dict() for k, v in library.reservations.reservations.items()}}
+
+
+@pytest.mark.parametrize('snapshot_format', ['json', 'binary'])
+def test_migration_copies_every_record_including_the_pending_journal(workdir, snapshot_format):
+    rng = random.Random(7)
+    library = stocked_library(journal_mode=True, snapshot_format=snapshot_format)
+    for book in random_catalog(rng, 300)[1:]:
+        library.books[book.id] = book
+        library.commit_book(book.id)
+    library.users[4] = User(4, "Ada", 'premium')
+    library.commit_user(4)
+    for user_id in (1, 2, 3):
+        library.checkout(user_id, 1, NOW)
+    library.reserve(4, 1, NOW)
+    library.checkin(2, 1, NOW + DAY)
+    expected = records_of(library)
+    library.close()
+    # The last changes are only in the journal
+    assert (workdir / 'library.journal').exists()
+
+    database = SqliteStorage('library.db')
+    counts = database.migrate_from_json(JsonStorage(journal_mode=True, snapshot_format=snapshot_format))
+    database.close()
+    assert counts == {kind: len(records) for kind, records in expected.items()}
+    migrated = LibraryManager(storage='sqlite')
+    assert records_of(migrated) == expected
+    assert [r.user_id for r in migrated.reservations.held(1)] == [4]
+    assert [book.id for book in migrated.find_books("the hobbit", 1)] == [1]
+    migrated.close()
+
+
+def test_sqlite_storage_keeps_every_change_across_restarts(workdir):
+    library = stocked_library('sqlite')
+    library.checkout(1, 1, NOW)
+    library.update_book(1, {'name': "The Hobbit, or There and Back Again"})
+    library.insert_book(Book(2, "Farmer Giles of Ham", "J. R. R. Tolkien", 1, 8.0))
+    library.change_user_id(3, 30)
+    library.remove_user(2)
+    expected = records_of(library)
+    library.close()
+
+    reopened = LibraryManager(storage='sqlite')
+    assert records_of(reopened) == expected
+    assert sorted(reopened.users) == [1, 30]
+    assert reopened.books[1].copies_left == 2
+    assert [book.id for book in reopened.find_books("farmer giles")] == [2]
+    reopened.checkin(1, 1, NOW + DAY)
+    reopened.remove_book(2)
+    reopened.close()
+    again = LibraryManager(storage='sqlite')
+    assert sorted(again.books) == [1] and again.books[1].copies_left == 3 and not again.loans.loans
+    again.close()
+
+
+# Compare-and-swap between desks
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_compare_and_swap_refuses_a_stale_version(workdir, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    read_by_b = desk_b.books[1]
+
+    def taken(book: Book) -> Book:
+        updated = Book.from_dict(book.to_dict())
+        updated.copies_left -= 1
+        updated.version = book.version + 1
+        return updated
+
+    assert desk_a.storage.compare_and_swap(taken(desk_a.books[1]), desk_a.books[1].version)
+    assert not desk_b.storage.compare_and_swap(taken(read_by_b), read_by_b.version)
+    desk_b.sync()
+    assert desk_b.books[1].copies_left == 2
+    assert desk_b.books[1].version == read_by_b.version + 1
+    desk_a.close()
+    desk_b.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_checkout_retries_after_losing_a_race(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_b.storage.compare_and_swap
+    attempts = []
+
+    def racing(*args, **kwargs):
+        if not attempts:
+            # Desk A issues a copy between desk B reading the book and writing it
+            desk_a.checkout(1, 1, NOW)
+        attempts.append(args)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_b.storage, 'compare_and_swap', racing)
+    loan = desk_b.checkout(2, 1, NOW)
+    assert len(attempts) == 2
+
+    for desk in (desk_a, desk_b):
+        desk.sync()
+        assert desk.books[1].copies_left == 1
+        assert sorted((loan.user_id, loan.id) for loan in desk.loans.for_book(1)) == [(1, 1), (2, loan.id)]
+    assert loan.id != 1
+    desk_a.close()
+    desk_b.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_edit_keeps_copies_issued_at_another_desk(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_a.storage.compare_and_swap
+    attempts = []
+
+    def racing(*args, **kwargs):
+        if not attempts:
+            # Desk B issues a copy while desk A's edit of the book is in flight
+            desk_b.checkout(2, 1, NOW)
+        attempts.append(args)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_a.storage, 'compare_and_swap', racing)
+    desk_a.update_book(1, {'name': "The Hobbit, or There and Back Again", 'copies': 4})
+    assert len(attempts) == 2
+
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        book = desk.books[1]
+        assert (book.name, book.copies, book.copies_left, book.version) == ("The Hobbit, or There and Back Again", 4, 3, 3)
+        assert [book.id for book in desk.find_books("there and back")] == [1]
+        desk.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_two_desks_on_one_directory_keep_each_others_edit_and_issue(workdir, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    # Both desks have read the book, then each writes its own change without looking again
+    desk_b.checkout(1, 1, NOW)
+    desk_a.update_book(1, {'price': 12.5})
+    desk_b.checkout(2, 1, NOW)
+
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        book = desk.books[1]
+        assert (book.price, book.copies_left, desk.loans.copies_out(1)) == (12.5, 1, 2)
+        desk.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_adding_a_book_id_another_desk_just_added_is_refused(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_b.storage.compare_and_swap
+
+    def racing(*args, **kwargs):
+        desk_a.insert_book(Book(2, "Farmer Giles of Ham", "J. R. R. Tolkien", 1, 8.0))
+        monkeypatch.setattr(desk_b.storage, 'compare_and_swap', swap)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_b.storage, 'compare_and_swap', racing)
+    with pytest.raises(LibraryError, match="already exists"):
+        desk_b.insert_book(Book(2, "Smith of Wootton Major", "J. R. R. Tolkien", 2, 9.0))
+
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        assert desk.books[2].name == "Farmer Giles of Ham"
+        assert [book.id for book in desk.find_books("farmer giles")] == [2]
+        desk.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_deleting_a_book_another_desk_just_issued_is_refused(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_b.storage.compare_and_swap
+
+    def racing(*args, **kwargs):
+        desk_a.checkout(1, 1, NOW)
+        monkeypatch.setattr(desk_b.storage, 'compare_and_swap', swap)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_b.storage, 'compare_and_swap', racing)
+    with pytest.raises(LibraryError, match="on loan"):
+        desk_b.remove_book(1)
+
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        assert desk.books[1].copies_left == 2 and desk.loans.copies_out(1) == 1
+        desk.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_member_id_change_is_refused_once_another_desk_issues_them_a_book(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_b.storage.compare_and_swap
+
+    def racing(*args, **kwargs):
+        desk_a.checkout(1, 1, NOW)
+        monkeypatch.setattr(desk_b.storage, 'compare_and_swap', swap)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_b.storage, 'compare_and_swap', racing)
+    with pytest.raises(LibraryError, match="Return the user's books"):
+        desk_b.change_user_id(1, 10)
+    with pytest.raises(LibraryError, match="already exists"):
+        desk_b.change_user_id(2, 3)
+    assert desk_b.change_user_id(2, 20).name == desk_a.users[2].name
+
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        assert sorted(desk.users) == [1, 3, 20]
+        assert [loan.user_id for loan in desk.loans.for_book(1)] == [1]
+        desk.close()
+
+
+def test_edit_refuses_fewer_copies_than_are_out(workdir):
+    library = stocked_library()
+    library.checkout(1, 1, NOW)
+    library.checkout(2, 1, NOW)
+    with pytest.raises(LibraryError):
+        library.update_book(1, {'copies': 1})
+    library.update_book(1, {'copies': 2, 'price': 12.5})
+    assert (library.books[1].copies, library.books[1].copies_left, library.books[1].price) == (2, 0, 12.5)
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_deleting_a_book_closes_its_waitlist_and_holds(workdir, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_a.books[2] = Book(2, "Farmer Giles of Ham", "J. R. R. Tolkien", 1, 8.0)
+    desk_a.commit_book(2)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    desk_a.checkout(1, 2, NOW)
+    desk_a.reserve(2, 2, NOW)
+    desk_a.reserve(3, 2, NOW + DAY)
+    desk_a.checkin(1, 2, NOW + DAY)
+    desk_b.sync()
+    assert [r.user_id for r in desk_b.reservations.held(2)] == [2]
+
+    assert [r.user_id for r in desk_a.remove_book(2)] == [2, 3]
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        assert 2 not in desk.books
+        assert desk.reservations.for_book(2) == [] and desk.reservations.for_user(2) == []
+        desk.close()
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_added_copies_are_held_for_the_head_of_the_waitlist(workdir, storage, concurrent):
+    library = stocked_library(storage, concurrent=concurrent)
+    for user_id in (1, 2, 3):
+        library.checkout(user_id, 1, NOW)
+    for user_id, tier in ((4, 'standard'), (5, 'premium'), (6, 'standard')):
+        library.users[user_id] = User(user_id, f"Member {user_id}", tier)
+        library.commit_user(user_id)
+        library.reserve(user_id, 1, NOW + user_id * DAY)
+
+    library.update_book(1, {'copies': 6}, NOW + 10 * DAY)
+    library.close()
+    reopened = LibraryManager(storage=storage, concurrent=concurrent)
+    # Premium member 5 first, then 4 who asked before 6; the third copy goes to 6, nothing is left on the shelf
+    assert sorted(r.user_id for r in reopened.reservations.held(1)) == [4, 5, 6]
+    assert all(r.hold_until == NOW + (10 + reopened.hold_days) * DAY for r in reopened.reservations.held(1))
+    assert (reopened.books[1].copies, reopened.books[1].copies_left) == (6, 0)
+    reopened.update_book(1, {'copies': 7}, NOW + 10 * DAY)
+    assert reopened.books[1].copies_left == 1
+    reopened.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_added_copy_goes_to_the_head_of_the_queue_first(workdir, storage):
+    library = stocked_library(storage)
+    for user_id in (1, 2, 3):
+        library.checkout(user_id, 1, NOW)
+    for user_id, tier in ((4, 'standard'), (5, 'premium')):
+        library.users[user_id] = User(user_id, f"Member {user_id}", tier)
+        library.commit_user(user_id)
+        library.reserve(user_id, 1, NOW + user_id * DAY)
+    library.update_book(1, {'copies': 4}, NOW + 10 * DAY)
+    assert [r.user_id for r in library.reservations.held(1)] == [5]
+    assert [r.user_id for r in library.reservations.waitlist(1)] == [4]
+    library.close()
+
+
+def test_member_with_reservations_keeps_their_id(workdir):
+    library = stocked_library()
+    for user_id in (1, 2, 3):
+        library.checkout(user_id, 1, NOW)
+    library.users[4] = User(4, "Member 4")
+    library.commit_user(4)
+    library.reserve(4, 1, NOW)
+    with pytest.raises(LibraryError, match="reservations"):
+        library.change_user_id(4, 40)
+    assert library.reservations.find(4, 1) is not None
+    library.cancel_reservation(4, 1, NOW)
+    assert library.change_user_id(4, 40).id == 40
+    library.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_deleting_a_member_another_desk_just_queued_is_refused(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    for user_id in (1, 2, 3):
+        desk_a.checkout(user_id, 1, NOW)
+    desk_a.users[4] = User(4, "Member 4")
+    desk_a.commit_user(4)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_b.storage.compare_and_swap
+
+    def racing(*args, **kwargs):
+        desk_a.reserve(4, 1, NOW)
+        monkeypatch.setattr(desk_b.storage, 'compare_and_swap', swap)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_b.storage, 'compare_and_swap', racing)
+    with pytest.raises(LibraryError, match="reservations"):
+        desk_b.remove_user(4)
+    desk_b.sync()
+    assert 4 in desk_b.users and desk_b.reservations.find(4, 1) is not None
+    desk_a.close()
+    desk_b.close()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_a_member_another_desk_deleted_cannot_borrow(workdir, monkeypatch, storage):
+    desk_a = stocked_library(storage, concurrent=True)
+    desk_b = LibraryManager(storage=storage, concurrent=True)
+    swap = desk_b.storage.compare_and_swap
+
+    def racing(*args, **kwargs):
+        desk_a.remove_user(3)
+        monkeypatch.setattr(desk_b.storage, 'compare_and_swap', swap)
+        return swap(*args, **kwargs)
+
+    monkeypatch.setattr(desk_b.storage, 'compare_and_swap', racing)
+    with pytest.raises(LibraryError, match="User ID does not exist"):
+        desk_b.checkout(3, 1, NOW)
+    reopened = LibraryManager(storage=storage, concurrent=True)
+    for desk in (desk_a, desk_b, reopened):
+        desk.sync()
+        assert 3 not in desk.users
+        assert desk.books[1].copies_left == 3 and desk.loans.copies_out(1) == 0
+        desk.close()
+
+
+def test_concurrent_desks_never_lend_more_copies_than_exist(workdir):
+    desks = [stocked_library(concurrent=True)] + [LibraryManager(concurrent=True) for _ in range(2)]
+    for user_id in range(4, 10):
+        desks[0].users[user_id] = User(user_id, f"Member {user_id}")
+        desks[0].commit_user(user_id)
+    issued = 0
+    for user_id in range(1, 10):
+        try:
+            desks[user_id % 3].checkout(user_id, 1, NOW)
+            issued += 1
+        except LibraryError:
+            pass
+    assert issued == 3
+    for desk in desks:
+        desk.sync()
+        assert desk.books[1].copies_left == 0
+        assert desk.loans.copies_out(1) == 3
+        desk.close()
+
+
+# Catalog import and export
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+@pytest.mark.parametrize('extension', ['csv', 'jsonl'])
+def test_import_skips_duplicates_and_bad_rows_and_persists_per_batch(workdir, monkeypatch, storage, extension):
+    library = stocked_library(storage)
+    library.books[2] = Book(2, "Farmer Giles of Ham", "J. R. R. Tolkien", 1, 8.0, "9780261102927")
+    library.commit_book(2)
+    rows = [
+        {'id': 10, 'name': "Leaf by Niggle", 'author': "J. R. R. Tolkien", 'copies': 2, 'price': 6.5, 'isbn': "978-0-00-000010-1"},
+        {'id': 11, 'name': "Roverandom", 'author': "J. R. R. Tolkien", 'copies': 1, 'price': 7.0, 'isbn': ""},
+        {'id': 10, 'name': "Same ID in the batch", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': ""},
+        {'id': 12, 'name': "Same ISBN in the batch", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': "9780000000101"},
+        {'id': 1, 'name': "ID already in the catalog", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': ""},
+        {'id': 13, 'name': "ISBN already in the catalog", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': "978 0261 102927"},
+        {'id': 'x', 'name': "Bad ID", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': ""},
+        {'id': 14, 'name': "", 'author': "No name", 'copies': 1, 'price': 1.0, 'isbn': ""},
+        {'id': 15, 'name': "Bilbo's Last Song", 'author': "J. R. R. Tolkien", 'copies': 3, 'price': 9.0, 'isbn': "9780000000150"},
+        {'id': 10, 'name': "ID of the first batch again", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': ""},
+        {'id': 11, 'name': "Roverandom again", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': ""},
+        {'id': 17, 'name': "ISBN of the first batch again", 'author': "", 'copies': 1, 'price': 1.0, 'isbn': "9780000000101"},
+    ]
+    path = str(workdir / f"catalog.{extension}")
+    with open(path, 'w', newline='') as f:
+        if extension == 'jsonl':
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+        else:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    batches = []
+    put_many = library.storage.put_many
+    monkeypatch.setattr(library.storage, 'put_many', lambda kind, books: (batches.append(len(books)), put_many(kind, books)))
+    stats = library.import_catalog(path, batch_size=4, progress=lambda line: None)
+    assert {key: stats[key] for key in ('read', 'imported', 'duplicates', 'invalid')} == \
+        {'read': 12, 'imported': 3, 'duplicates': 7, 'invalid': 2}
+    # One write per batch that had anything new
+    assert batches == [2, 1]
+    assert [book.id for book in library.find_books("roverandom")] == [11]
+    library.close()
+
+    reopened = LibraryManager(storage=storage)
+    assert sorted(reopened.books) == [1, 2, 10, 11, 15]
+    assert reopened.books[10].isbn == "9780000000101" and reopened.books[11].isbn is None
+    assert reopened.books[10].name == "Leaf by Niggle"
+    reopened.close()
+
+
+@pytest.mark.parametrize('extension', ['csv', 'jsonl'])
+def test_export_then_import_gives_back_the_catalog(workdir, extension):
+    rng = random.Random(8)
+    library = LibraryManager()
+    for book in random_catalog(rng, 500):
+        book.isbn = f"97800000{book.id:05d}" if book.id % 3 else None
+        book.copies, book.copies_left = 3, rng.randint(0, 3)
+        library.books[book.id] = book
+    path = str(workdir / f"catalog.{extension}")
+    assert library.export_catalog(path) == 500
+
+    fresh = LibraryManager(db_file='other.db', storage='sqlite')
+    stats = fresh.import_catalog(path, batch_size=64, progress=lambda line: None)
+    assert (stats['imported'], stats['duplicates'], stats['invalid']) == (500, 0, 0)
+    assert {book_id: book.to_dict() for book_id, book in fresh.books.items()} == \
+        {book_id: {**book.to_dict(), 'version': 0} for book_id, book in library.books.items()}
+    fresh.close()
@@ -0,0 +1,144 @@
+"""
+Tests for the Library Management System HTTP service
+
+    python -m pytest -q test_server.py
+"""
+
+import json
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from app import CirculationLog, LibraryError
+from server import LibraryRequestHandler, LibraryService
+from test_app import stocked_library, workdir  # noqa: F401 (fixture)
+
+
+@pytest.fixture
+def served(workdir):
+    """A stocked library behind the HTTP handler on a free port"""
+    service = LibraryService(stocked_library())
+    handler = type('Handler', (LibraryRequestHandler,), {'service': service, 'log_message': lambda *args: None})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield service, server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def request(port: int, method: str, path: str, payload=None):
+    """Status and decoded JSON body of one request"""
+    connection = HTTPConnection('127.0.0.1', port)
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8') if payload is not None else None
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def test_circulation_appends_leave_the_state_lock_to_the_storage_writer(workdir, monkeypatch):
+    service = LibraryService(stocked_library())
+    appended = []
+    append = CirculationLog.append
+
+    def recording(log, event):
+        appended.append((event['event'], threading.current_thread()))
+        append(log, event)
+
+    monkeypatch.setattr(CirculationLog, 'append', recording)
+    service.issue(1, 1)
+    service.collect(1, 1)
+    assert [event['event'] for event, _ in service.library.circulation_log.read_from(0)] == ['issue', 'return']
+    service.library.storage.flush()
+    # Written by the storage writer thread, not by the mutation holding the state lock
+    assert appended == [('issue', service.library.storage.thread), ('return', service.library.storage.thread)]
+    assert service.library.top_titles() == [(1, 1)]
+    service.close()
+
+
+def test_circulation_reads_do_not_wait_for_the_storage_writer(workdir):
+    service = LibraryService(stocked_library())
+    log = service.library.circulation_log
+    service.issue(1, 1)
+    service.library.storage.flush()
+    release = threading.Event()
+    service.library.storage.queue(release.wait)
+    service.collect(1, 1)
+    service.issue(2, 1)
+
+    # The writer is stuck behind the blocked write, the queued events are read from memory
+    events = list(log.read_from(0))
+    assert [event['event'] for event, _ in events] == ['issue', 'return', 'issue']
+    assert [event['event'] for event, _ in log.read_from(events[0][1])] == ['return', 'issue']
+    assert service.library.top_titles() == [(1, 2)]
+    release.set()
+    service.library.storage.flush()
+    # Once written the file holds the same events at the same offsets
+    assert list(log.read_from(0)) == events == list(CirculationLog(log.path).read_from(0))
+    service.close()
+
+
+def test_mutations_run_one_at_a_time_on_the_writer_thread(workdir):
+    service = LibraryService(stocked_library())
+    threads = []
+    run = service.library.checkout
+
+    def checkout(*args):
+        threads.append(threading.current_thread())
+        return run(*args)
+
+    service.library.checkout = checkout
+    outcomes = []
+
+    def issue(user_id: int):
+        try:
+            outcomes.append(service.issue(user_id, 1)['loan']['user_id'])
+        except LibraryError as e:
+            outcomes.append(str(e))
+
+    clients = [threading.Thread(target=issue, args=(user_id,)) for user_id in (1, 2, 3, 1)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    assert sorted(outcome for outcome in outcomes if isinstance(outcome, int)) == [1, 2, 3]
+    assert outcomes.count("User already holds a copy of this book!") == 1
+    assert set(threads) == {service.writer}
+    assert service.library.books[1].copies_left == 0
+    service.close()
+
+
+def test_http_mutations_answer_with_json(served):
+    service, port = served
+    status, body = request(port, 'POST', '/issue', {'user_id': 1, 'book_id': 1})
+    assert status == 200 and body['loan']['user_id'] == 1
+    request(port, 'POST', '/issue', {'user_id': 2, 'book_id': 1})
+    request(port, 'POST', '/issue', {'user_id': 3, 'book_id': 1})
+    assert request(port, 'POST', '/issue', {'user_id': 2, 'book_id': 1}) == (409, {'error': "User already holds a copy of this book!"})
+    status, body = request(port, 'POST', '/reserve', {'user_id': 2, 'book_id': 1})
+    assert status == 409
+
+    status, body = request(port, 'POST', '/collect', {'user_id': 1, 'book_id': 1})
+    assert status == 200 and body['fine'] == 0 and body['hold'] is None
+    status, body = request(port, 'GET', '/users/1')
+    assert status == 200 and body['loans'] == []
+
+    assert request(port, 'POST', '/issue', b'not json')[0] == 400
+    assert request(port, 'POST', '/issue', {'user_id': 1})[0] == 400
+    assert request(port, 'POST', '/renew', {'user_id': 1, 'book_id': 1})[0] == 404
+
+
+def test_an_unexpected_error_is_a_json_500(served, monkeypatch):
+    service, port = served
+
+    def failing(user_id: int, book_id: int):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(service, 'issue', failing)
+    assert request(port, 'POST', '/issue', {'user_id': 1, 'book_id': 1}) == (500, {'error': "Internal error"})
+    # The server keeps answering
+    assert request(port, 'GET', '/books?q=hobbit')[0] == 200
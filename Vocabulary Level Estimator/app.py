@@ -6,8 +6,9 @@ Streamlit Web Interface for CEFR Vocabulary Level Estimator
 This script creates an interactive web application using Streamlit to estimate the CEFR vocabulary level of a given text.
 """
 
+import os
 import streamlit as st
-from main import CEFRVocabularyEstimator
+from main import DEFAULT_CACHE_DIR, CEFRVocabularyEstimator, ResultCache
 import matplotlib.pyplot as plt
 import seaborn as sns
 from io import BytesIO
@@ -16,11 +17,18 @@ import base64
 # Global estimator instance
 estimator = None
 
+@st.cache_resource
+def load_estimator():
+    """Build one estimator per server process, kept across reruns, with results cached on disk."""
+    result_cache = ResultCache(os.path.join(DEFAULT_CACHE_DIR, "results.sqlite"))
+    # Sessions run in threads; concurrent analyses share transformer batches
+    return CEFRVocabularyEstimator(result_cache=result_cache, batch_window=0.005)
+
 def initialize_estimator():
     """Initialize the CEFR estimator."""
     global estimator
     if estimator is None:
-        estimator = CEFRVocabularyEstimator()
+        estimator = load_estimator()
     return estimator
 
 def create_visualization(result):
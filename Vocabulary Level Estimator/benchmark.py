@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the CEFR Vocabulary Level Estimator
+
+    python benchmark.py analysis --mb 1 4 --repeat 3
+    python benchmark.py backends --texts 200 --threads 1 4
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import tempfile
+import statistics
+from typing import Callable, Dict, List, Optional
+
+from main import CEFR_LEVELS, CEFRVocabularyEstimator, _AnalysisAccumulator, export_onnx
+
+
+def synthetic_text(size: int, estimator: CEFRVocabularyEstimator, seed: int = 1) -> str:
+    """
+    Deterministic English-like text of about size characters.
+
+    Listed words of every level are mixed with stop words and invented
+    unlisted words, so every branch of the word leveling is exercised.
+    """
+    rng = random.Random(seed)
+    vocabulary = sorted(word for words in estimator.vocabulary_lists.values() for word in words)
+    stop_words = ['the', 'a', 'of', 'and', 'to', 'in', 'is', 'it', 'that', 'was']
+    unlisted = [f"{word}ness" for word in vocabulary[::7]] + [f"re{word}ed" for word in vocabulary[::11]]
+    sentences = []
+    length = 0
+    while length < size:
+        words = [rng.choice(stop_words) if rng.random() < 0.4 else
+                 rng.choice(unlisted) if rng.random() < 0.1 else rng.choice(vocabulary)
+                 for _ in range(rng.randint(5, 25))]
+        sentence = ' '.join(words).capitalize() + rng.choice('..!?') + ' '
+        sentences.append(sentence)
+        length += len(sentence)
+    return ''.join(sentences)
+
+
+def best_of(func: Callable, repeat: int) -> float:
+    """Fastest of repeat runs, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def analysis_benchmark(sizes: List[float], repeat: int) -> List[Dict]:
+    """
+    Per-MB cost of each tokenizer and of the vocabulary and complexity pass.
+
+    The separate passes are what `analyze_text` used to run (level estimate,
+    then each complexity metric over the word list); the fused pass is the
+    single traversal it runs now.
+    """
+    estimator = CEFRVocabularyEstimator()
+    estimator.token_levels  # Leveling tables are built once, outside the timings
+
+    tokenizers = {'regex': estimator.regex_tokenize}
+    if estimator.nltk_tokenizers:
+        # Timed through NLTK directly, tokenize_text prefers spaCy when it is installed
+        word_tokenize, sent_tokenize = estimator.nltk_tokenizers
+        tokenizers['nltk'] = lambda text: ([word.lower() for word in word_tokenize(text) if word.isalpha()],
+                                           sent_tokenize(text))
+    if estimator.nlp:
+        estimator.nlp.max_length = 10 ** 9
+        tokenizers['spacy'] = lambda text: estimator._tokens_from_doc(estimator.nlp(text))
+
+    results = []
+    for mb in sizes:
+        text = estimator.preprocess_text(synthetic_text(int(mb * 1024 * 1024), estimator))
+        megabytes = len(text.encode('utf-8')) / (1024 * 1024)
+        row = {'mb': round(megabytes, 2)}
+        for name, tokenize in tokenizers.items():
+            row[f'tokenize_{name}'] = best_of(lambda: tokenize(text), repeat) / megabytes
+
+        words, sentences = estimator.regex_tokenize(text)
+        # Warm the unlisted-word memo so both passes see the same state
+        estimator.estimate_level_from_vocabulary(words)
+
+        def separate():
+            estimator.estimate_level_from_vocabulary(words)
+            estimator.calculate_complexity_metrics(words, sentences)
+
+        def fused():
+            accumulator = _AnalysisAccumulator(estimator)
+            accumulator.add(words, sentences)
+            accumulator.complexity_metrics()
+
+        row['metrics_separate'] = best_of(separate, repeat) / megabytes
+        row['metrics_fused'] = best_of(fused, repeat) / megabytes
+        results.append(row)
+    return results
+
+
+def tiny_model(directory: str, estimator: CEFRVocabularyEstimator):
+    """
+    Save a small randomly initialized BERT classifier with the CEFR labels.
+
+    Its word-level vocabulary comes from the estimator's word lists, so it
+    needs no download; predictions are meaningless but deterministic, which
+    is all a latency and agreement comparison needs.
+    """
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    os.makedirs(directory, exist_ok=True)
+    vocabulary = sorted({word for words in estimator.vocabulary_lists.values() for word in words})
+    vocab_file = os.path.join(directory, "vocab.txt")
+    with open(vocab_file, 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', '.', ',', '!', '?'] + vocabulary) + '\n')
+    tokenizer = BertTokenizerFast(vocab_file=vocab_file, model_max_length=128)
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=128, max_position_embeddings=128, num_labels=len(CEFR_LEVELS),
+                        id2label=dict(enumerate(CEFR_LEVELS)), label2id={level: i for i, level in enumerate(CEFR_LEVELS)})
+    BertForSequenceClassification(config).eval().save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+
+
+def backend_benchmark(model_dir: Optional[str], count: int, threads: List[int], repeat: int) -> List[Dict]:
+    """
+    Latency and agreement of each classifier backend against fp32 PyTorch.
+
+    Each backend classifies the same texts one at a time (p50/p95 latency)
+    and as one batch (texts per second). Agreement is the share of texts
+    given the same level as the fp32 pipeline, and score drift the mean
+    absolute difference of the confidence.
+    """
+    workdir = tempfile.mkdtemp(prefix="cefr-backends-")
+    probe = CEFRVocabularyEstimator(offline=True)
+    if model_dir is None:
+        model_dir = os.path.join(workdir, "tiny")
+        tiny_model(model_dir, probe)
+    onnx_dir, onnx_int8_dir = os.path.join(workdir, "onnx"), os.path.join(workdir, "onnx-int8")
+    export_onnx(model_dir, onnx_dir)
+    export_onnx(model_dir, onnx_int8_dir, quantize=True)
+
+    texts = [synthetic_text(size, probe, seed) for seed, size in enumerate(([200, 600, 1500] * count)[:count])]
+    variants = [('pytorch', 'pytorch', model_dir), ('int8', 'int8', model_dir),
+                ('onnx', 'onnx', onnx_dir), ('onnx-int8', 'onnx', onnx_int8_dir)]
+
+    results = []
+    for thread_count in threads:
+        reference = None
+        for name, backend, directory in variants:
+            estimator = CEFRVocabularyEstimator(offline=True, backend=backend, backend_dir=directory, threads=thread_count)
+            if not estimator.classifier:
+                continue
+            estimator.estimate_levels_with_transformer(texts[:4])  # Warm-up
+
+            latencies = []
+            for text in texts:
+                started = time.perf_counter()
+                estimator.estimate_level_with_transformer(text)
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            batch_seconds = best_of(lambda: estimator.estimate_levels_with_transformer(texts), repeat)
+            predictions = estimator.estimate_levels_with_transformer(texts)
+            if reference is None:
+                reference = predictions
+
+            results.append({
+                'backend': name,
+                'threads': thread_count,
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+                'texts_per_second': len(texts) / batch_seconds,
+                'agreement': sum(a[0] == b[0] for a, b in zip(predictions, reference)) / len(texts),
+                'score_drift': statistics.mean(abs(a[1] - b[1]) for a, b in zip(predictions, reference)),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CEFR Vocabulary Level Estimator benchmarks")
+    sub = parser.add_subparsers(dest='command', required=True)
+    analysis = sub.add_parser('analysis', help="per-MB cost of tokenization and of the metric pass")
+    analysis.add_argument('--mb', type=float, nargs='+', default=[1, 4], help="text sizes in megabytes")
+    analysis.add_argument('--repeat', type=int, default=3, help="runs per measurement, the fastest is reported")
+    analysis.add_argument('--json', action='store_true', help="print machine-readable output")
+    backends = sub.add_parser('backends', help="latency and agreement of the classifier backends")
+    backends.add_argument('--model-dir', help="local transformers model to compare (default: a tiny generated one)")
+    backends.add_argument('--texts', type=int, default=200, help="texts classified per backend")
+    backends.add_argument('--threads', type=int, nargs='+', default=[1], help="thread counts to compare")
+    backends.add_argument('--repeat', type=int, default=3, help="timed batch runs, the fastest is reported")
+    backends.add_argument('--json', action='store_true', help="print machine-readable output")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.command == 'analysis':
+        results = analysis_benchmark(args.mb, args.repeat)
+        if args.json:
+            print(json.dumps(results))
+        else:
+            stages = [key for key in results[0] if key != 'mb']
+            print(f"{'MB':>6} " + ' '.join(f"{stage:>18}" for stage in stages))
+            for row in results:
+                print(f"{row['mb']:>6.2f} " + ' '.join(f"{row[stage] * 1000:>15.1f} ms" for stage in stages))
+            print("(milliseconds per MB of text, lower is better)")
+    elif args.command == 'backends':
+        results = backend_benchmark(args.model_dir, args.texts, args.threads, args.repeat)
+        if args.json:
+            print(json.dumps(results))
+        else:
+            print(f"{'Backend':<10} {'Threads':>7} {'p50 ms':>8} {'p95 ms':>8} {'Texts/s':>9} {'Agree':>7} {'Drift':>7}")
+            for row in results:
+                print(f"{row['backend']:<10} {row['threads']:>7} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                      f"{row['texts_per_second']:>9.1f} {row['agreement']:>6.1%} {row['score_drift']:>7.4f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,31 +10,44 @@ Author: Assistant
 Date: 2025
 """
 
+import os
 import re
 import json
+import time
+import sqlite3
+import hashlib
+import inspect
 import logging
-from typing import Dict, List, Tuple, Optional, Union
-from collections import Counter, defaultdict
-from dataclasses import dataclass
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import asdict, dataclass, replace
 import statistics
+from functools import lru_cache
 
-# External libraries
-try:
-    import nltk
-    from nltk.tokenize import word_tokenize, sent_tokenize
-    from nltk.corpus import stopwords
-    from nltk.stem import WordNetLemmatizer
-    import spacy
-    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-except ImportError as e:
-    print(f"Missing required libraries. Please install: {e}")
-    print("Run: pip install nltk spacy transformers torch")
-    exit(1)
+# External libraries (nltk, spacy, transformers) are imported when the component
+# that needs them is first used, so the CLI starts instantly and `--help` loads nothing.
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Local copies of NLTK data and models live here, so later starts never touch the network
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CEFR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cefr-estimator")
+)
+
+# NLTK packages and the resource path that shows they are already installed
+NLTK_RESOURCES = {
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet',
+    'punkt': 'tokenizers/punkt',
+    'punkt_tab': 'tokenizers/punkt_tab',
+}
+
+# CEFR level hierarchy, lowest first
+CEFR_LEVELS = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']
+
 @dataclass
 class TextAnalysisResult:
     """Data class to store text analysis results."""
@@ -49,68 +62,862 @@ class TextAnalysisResult:
     representative_words: Dict[str, List[str]]
     complexity_metrics: Dict[str, float]
 
+class _AnalysisAccumulator:
+    """
+    Running totals of a text analyzed piece by piece.
+    
+    Counts, level histogram, representative words and the sums behind the
+    complexity metrics are merged as each piece arrives, so a text of any
+    length is analyzed without holding its words in memory. Only the table
+    of distinct words grows, bounded by the vocabulary of the text.
+    
+    Each word is visited once: its level, length and syllable count are
+    worked out the first time it appears and looked up afterwards.
+    """
+    
+    def __init__(self, estimator: 'CEFRVocabularyEstimator'):
+        self.estimator = estimator
+        self.word_count = 0
+        self.sentence_count = 0
+        self.level_counts: Counter = Counter()
+        self.representative_words: Dict[str, List[str]] = defaultdict(list)
+        # Distinct words seen so far -> (level, length, syllables)
+        self.profiles: Dict[str, Tuple[str, int, int]] = {}
+        self.total_word_length = 0
+        self.long_words = 0
+        self.total_syllables = 0
+    
+    def add(self, words: List[str], sentences: List[str]):
+        """
+        Merge the words and sentences of one piece of the text.
+        
+        Args:
+            words: Lowercased words of the piece
+            sentences: Sentences of the piece
+        """
+        self.word_count += len(words)
+        self.sentence_count += len(sentences)
+        
+        profiles = self.profiles
+        word_profile = self.estimator.word_profile
+        level_counts = self.level_counts
+        representative_words = self.representative_words
+        total_length = total_syllables = long_words = 0
+        for word in words:
+            profile = profiles.get(word)
+            if profile is None:
+                profile = profiles[word] = word_profile(word)
+            level, length, syllables = profile
+            total_length += length
+            total_syllables += syllables
+            if length > 6:
+                long_words += 1
+            if level:
+                level_counts[level] += 1
+                # Keep representative words (limit to avoid clutter)
+                representative = representative_words[level]
+                if len(representative) < 10:
+                    representative.append(word)
+        
+        self.total_word_length += total_length
+        self.total_syllables += total_syllables
+        self.long_words += long_words
+    
+    def complexity_metrics(self) -> Dict[str, float]:
+        """Complexity metrics of everything added so far."""
+        if not self.word_count or not self.sentence_count:
+            return {}
+        return {
+            'avg_word_length': self.total_word_length / self.word_count,
+            'avg_sentence_length': self.word_count / self.sentence_count,
+            'lexical_diversity': len(self.profiles) / self.word_count,
+            'long_word_ratio': self.long_words / self.word_count,
+            'avg_syllables_per_word': self.total_syllables / self.word_count
+        }
+    
+    def result(self, text: str, transformer_level: Optional[str], confidence_score: float) -> TextAnalysisResult:
+        """
+        Build the analysis result of everything added so far.
+        
+        Args:
+            text: The text (or its opening) shown as the sample
+            transformer_level: Level predicted by the transformer, if any
+            confidence_score: Confidence of that prediction
+            
+        Returns:
+            TextAnalysisResult object
+        """
+        estimator = self.estimator
+        level_counts = dict(self.level_counts)
+        
+        # Vocabulary-based analysis
+        vocab_level = estimator._level_from_counts(level_counts)
+        
+        # Combine estimates
+        if transformer_level and confidence_score > 0.5:
+            estimated_level = transformer_level
+        else:
+            estimated_level = vocab_level
+            confidence_score = 0.7  # Default confidence for vocabulary-based estimation
+        
+        # Calculate level percentages
+        total_analyzed_words = sum(level_counts.values())
+        level_percentages = {}
+        if total_analyzed_words > 0:
+            for level in estimator.cefr_levels:
+                count = level_counts.get(level, 0)
+                level_percentages[level] = (count / total_analyzed_words) * 100
+        
+        return TextAnalysisResult(
+            text=text[:200] + "..." if len(text) > 200 else text,
+            estimated_level=estimated_level,
+            confidence_score=confidence_score,
+            word_count=self.word_count,
+            sentence_count=self.sentence_count,
+            avg_sentence_length=self.word_count / self.sentence_count if self.sentence_count > 0 else 0,
+            vocabulary_distribution=level_counts,
+            level_percentages=level_percentages,
+            representative_words=dict(self.representative_words),
+            complexity_metrics=self.complexity_metrics()
+        )
+
+
+class _LevelVote:
+    """
+    Length-weighted average of the transformer's label distributions over the windows of a text.
+    """
+    
+    def __init__(self):
+        self.label_weights: Counter = Counter()
+        self.total_weight = 0
+    
+    def add(self, distribution: Dict[str, float], weight: int):
+        """Count one window's label distribution, weighted by its length in tokens."""
+        if not distribution:
+            return
+        for label, score in distribution.items():
+            self.label_weights[label] += score * weight
+        self.total_weight += weight
+    
+    def estimate(self) -> Tuple[Optional[str], float]:
+        """Most probable label over all windows and its averaged probability, (None, 0.0) without windows."""
+        if not self.total_weight:
+            return None, 0.0
+        label = max(self.label_weights, key=self.label_weights.get)
+        return label, self.label_weights[label] / self.total_weight
+
+
+class ResultCache:
+    """
+    Analysis results stored by content, in memory and optionally on disk.
+    
+    Keys are hashes of the normalized text and of everything the result
+    depends on (see `CEFRVocabularyEstimator.result_key`), so an identical
+    text analyzed again, by this process or a later one, is answered from
+    the cache. Recent results stay in an in-memory LRU; the SQLite file is
+    shared between processes and evicts its least recently used results
+    once it grows past max_bytes.
+    
+    Both tiers hold the result as JSON text, so every get builds a fresh
+    result and a caller changing one never changes the cached copy. The
+    on-disk tier is only an accelerator: when the file is busy or broken a
+    get is a miss and a put stays in memory.
+    """
+    
+    RESYNC_PUTS = 1000
+    # Access times of on-disk hits are written in one statement every this many hits, and before evicting
+    ACCESS_FLUSH = 100
+    # Seconds to wait on another process's write before giving up on the on-disk tier for this call
+    BUSY_TIMEOUT = 1.0
+    
+    def __init__(self, path: Optional[str] = None, memory_size: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite file for the on-disk tier, None to keep results in memory only
+            memory_size: Results kept in memory
+            max_bytes: Size of stored results the on-disk tier is trimmed to
+        """
+        self.memory_size = memory_size
+        self.max_bytes = max_bytes
+        self.memory: OrderedDict = OrderedDict()
+        # Raw text digest -> key, so an exact repeat skips preprocessing too
+        self.aliases: OrderedDict = OrderedDict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        # Running size of the on-disk tier, so a put does not sum the whole table. Other processes
+        # write to the same file, so it is read again every RESYNC_PUTS puts and before evicting
+        self.stored_bytes = 0
+        self.puts = 0
+        # Key -> last access of on-disk hits whose accessed column is not updated yet
+        self.accessed: Dict[str, float] = {}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self.stored_bytes = self._stored_size()
+    
+    def get(self, key: str) -> Optional[TextAnalysisResult]:
+        """Stored result for a key, None on a miss."""
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+            elif self.db is not None:
+                try:
+                    row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                except sqlite3.OperationalError as e:
+                    logger.warning(f"Result cache unavailable, treating as a miss: {e}")
+                    row = None
+                if row is not None:
+                    value = row[0]
+                    self._remember(key, value)
+                    self.accessed[key] = time.time()
+                    if len(self.accessed) >= self.ACCESS_FLUSH:
+                        self._flush_accessed()
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return TextAnalysisResult(**json.loads(value))
+    
+    def put(self, key: str, result: TextAnalysisResult):
+        """Store a result in both tiers."""
+        value = json.dumps(asdict(result))
+        with self.lock:
+            self._remember(key, value)
+            if self.db is None:
+                return
+            try:
+                replaced = self.db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+                self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                (key, value, len(value), time.time()))
+                self.accessed.pop(key, None)
+                self.stored_bytes += len(value) - (replaced[0] if replaced else 0)
+                self.puts += 1
+                if self.puts % self.RESYNC_PUTS == 0:
+                    self.stored_bytes = self._stored_size()
+                if self.stored_bytes > self.max_bytes:
+                    self._evict()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Result cache unavailable, result kept in memory only: {e}")
+    
+    def resolve(self, alias: str) -> Optional[str]:
+        """Key recorded for an alias, None if unknown."""
+        with self.lock:
+            key = self.aliases.get(alias)
+            if key is not None:
+                self.aliases.move_to_end(alias)
+            return key
+    
+    def alias(self, alias: str, key: str):
+        """Record that an alias (e.g. a digest of the raw text) stands for a key, in memory only."""
+        with self.lock:
+            self.aliases[alias] = key
+            self.aliases.move_to_end(alias)
+            while len(self.aliases) > self.memory_size:
+                self.aliases.popitem(last=False)
+    
+    def _remember(self, key: str, value: str):
+        """Add a result's JSON to the in-memory LRU, dropping the least recently used result when full."""
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+    
+    def _stored_size(self) -> int:
+        """Size of every result in the on-disk tier, summed over the table."""
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    
+    def _flush_accessed(self):
+        """Write the pending access times of on-disk hits in one statement."""
+        accessed, self.accessed = self.accessed, {}
+        try:
+            self.db.executemany("UPDATE results SET accessed = ? WHERE key = ?",
+                                [(when, key) for key, when in accessed.items()])
+        except sqlite3.OperationalError as e:
+            # Only the eviction order suffers
+            logger.warning(f"Result cache access times not saved: {e}")
+    
+    def _evict(self):
+        """Trim the on-disk tier to 90% of max_bytes, oldest access first."""
+        if self.accessed:
+            self._flush_accessed()
+        # Another process may have evicted already
+        self.stored_bytes = self._stored_size()
+        if self.stored_bytes <= self.max_bytes:
+            return
+        excess = self.stored_bytes - int(self.max_bytes * 0.9)
+        removed = 0
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY accessed"):
+            doomed.append((key,))
+            removed += size
+            if removed >= excess:
+                break
+        self.db.executemany("DELETE FROM results WHERE key = ?", doomed)
+        self.stored_bytes -= removed
+    
+    def clear(self):
+        """Forget every stored result."""
+        with self.lock:
+            self.memory.clear()
+            self.aliases.clear()
+            self.accessed.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM results")
+                self.stored_bytes = 0
+    
+    def close(self):
+        """Save pending access times and close the on-disk tier."""
+        with self.lock:
+            if self.db is None:
+                return
+            if self.accessed:
+                self._flush_accessed()
+            self.db.close()
+            self.db = None
+
+
+class OnnxClassifier:
+    """
+    Text classifier running an exported ONNX model on onnxruntime.
+    
+    It is called like the transformers pipeline it replaces (texts in,
+    label distributions out) and exposes its tokenizer as `tokenizer`, so
+    windowing and batching work unchanged. Export a model with
+    `export_onnx` (`python main.py --export-onnx DIR`).
+    """
+    
+    def __init__(self, model_dir: str, threads: Optional[int] = None):
+        """
+        Args:
+            model_dir: Directory with model.onnx, the tokenizer and config.json
+            threads: Threads per inference call (default: onnxruntime's choice)
+        """
+        import numpy as np
+        import onnxruntime
+        from transformers import AutoConfig, AutoTokenizer
+        
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.labels = AutoConfig.from_pretrained(model_dir).id2label
+        self.np = np
+    
+    def __call__(self, texts: Union[str, List[str]], batch_size: int = 32, truncation: bool = True,
+                 top_k: Optional[int] = 1, **kwargs):
+        """
+        Classify texts.
+        
+        Args:
+            texts: One text or a list of texts
+            batch_size: Texts per inference call
+            truncation: Cut texts longer than the model's limit
+            top_k: Labels returned per text, None for all of them, 1 for a bare dict
+            
+        Returns:
+            Per text, its labels as {'label', 'score'} dicts, most probable first
+        """
+        np = self.np
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        max_length = min(self.tokenizer.model_max_length, 512)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=truncation,
+                                     max_length=max_length, return_tensors="np")
+            logits = self.session.run(None, {name: encoded[name].astype(np.int64) for name in self.input_names})[0]
+            # Softmax, shifted for numerical stability
+            scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+            for row in scores:
+                ranked = sorted(({'label': self.labels[index], 'score': float(score)} for index, score in enumerate(row)),
+                                key=lambda prediction: -prediction['score'])
+                results.append(ranked if top_k is None else ranked[0] if top_k == 1 else ranked[:top_k])
+        return results[0] if single else results
+
+
+def export_onnx(model_dir: str, output_dir: str, quantize: bool = False):
+    """
+    Export a local transformers classifier to ONNX for the 'onnx' backend.
+    
+    Args:
+        model_dir: Directory of the saved transformers model and tokenizer
+        output_dir: Directory to write model.onnx, the tokenizer and config to
+        quantize: Store the weights as int8 (onnxruntime dynamic quantization)
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir).eval()
+    model.config.return_dict = False
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    sample = dict(tokenizer(["An example sentence to trace the model."], return_tensors="pt"))
+    # Graph inputs follow forward()'s parameters, not the tokenizer's key order, and are named in that order
+    names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+    axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+    axes['logits'] = {0: 'batch'}
+    path = os.path.join(output_dir, "model.onnx")
+    # Newer torch exports through dynamo by default, which needs onnxscript; the TorchScript exporter does not
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        # A trailing dict is passed as keyword arguments, whatever order forward() declares them in
+        torch.onnx.export(model, (sample,), path, input_names=names, output_names=['logits'],
+                          dynamic_axes=axes, opset_version=14, **options)
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized = os.path.join(output_dir, "model.int8.onnx")
+        quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+        os.replace(quantized, path)
+    
+    tokenizer.save_pretrained(output_dir)
+    model.config.return_dict = True
+    model.config.save_pretrained(output_dir)
+
+
+class InferenceScheduler:
+    """
+    Micro-batching queue in front of the transformer.
+    
+    Concurrent callers each submit one text; a background thread gathers
+    the texts arriving within `window` seconds of the first one (or up to
+    `max_batch` texts) and classifies them in one batched call, then
+    resolves each caller's future. Single callers pay at most the window
+    in extra latency; under load the model sees full batches.
+    """
+    
+    def __init__(self, estimator: 'CEFRVocabularyEstimator', window: float = 0.005, max_batch: int = 32):
+        """
+        Args:
+            estimator: Estimator whose transformer runs the batches
+            window: Seconds to keep collecting after the first text of a batch arrives
+            max_batch: Texts per batch, a full batch runs without waiting out the window
+        """
+        import queue
+        
+        self.estimator = estimator
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self.max_queue_depth = 0
+        self.total_queue_depth = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def submit(self, text: str, sentences: Optional[List[str]] = None):
+        """
+        Queue a text for classification.
+        
+        Args:
+            text: Input text
+            sentences: Its sentences, when already tokenized
+            
+        Returns:
+            Future resolving to (estimated_level, confidence_score), or to the
+            exception the batch failed with
+            
+        Raises:
+            RuntimeError: The scheduler was closed
+        """
+        from concurrent.futures import Future
+        
+        future = Future()
+        # Under the lock, so nothing is queued behind the stop marker close() puts
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("InferenceScheduler is closed")
+            self.requests.put((text, sentences, future))
+        return future
+    
+    def _run(self):
+        """Batching loop: block for a first text, fill the batch until the window closes, classify it."""
+        import queue
+        
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch = [first]
+            # Whatever goes wrong fails this batch's futures, the thread lives on for the next one
+            try:
+                deadline = time.perf_counter() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        item = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        # Finish this batch, then stop
+                        self.requests.put(None)
+                        break
+                    batch.append(item)
+                
+                depth = self.requests.qsize()
+                with self.lock:
+                    self.batches += 1
+                    self.texts += len(batch)
+                    self.total_queue_depth += depth
+                    self.max_queue_depth = max(self.max_queue_depth, depth)
+                
+                texts = [text for text, _, _ in batch]
+                sentence_lists = [sentences or self.estimator.split_sentences(text) for text, sentences, _ in batch]
+                predictions = self.estimator._classify_texts(texts, self.max_batch, sentence_lists)
+            except Exception as e:
+                logger.error(f"Error in transformer prediction: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+    
+    def stats(self) -> Dict[str, float]:
+        """
+        Batching metrics so far.
+        
+        Returns:
+            Batches run, texts classified, average and maximum queue depth
+            left behind when a batch closed, and batch fill ratio (average
+            batch size over max_batch)
+        """
+        with self.lock:
+            batches = self.batches or 1
+            return {
+                'batches': self.batches,
+                'texts': self.texts,
+                'queue_depth': self.requests.qsize(),
+                'avg_queue_depth': self.total_queue_depth / batches,
+                'max_queue_depth': self.max_queue_depth,
+                'fill_ratio': self.texts / (batches * self.max_batch),
+            }
+    
+    def close(self):
+        """Classify what is queued, then stop the batching thread. Later submits raise."""
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.requests.put(None)
+        self.thread.join()
+
+
 class CEFRVocabularyEstimator:
     """
     A comprehensive CEFR vocabulary level estimator using multiple approaches.
     """
     
-    def __init__(self, model_name: str = "AnonymousSubmissions/cefr-classifier"):
+    # Components loaded on first access instead of at construction
+    LAZY_COMPONENTS = ('stop_words', 'lemmatizer', 'word_levels', 'token_levels', 'nlp', 'nltk_tokenizers', 'classifier')
+    
+    # Out-of-vocabulary words whose lemma and level are remembered
+    UNLISTED_CACHE_SIZE = 100_000
+    
+    # Letters-only words and sentence ends, for the regex tokenizer
+    WORD_PATTERN = re.compile(r'[^\W\d_]+')
+    SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+    
+    # Ways to run the classifier: transformers pipeline in fp32, the same with
+    # dynamically int8-quantized linear layers, or an exported ONNX model
+    BACKENDS = ('pytorch', 'int8', 'onnx')
+    
+    # Part of every result cache key; bump when the analysis itself changes so stored results are recomputed
+    RESULT_FORMAT = 1
+    
+    def __init__(self, model_name: str = "AnonymousSubmissions/cefr-classifier",
+                 cache_dir: Optional[str] = None, offline: bool = False,
+                 result_cache: Optional[ResultCache] = None, fast_tokenizer: bool = False,
+                 batch_window: Optional[float] = None, max_batch: int = 32,
+                 backend: str = 'pytorch', backend_dir: Optional[str] = None, threads: Optional[int] = None):
         """
         Initialize the CEFR Vocabulary Estimator.
         
+        Nothing heavy happens here: spaCy, NLTK data and the transformer model are
+        loaded the first time they are needed (or all at once with `preload`).
+        
         Args:
             model_name: HuggingFace model name for CEFR classification
+            cache_dir: Directory for local copies of NLTK data and the model
+                (default: $CEFR_CACHE_DIR or ~/.cache/cefr-estimator)
+            offline: Never download; use only what is already cached or installed
+                (also enabled by CEFR_OFFLINE=1)
+            result_cache: Cache answering repeated texts with their stored results
+            fast_tokenizer: Split words and sentences with regular expressions
+                instead of spaCy or NLTK, which are then never loaded
+            batch_window: Seconds concurrent `analyze_text` calls wait to share a
+                transformer batch (see `InferenceScheduler`); None classifies each call alone
+            max_batch: Texts per shared transformer batch
+            backend: How the classifier runs, one of BACKENDS
+            backend_dir: Local model directory for the backend (default: the cached
+                copy of model_name, or that path + '-onnx' for the ONNX backend)
+            threads: CPU threads the classifier may use (default: the library's choice)
         """
+        # Streamlit sessions and the scheduler thread can reach a component at once, only one of them loads it
+        self._load_locks = {name: threading.Lock() for name in self.LAZY_COMPONENTS}
         self.model_name = model_name
-        self.classifier = None
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.offline = offline or os.environ.get("CEFR_OFFLINE") == "1"
         self.tokenizer = None
-        self.nlp = None
-        self.lemmatizer = None
-        self.stop_words = set()
+        self.result_cache = result_cache
+        self.fast_tokenizer = fast_tokenizer
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(self.BACKENDS)}")
+        self.backend = backend
+        self.backend_dir = backend_dir
+        self.threads = threads
+        self.scheduler = InferenceScheduler(self, batch_window, max_batch) if batch_window is not None else None
+        # Seconds spent loading each component, in load order
+        self.load_times: Dict[str, float] = {}
         
+        started = time.perf_counter()
         # CEFR level hierarchy
-        self.cefr_levels = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']
+        self.cefr_levels = list(CEFR_LEVELS)
         self.level_to_numeric = {level: i for i, level in enumerate(self.cefr_levels)}
         
         # Basic vocabulary lists (simplified for demonstration)
         self.vocabulary_lists = self._load_vocabulary_lists()
+        # Lowest level each listed word appears at
+        self.listed_levels: Dict[str, str] = {}
+        for level in reversed(self.cefr_levels):
+            self.listed_levels.update(dict.fromkeys(self.vocabulary_lists[level], level))
+        self.load_times['vocabulary_lists'] = time.perf_counter() - started
+        
+        # Model and vocabulary the results depend on, folded into every result cache key;
+        # results made without the classifier are keyed under the 'none' backend
+        fingerprints = [json.dumps({
+            'format': self.RESULT_FORMAT,
+            'model': self.model_name,
+            'tokenizer': 'regex' if fast_tokenizer else 'default',
+            'backend': name,
+            'vocabulary': {level: sorted(words) for level, words in self.vocabulary_lists.items()},
+        }, sort_keys=True) for name in (backend, 'none')]
+        self.result_version, self.unclassified_version = (hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+                                                          for fingerprint in fingerprints)
         
-        self._initialize_components()
+        # Bounded memo, so a long text lemmatizes each unlisted word once
+        self._unlisted_word_level = lru_cache(maxsize=self.UNLISTED_CACHE_SIZE)(self._level_of_unlisted_word)
     
-    def _initialize_components(self):
-        """Initialize NLP components and models."""
-        try:
-            # Download required NLTK data
-            nltk.download('punkt', quiet=True)
-            nltk.download('stopwords', quiet=True)
-            nltk.download('wordnet', quiet=True)
-            nltk.download('averaged_perceptron_tagger', quiet=True)
-            
-            # Initialize NLTK components
-            self.lemmatizer = WordNetLemmatizer()
-            self.stop_words = set(stopwords.words('english'))
-            
-            # Initialize spaCy
+    def __getattr__(self, name: str):
+        """
+        Load a lazy component the first time it is accessed.
+        
+        The loaded value is stored as a plain attribute, so later accesses
+        never come back here. Threads asking for a component while it loads
+        wait for it instead of loading it again.
+        """
+        if name not in self.LAZY_COMPONENTS:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        with self._load_locks[name]:
+            if name in self.__dict__:
+                return self.__dict__[name]
+            started = time.perf_counter()
+            value = getattr(self, f"_load_{name}")()
+            self.load_times[name] = time.perf_counter() - started
+            setattr(self, name, value)
+        return value
+    
+    def preload(self):
+        """Load every component now, e.g. before serving requests."""
+        for name in self.LAZY_COMPONENTS:
+            getattr(self, name)
+    
+    def startup_report(self) -> str:
+        """
+        Report how long each component took to load.
+        
+        Returns:
+            Formatted report string
+        """
+        report = ["⏱️  COMPONENT LOAD TIMES", "-" * 30]
+        for name, seconds in self.load_times.items():
+            report.append(f"{name.replace('_', ' ').title()}: {seconds:.2f}s")
+        pending = [name for name in self.LAZY_COMPONENTS if name not in self.load_times]
+        if pending:
+            report.append(f"Not loaded yet: {', '.join(pending)}")
+        report.append(f"Total: {sum(self.load_times.values()):.2f}s")
+        return "\n".join(report)
+    
+    def _ensure_nltk_data(self, *packages: str):
+        """
+        Make NLTK packages available from the local cache.
+        
+        Installed packages are found on disk without any network check;
+        missing ones are downloaded into the cache unless running offline.
+        
+        Args:
+            packages: NLTK package names (keys of NLTK_RESOURCES)
+        """
+        import nltk
+        
+        nltk_dir = os.path.join(self.cache_dir, "nltk_data")
+        if nltk_dir not in nltk.data.path:
+            nltk.data.path.insert(0, nltk_dir)
+        for package in packages:
             try:
-                self.nlp = spacy.load("en_core_web_sm")
-            except OSError:
-                logger.warning("spaCy model 'en_core_web_sm' not found. Using basic tokenization.")
-                self.nlp = None
+                nltk.data.find(NLTK_RESOURCES[package])
+            except LookupError:
+                if self.offline:
+                    logger.warning(f"NLTK package '{package}' is not cached and running offline")
+                else:
+                    nltk.download(package, download_dir=nltk_dir, quiet=True)
+    
+    def _load_stop_words(self) -> set:
+        """English stop words from NLTK (empty if NLTK is unavailable)."""
+        try:
+            self._ensure_nltk_data('stopwords')
+            from nltk.corpus import stopwords
+            return set(stopwords.words('english'))
+        except (ImportError, LookupError) as e:
+            logger.warning(f"Stop words unavailable: {e}")
+            return set()
+    
+    def _load_lemmatizer(self):
+        """WordNet lemmatizer with its corpus already read (None if unavailable)."""
+        try:
+            self._ensure_nltk_data('wordnet')
+            from nltk.stem import WordNetLemmatizer
+            lemmatizer = WordNetLemmatizer()
+            # WordNet is read on the first lemmatization, do it here so it is counted as load time
+            lemmatizer.lemmatize('words')
+            return lemmatizer
+        except (ImportError, LookupError) as e:
+            logger.warning(f"Lemmatizer unavailable: {e}")
+            return None
+    
+    def _load_word_levels(self) -> Dict[str, str]:
+        """
+        Level of every listed word, checked against its lemma once here instead of per token.
+        
+        Returns:
+            Dictionary mapping listed words to CEFR levels
+        """
+        word_levels = {}
+        for word, level in self.listed_levels.items():
+            lemma = self.lemmatizer.lemmatize(word) if self.lemmatizer else word
+            lemma_level = self.listed_levels.get(lemma, level)
+            word_levels[word] = min(level, lemma_level, key=self.level_to_numeric.get)
+        return word_levels
+    
+    def _load_token_levels(self) -> Dict[str, str]:
+        """
+        Level counted for each known token in vocabulary estimation.
+        
+        Stop words and words of two letters or fewer map to '' (not counted),
+        so a token needs a single dictionary probe.
+        """
+        token_levels = {word: level for word, level in self.word_levels.items() if len(word) > 2}
+        token_levels.update(dict.fromkeys(self.stop_words, ''))
+        token_levels.update(dict.fromkeys((word for word in self.word_levels if len(word) <= 2), ''))
+        return token_levels
+    
+    def _load_nlp(self):
+        """spaCy English pipeline (None if spaCy or the model is not installed, or with the fast tokenizer)."""
+        if self.fast_tokenizer:
+            return None
+        try:
+            import spacy
+            # Only tokens and sentence boundaries are used, entity recognition and lemmas would be wasted work
+            return spacy.load("en_core_web_sm", exclude=["ner", "lemmatizer"])
+        except ImportError:
+            logger.warning("spaCy is not installed. Using basic tokenization.")
+        except OSError:
+            logger.warning("spaCy model 'en_core_web_sm' not found. Using basic tokenization.")
+        return None
+    
+    def _load_nltk_tokenizers(self) -> Optional[Tuple]:
+        """NLTK word and sentence tokenizers, used when spaCy is unavailable (None without NLTK or with the fast tokenizer)."""
+        if self.fast_tokenizer:
+            return None
+        try:
+            self._ensure_nltk_data('punkt', 'punkt_tab')
+            from nltk.tokenize import word_tokenize, sent_tokenize
+        except ImportError as e:
+            logger.warning(f"NLTK tokenizers unavailable: {e}. Using regex tokenization.")
+            return None
+        return word_tokenize, sent_tokenize
+    
+    def _local_model_dir(self) -> str:
+        """Directory holding the local copy of the classifier."""
+        return os.path.join(self.cache_dir, "models", self.model_name.replace("/", "--"))
+    
+    def _load_classifier(self):
+        """
+        Transformer classifier for the chosen backend, None when it cannot be loaded.
+        
+        The model is read from the local cache directory when present, which
+        needs no network at all; otherwise it is downloaded once and saved there.
+        The int8 backend quantizes that model as it loads; the ONNX backend
+        reads an export made with `export_onnx`.
+        """
+        try:
+            from transformers import pipeline
+        except ImportError:
+            logger.warning("transformers is not installed. Falling back to vocabulary-based estimation")
+            return None
+        
+        try:
+            if self.backend == 'onnx':
+                return self._load_onnx_classifier()
             
-            # Initialize transformer model
-            try:
-                self.classifier = pipeline(
+            if self.threads:
+                import torch
+                torch.set_num_threads(self.threads)
+            model_dir = self.backend_dir or self._local_model_dir()
+            if os.path.isdir(model_dir):
+                classifier = pipeline("text-classification", model=model_dir, tokenizer=model_dir)
+            elif self.offline or self.backend_dir:
+                logger.warning(f"No copy of {self.model_name} in {model_dir}")
+                return None
+            else:
+                classifier = pipeline(
                     "text-classification",
                     model=self.model_name,
                     tokenizer=self.model_name
                 )
-                logger.info(f"Loaded CEFR classifier: {self.model_name}")
-            except Exception as e:
-                logger.warning(f"Could not load transformer model: {e}")
-                logger.info("Falling back to vocabulary-based estimation")
-                
+                classifier.save_pretrained(model_dir)
+            if self.backend == 'int8':
+                classifier = self._quantize_classifier(classifier)
+            logger.info(f"Loaded CEFR classifier: {self.model_name} ({self.backend})")
+            return classifier
         except Exception as e:
-            logger.error(f"Error initializing components: {e}")
+            logger.warning(f"Could not load transformer model: {e}")
+            logger.info("Falling back to vocabulary-based estimation")
+            return None
+    
+    @staticmethod
+    def _quantize_classifier(classifier):
+        """The same pipeline with its linear layers dynamically quantized to int8."""
+        import torch
+        from transformers import pipeline
+        
+        model = torch.quantization.quantize_dynamic(classifier.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return pipeline("text-classification", model=model, tokenizer=classifier.tokenizer)
+    
+    def _load_onnx_classifier(self) -> Optional[OnnxClassifier]:
+        """ONNX export of the classifier on onnxruntime, None when there is no export."""
+        model_dir = self.backend_dir or self._local_model_dir() + "-onnx"
+        if not os.path.isfile(os.path.join(model_dir, "model.onnx")):
+            logger.warning(f"No ONNX model in {model_dir}; create one with: python main.py --export-onnx {model_dir}")
+            return None
+        classifier = OnnxClassifier(model_dir, self.threads)
+        logger.info(f"Loaded CEFR classifier: {self.model_name} (onnx from {model_dir})")
+        return classifier
     
     def _load_vocabulary_lists(self) -> Dict[str, set]:
         """
@@ -202,18 +1009,63 @@ class CEFRVocabularyEstimator:
         """
         try:
             if self.nlp:
-                doc = self.nlp(text)
-                words = [token.text.lower() for token in doc if token.is_alpha]
-                sentences = [sent.text for sent in doc.sents]
-            else:
+                return self._tokens_from_doc(self.nlp(text))
+            elif self.nltk_tokenizers:
+                word_tokenize, sent_tokenize = self.nltk_tokenizers
                 words = [word.lower() for word in word_tokenize(text) if word.isalpha()]
                 sentences = sent_tokenize(text)
+            else:
+                return self.regex_tokenize(text)
             
             return words, sentences
         except Exception as e:
             logger.error(f"Error in tokenization: {e}")
             return [], []
     
+    @classmethod
+    def regex_tokenize(cls, text: str) -> Tuple[List[str], List[str]]:
+        """
+        Tokenize with two regular expressions, the fast path without spaCy or NLTK.
+        
+        Words are runs of letters, lowercased; sentences end at '.', '?' or '!'
+        followed by whitespace.
+        
+        Args:
+            text: Input text
+            
+        Returns:
+            Tuple of (words, sentences)
+        """
+        words = cls.WORD_PATTERN.findall(text.lower())
+        sentences = [sentence for sentence in cls.SENTENCE_END.split(text) if sentence]
+        return words, sentences
+    
+    @staticmethod
+    def _tokens_from_doc(doc) -> Tuple[List[str], List[str]]:
+        """Lowercased words and sentence texts of a spaCy doc."""
+        words = [token.text.lower() for token in doc if token.is_alpha]
+        sentences = [sent.text for sent in doc.sents]
+        return words, sentences
+    
+    def tokenize_many(self, texts: List[str], batch_size: int = 32) -> List[Tuple[List[str], List[str]]]:
+        """
+        Tokenize several texts, streaming them through spaCy in batches.
+        
+        Args:
+            texts: Input texts
+            batch_size: Texts per spaCy batch
+            
+        Returns:
+            List of (words, sentences) tuples, one per text
+        """
+        if not self.nlp:
+            return [self.tokenize_text(text) for text in texts]
+        try:
+            return [self._tokens_from_doc(doc) for doc in self.nlp.pipe(texts, batch_size=batch_size)]
+        except Exception as e:
+            logger.error(f"Error in batch tokenization: {e}")
+            return [self.tokenize_text(text) for text in texts]
+    
     def get_word_cefr_level(self, word: str) -> str:
         """
         Determine the CEFR level of a word based on vocabulary lists.
@@ -224,16 +1076,26 @@ class CEFRVocabularyEstimator:
         Returns:
             CEFR level (A1-C2) or 'Unknown'
         """
-        # Check lemmatized form
-        if self.lemmatizer:
-            lemmatized = self.lemmatizer.lemmatize(word)
-        else:
-            lemmatized = word
+        level = self.word_levels.get(word)
+        if level is None:
+            level = self._unlisted_word_level(word)
+        return level
+    
+    def _level_of_unlisted_word(self, word: str) -> str:
+        """
+        CEFR level of a word that is not in the vocabulary lists (memoized per word).
         
-        # Check both original and lemmatized forms
-        for level in self.cefr_levels:
-            if word in self.vocabulary_lists[level] or lemmatized in self.vocabulary_lists[level]:
-                return level
+        Args:
+            word: Input word (lowercase)
+            
+        Returns:
+            Level of its lemma if listed, otherwise estimated from its length
+        """
+        # Check lemmatized form
+        lemmatized = self.lemmatizer.lemmatize(word) if self.lemmatizer else word
+        level = self.listed_levels.get(lemmatized)
+        if level is not None:
+            return level
         
         # If not found in any list, estimate based on word length and complexity
         if len(word) <= 4:
@@ -276,12 +1138,7 @@ class CEFRVocabularyEstimator:
         long_word_ratio = len(long_words) / len(words) if words else 0
         
         # Syllable estimation (rough)
-        def count_syllables(word):
-            vowels = 'aeiouy'
-            syllables = sum(1 for char in word.lower() if char in vowels)
-            return max(1, syllables)  # At least 1 syllable
-        
-        avg_syllables = statistics.mean(count_syllables(word) for word in words)
+        avg_syllables = statistics.mean(self.count_syllables(word) for word in words)
         
         return {
             'avg_word_length': avg_word_length,
@@ -291,6 +1148,13 @@ class CEFRVocabularyEstimator:
             'avg_syllables_per_word': avg_syllables
         }
     
+    @staticmethod
+    def count_syllables(word: str) -> int:
+        """Rough syllable count: vowels in the word, at least 1."""
+        vowels = 'aeiouy'
+        syllables = sum(1 for char in word.lower() if char in vowels)
+        return max(1, syllables)  # At least 1 syllable
+    
     def estimate_level_from_vocabulary(self, words: List[str]) -> Tuple[str, Dict[str, int], Dict[str, List[str]]]:
         """
         Estimate CEFR level based on vocabulary distribution.
@@ -305,22 +1169,53 @@ class CEFRVocabularyEstimator:
             return 'A1', {}, {}
         
         # Analyze vocabulary levels
-        word_levels = {}
         level_counts = Counter()
         representative_words = defaultdict(list)
+        self._count_levels(words, level_counts, representative_words)
+        if not level_counts:
+            return 'A1', {}, {}
+        
+        return self._level_from_counts(level_counts), dict(level_counts), dict(representative_words)
+    
+    def _count_levels(self, words: List[str], level_counts: Counter, representative_words: Dict[str, List[str]]):
+        """Add the levels of the counted words to a histogram and keep the first 10 words of each level."""
+        token_levels = self.token_levels
         
         for word in words:
-            if word not in self.stop_words and len(word) > 2:  # Filter out stop words and very short words
-                level = self.get_word_cefr_level(word)
-                word_levels[word] = level
-                level_counts[level] += 1
-                
-                # Keep representative words (limit to avoid clutter)
-                if len(representative_words[level]) < 10:
-                    representative_words[level].append(word)
+            # One probe for listed words and stop words ('' means not counted)
+            level = token_levels.get(word)
+            if level is None:
+                if len(word) <= 2:  # Filter out very short words
+                    continue
+                level = self._unlisted_word_level(word)
+            if not level:
+                continue
+            level_counts[level] += 1
+            
+            # Keep representative words (limit to avoid clutter)
+            if len(representative_words[level]) < 10:
+                representative_words[level].append(word)
+    
+    def word_profile(self, word: str) -> Tuple[str, int, int]:
+        """
+        What a single pass over a text needs to know about one word.
         
+        Args:
+            word: Input word (lowercase)
+            
+        Returns:
+            Tuple of (level counted for the word, '' if not counted; length; syllables)
+        """
+        level = self.token_levels.get(word)
+        if level is None:
+            # Very short words are not counted
+            level = self._unlisted_word_level(word) if len(word) > 2 else ''
+        return level, len(word), self.count_syllables(word)
+    
+    def _level_from_counts(self, level_counts: Dict[str, int]) -> str:
+        """Overall level implied by a vocabulary level histogram."""
         if not level_counts:
-            return 'A1', {}, {}
+            return 'A1'
         
         # Calculate weighted level estimate
         total_words = sum(level_counts.values())
@@ -346,7 +1241,7 @@ class CEFRVocabularyEstimator:
         elif level_weights.get('B2', 0) > 0.3:
             estimated_level = 'B2'
         
-        return estimated_level, dict(level_counts), dict(representative_words)
+        return estimated_level
     
     def estimate_level_with_transformer(self, text: str) -> Tuple[str, float]:
         """
@@ -358,27 +1253,128 @@ class CEFRVocabularyEstimator:
         Returns:
             Tuple of (estimated_level, confidence_score)
         """
-        if not self.classifier:
-            return None, 0.0
+        return self._estimate_one(text)
+    
+    def _estimate_one(self, text: str, sentences: Optional[List[str]] = None) -> Tuple[str, float]:
+        """Transformer estimate of one text, through the batching scheduler when there is one."""
+        if self.scheduler is not None and self.classifier:
+            future = self.scheduler.submit(text, sentences)
+            try:
+                return future.result()
+            except Exception:
+                # Logged by the scheduler; like an unbatched call, the failure means no prediction
+                return None, 0.0
+        return self.estimate_levels_with_transformer([text], sentence_lists=[sentences] if sentences else None)[0]
+    
+    def estimate_levels_with_transformer(self, texts: List[str], batch_size: int = 32,
+                                         sentence_lists: Optional[List[List[str]]] = None) -> List[Tuple[str, float]]:
+        """
+        Estimate CEFR levels of several texts, classifying the whole of each text.
         
-        try:
-            # Truncate text if too long
-            max_length = 512
-            if len(text.split()) > max_length:
-                text = ' '.join(text.split()[:max_length])
-            
-            result = self.classifier(text)
-            
-            if isinstance(result, list) and len(result) > 0:
-                prediction = result[0]
-                level = prediction['label']
-                confidence = prediction['score']
-                return level, confidence
+        Every text is cut on sentence boundaries into windows that fit the
+        model's token limit. The windows of all texts go through the
+        transformer as one batched call, and each text's label distributions
+        are averaged with its windows weighted by token count.
+        
+        Args:
+            texts: Input texts
+            batch_size: Windows per forward pass
+            sentence_lists: Sentences of each text when already tokenized
             
+        Returns:
+            List of (estimated_level, confidence_score) tuples, (None, 0.0) where no prediction was made
+        """
+        if not self.classifier or not texts:
+            return [(None, 0.0)] * len(texts)
+        
+        if sentence_lists is None:
+            sentence_lists = [self.split_sentences(text) for text in texts]
+        try:
+            return self._classify_texts(texts, batch_size, sentence_lists)
         except Exception as e:
             logger.error(f"Error in transformer prediction: {e}")
+            return [(None, 0.0)] * len(texts)
+    
+    def _classify_texts(self, texts: List[str], batch_size: int, sentence_lists: List[List[str]]) -> List[Tuple[str, float]]:
+        """Window, classify and aggregate texts in one batched call; errors propagate."""
+        windows, owners = [], []
+        for index, (text, sentences) in enumerate(zip(texts, sentence_lists)):
+            for window in self.sentence_windows([sentences or [text]]):
+                windows.append(window)
+                owners.append(index)
+        
+        distributions = self._classify_windows(windows, batch_size)
+        votes = [_LevelVote() for _ in texts]
+        for owner, (_, tokens), distribution in zip(owners, windows, distributions):
+            votes[owner].add(distribution, tokens)
+        return [vote.estimate() for vote in votes]
+    
+    @classmethod
+    def split_sentences(cls, text: str) -> List[str]:
+        """Cheap sentence split for texts that were not tokenized."""
+        return [sentence for sentence in cls.SENTENCE_END.split(text) if sentence]
+    
+    def _window_budget(self) -> int:
+        """Tokens per transformer window, leaving room for the special tokens."""
+        tokenizer = getattr(self.classifier, 'tokenizer', None)
+        return min(getattr(tokenizer, 'model_max_length', 512), 512) - 2
+    
+    def _token_counts(self, sentences: List[str]) -> List[int]:
+        """Model tokens in each sentence, words when the classifier has no tokenizer."""
+        tokenizer = getattr(self.classifier, 'tokenizer', None)
+        if tokenizer is None:
+            return [len(sentence.split()) for sentence in sentences]
+        return [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)['input_ids']]
+    
+    def sentence_windows(self, sentence_lists: Iterable[List[str]]) -> Iterator[Tuple[str, int]]:
+        """
+        Pack consecutive sentences into windows that fit the transformer.
         
-        return None, 0.0
+        Sentences longer than a window on their own are cut into equal runs
+        of words. Sentence lists are consumed lazily, so windows of a
+        streamed text come out as its pieces arrive.
+        
+        Args:
+            sentence_lists: Consecutive lists of sentences of one text
+            
+        Yields:
+            (window_text, token_count) tuples in order
+        """
+        budget = self._window_budget()
+        window: List[str] = []
+        size = 0
+        for sentences in sentence_lists:
+            sentences = [sentence.strip() for sentence in sentences if sentence.strip()]
+            if not sentences:
+                continue
+            for sentence, tokens in zip(sentences, self._token_counts(sentences)):
+                if window and size + tokens > budget:
+                    yield ' '.join(window), size
+                    window, size = [], 0
+                if tokens <= budget:
+                    window.append(sentence)
+                    size += tokens
+                    continue
+                words = sentence.split()
+                step = -(-len(words) // -(-tokens // budget))
+                for start in range(0, len(words), step):
+                    piece = words[start:start + step]
+                    yield ' '.join(piece), max(1, round(tokens * len(piece) / len(words)))
+        if window:
+            yield ' '.join(window), size
+    
+    def _classify_windows(self, windows: List[Tuple[str, int]], batch_size: int) -> List[Dict[str, float]]:
+        """Label distribution of each window, from one batched transformer call."""
+        if not windows:
+            return []
+        results = self.classifier([text for text, _ in windows], batch_size=batch_size, truncation=True, top_k=None)
+        distributions = []
+        for result in results:
+            # All labels of a window, a bare dict when the pipeline returns only the best one
+            scores = result if isinstance(result, list) else [result]
+            distributions.append({prediction['label']: prediction['score'] for prediction in scores
+                                  if isinstance(prediction, dict) and 'label' in prediction})
+        return distributions
     
     def analyze_text(self, text: str) -> TextAnalysisResult:
         """
@@ -390,6 +1386,90 @@ class CEFRVocabularyEstimator:
         Returns:
             TextAnalysisResult object with all analysis results
         """
+        alias = self._text_alias(text)
+        if alias is not None:
+            cached = self._cached_result(self.result_cache.resolve(alias), text)
+            if cached is not None:
+                return cached
+        
+        cleaned_text = self._clean_input(text)
+        key, cached = self._lookup(cleaned_text, text)
+        if alias is not None:
+            self.result_cache.alias(alias, key)
+        if cached is not None:
+            return cached
+        
+        words, sentences = self.tokenize_text(cleaned_text)
+        if not words:
+            raise ValueError("No words found in text")
+        transformer_level, confidence_score = self._estimate_one(cleaned_text, sentences)
+        result = self._build_result(text, words, sentences, transformer_level, confidence_score)
+        self._store_result(key, result)
+        return result
+    
+    def analyze_many(self, texts: List[str], batch_size: int = 32) -> List[TextAnalysisResult]:
+        """
+        Analyze several texts at once.
+        
+        spaCy processes the texts as a stream (`nlp.pipe`) and the transformer
+        classifies them in padded batches, which is much faster than calling
+        `analyze_text` in a loop for many short documents.
+        
+        Args:
+            texts: Input texts to analyze
+            batch_size: Texts per spaCy and transformer batch
+            
+        Returns:
+            List of TextAnalysisResult objects, in input order
+        
+        Raises:
+            ValueError: If any text is invalid or has no words, naming its index
+        """
+        return self._analyze_outcomes(texts, batch_size, strict=True)
+    
+    def _analyze_outcomes(self, texts: List[str], batch_size: int = 32,
+                          strict: bool = False) -> List[Union[TextAnalysisResult, ValueError]]:
+        """
+        Batched analysis of `analyze_many`, with the ValueError of each unusable text in its place.
+        
+        The usable texts are still tokenized and classified together. With
+        strict, the first unusable text raises instead, naming its index.
+        """
+        outcomes: List[Union[TextAnalysisResult, ValueError, None]] = [None] * len(texts)
+        cleaned_texts: Dict[int, str] = {}
+        for index, text in enumerate(texts):
+            try:
+                cleaned_texts[index] = self._clean_input(text)
+            except ValueError as e:
+                if strict:
+                    raise ValueError(f"Text {index}: {e}") from e
+                outcomes[index] = e
+        
+        keys = {}
+        for index, cleaned_text in cleaned_texts.items():
+            keys[index], outcomes[index] = self._lookup(cleaned_text, texts[index])
+        # Only texts missing from the cache go through spaCy and the transformer
+        pending = [index for index in cleaned_texts if outcomes[index] is None]
+        
+        usable = []
+        for index, (words, sentences) in zip(pending, self.tokenize_many([cleaned_texts[index] for index in pending],
+                                                                          batch_size)):
+            if words:
+                usable.append((index, words, sentences))
+            elif strict:
+                raise ValueError(f"Text {index}: No words found in text")
+            else:
+                outcomes[index] = ValueError("No words found in text")
+        predictions = self.estimate_levels_with_transformer([cleaned_texts[index] for index, _, _ in usable], batch_size,
+                                                            [sentences for _, _, sentences in usable])
+        
+        for (index, words, sentences), (transformer_level, confidence_score) in zip(usable, predictions):
+            outcomes[index] = self._build_result(texts[index], words, sentences, transformer_level, confidence_score)
+            self._store_result(keys[index], outcomes[index])
+        return outcomes
+    
+    def _clean_input(self, text: str) -> str:
+        """Validate and preprocess one input text, raising ValueError when nothing is left."""
         if not text or not isinstance(text, str):
             raise ValueError("Invalid input text")
         
@@ -397,54 +1477,200 @@ class CEFRVocabularyEstimator:
         cleaned_text = self.preprocess_text(text)
         if not cleaned_text:
             raise ValueError("Text is empty after preprocessing")
+        return cleaned_text
+    
+    def result_key(self, cleaned_text: str) -> Optional[str]:
+        """
+        Result cache key of a preprocessed text, None when no cache is attached.
         
-        # Tokenize
-        words, sentences = self.tokenize_text(cleaned_text)
+        The analysis only ever sees the preprocessed text, so texts that differ
+        only in whitespace or stripped symbols share one key.
+        """
+        if self.result_cache is None:
+            return None
+        digest = hashlib.sha256(cleaned_text.encode('utf-8')).hexdigest()
+        return f"{self._key_version()}:{digest}"
+    
+    def _key_version(self) -> str:
+        """
+        Fingerprint new results are keyed under.
         
-        if not words:
-            raise ValueError("No words found in text")
+        Until the classifier is loaded its backend is assumed; once it turns
+        out to be unavailable, results belong to the 'none' backend so they
+        never stand in for model-backed ones.
+        """
+        return self.result_version if self.__dict__.get('classifier', True) else self.unclassified_version
+    
+    def _lookup(self, cleaned_text: str, text: str) -> Tuple[Optional[str], Optional[TextAnalysisResult]]:
+        """
+        Result key of a text and its cached result, None on a miss.
         
-        # Basic statistics
-        word_count = len(words)
-        sentence_count = len(sentences)
-        avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
+        A miss loads the classifier, which the analysis needs next anyway;
+        if there is none, the key moves to the 'none' backend and is tried too.
+        """
+        key = self.result_key(cleaned_text)
+        cached = self._cached_result(key, text)
+        if cached is None and key is not None and not self.classifier:
+            unclassified = self.result_key(cleaned_text)
+            if unclassified != key:
+                key, cached = unclassified, self._cached_result(unclassified, text)
+        return key, cached
+    
+    def _text_alias(self, text: str) -> Optional[str]:
+        """Digest of the raw text standing for its result key, None when no cache is attached."""
+        if self.result_cache is None or not isinstance(text, str):
+            return None
+        digest = hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+        return f"{self._key_version()}:raw:{digest}"
+    
+    def _cached_result(self, key: Optional[str], text: str) -> Optional[TextAnalysisResult]:
+        """Stored result for a key, with the sample taken from this text, None on a miss."""
+        if key is None:
+            return None
+        result = self.result_cache.get(key)
+        if result is None:
+            return None
+        return replace(result, text=text[:200] + "..." if len(text) > 200 else text)
+    
+    def _store_result(self, key: Optional[str], result: TextAnalysisResult):
+        """Cache a fresh result under the key `_lookup` gave its text."""
+        if key is not None:
+            self.result_cache.put(key, result)
+    
+    def _build_result(self, text: str, words: List[str], sentences: List[str],
+                      transformer_level: Optional[str], confidence_score: float) -> TextAnalysisResult:
+        """Combine tokenization and transformer output of one text into its analysis result."""
+        accumulator = _AnalysisAccumulator(self)
+        accumulator.add(words, sentences)
+        return accumulator.result(text, transformer_level, confidence_score)
+    
+    @staticmethod
+    def iter_text_chunks(path: str, chunk_size: int = 100_000) -> Iterator[str]:
+        """
+        Read a text file in pieces that end on a sentence boundary.
         
-        # Vocabulary-based analysis
-        vocab_level, level_counts, representative_words = self.estimate_level_from_vocabulary(words)
+        Each read of chunk_size characters is cut after its last sentence end
+        and the rest is carried into the next piece, so no sentence is split.
+        A run of text with no sentence end is cut at whitespace once it grows
+        past four reads, which keeps memory bounded on unpunctuated files.
         
-        # Transformer-based analysis
-        transformer_level, confidence_score = self.estimate_level_with_transformer(cleaned_text)
+        Args:
+            path: Text file (UTF-8)
+            chunk_size: Characters read at a time
+            
+        Yields:
+            Pieces of the file in order
+        """
+        boundary = re.compile(r'[.!?]\s|\n\s*\n')
+        carry = ''
+        with open(path, 'r', encoding='utf-8') as f:
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    break
+                buffer = carry + block
+                cut = None
+                for match in boundary.finditer(buffer, len(carry) - 1 if carry else 0):
+                    cut = match.end()
+                if cut is None:
+                    if len(buffer) < 4 * chunk_size:
+                        carry = buffer
+                        continue
+                    cut = max(buffer.rfind(' '), buffer.rfind('\n')) + 1 or len(buffer)
+                carry = buffer[cut:]
+                yield buffer[:cut]
+        if carry:
+            yield carry
+    
+    def _tokenize_stream(self, texts: Iterable[str]) -> Iterator[Tuple[List[str], List[str]]]:
+        """Tokenize texts one after another, through spaCy's streaming pipe when available."""
+        if self.nlp:
+            for doc in self.nlp.pipe(texts, batch_size=1):
+                yield self._tokens_from_doc(doc)
+        else:
+            for text in texts:
+                yield self.tokenize_text(text)
+    
+    def analyze_stream(self, chunks: Iterable[str], batch_size: int = 32) -> TextAnalysisResult:
+        """
+        Analyze a text that arrives in pieces, with memory bounded by the piece size.
         
-        # Combine estimates
-        if transformer_level and confidence_score > 0.5:
-            estimated_level = transformer_level
+        Pieces should end on sentence boundaries (see `iter_text_chunks`).
+        Counts, level distribution and complexity metrics are merged piece by
+        piece, and the transformer windows are classified in batches as they
+        fill, so the result matches `analyze_text` on the whole text.
+        
+        Args:
+            chunks: Consecutive pieces of the text
+            batch_size: Transformer windows per forward pass
+            
+        Returns:
+            TextAnalysisResult object for the whole text
+        """
+        accumulator = _AnalysisAccumulator(self)
+        vote = _LevelVote() if self.classifier else None
+        sample = ''
+        cleaned_any = False
+        
+        def cleaned_chunks():
+            nonlocal sample, cleaned_any
+            for chunk in chunks:
+                if len(sample) <= 200:
+                    sample += chunk[:201 - len(sample)]
+                cleaned = self.preprocess_text(chunk)
+                if cleaned:
+                    cleaned_any = True
+                    yield cleaned
+        
+        def sentence_lists():
+            for words, sentences in self._tokenize_stream(cleaned_chunks()):
+                accumulator.add(words, sentences)
+                yield sentences
+        
+        def classify(windows):
+            nonlocal vote
+            try:
+                for (_, tokens), distribution in zip(windows, self._classify_windows(windows, batch_size)):
+                    vote.add(distribution, tokens)
+            except Exception as e:
+                logger.error(f"Error in transformer prediction: {e}")
+                vote = None
+        
+        if vote is None:
+            for _ in sentence_lists():
+                pass
         else:
-            estimated_level = vocab_level
-            confidence_score = 0.7  # Default confidence for vocabulary-based estimation
+            pending = []
+            for window in self.sentence_windows(sentence_lists()):
+                pending.append(window)
+                if len(pending) == batch_size and vote is not None:
+                    classify(pending)
+                    pending = []
+            if pending and vote is not None:
+                classify(pending)
         
-        # Calculate level percentages
-        total_analyzed_words = sum(level_counts.values())
-        level_percentages = {}
-        if total_analyzed_words > 0:
-            for level in self.cefr_levels:
-                count = level_counts.get(level, 0)
-                level_percentages[level] = (count / total_analyzed_words) * 100
+        if not sample.strip():
+            raise ValueError("Invalid input text")
+        if not cleaned_any:
+            raise ValueError("Text is empty after preprocessing")
+        if not accumulator.word_count:
+            raise ValueError("No words found in text")
         
-        # Calculate complexity metrics
-        complexity_metrics = self.calculate_complexity_metrics(words, sentences)
+        transformer_level, confidence_score = vote.estimate() if vote else (None, 0.0)
+        return accumulator.result(sample, transformer_level, confidence_score)
+    
+    def analyze_file(self, path: str, chunk_size: int = 100_000) -> TextAnalysisResult:
+        """
+        Analyze a text file of any size by streaming it in sentence-aligned pieces.
         
-        return TextAnalysisResult(
-            text=text[:200] + "..." if len(text) > 200 else text,
-            estimated_level=estimated_level,
-            confidence_score=confidence_score,
-            word_count=word_count,
-            sentence_count=sentence_count,
-            avg_sentence_length=avg_sentence_length,
-            vocabulary_distribution=level_counts,
-            level_percentages=level_percentages,
-            representative_words=representative_words,
-            complexity_metrics=complexity_metrics
-        )
+        Args:
+            path: Text file (UTF-8)
+            chunk_size: Characters read at a time
+            
+        Returns:
+            TextAnalysisResult object for the whole file
+        """
+        return self.analyze_stream(self.iter_text_chunks(path, chunk_size))
     
     def generate_report(self, result: TextAnalysisResult) -> str:
         """
@@ -506,6 +1732,237 @@ class CEFRVocabularyEstimator:
         
         return "\n".join(report)
 
+# Complexity metrics written per row in batch mode (average sentence length has its own column)
+BATCH_METRICS = ['avg_word_length', 'lexical_diversity', 'long_word_ratio', 'avg_syllables_per_word']
+
+# Column names the text column is guessed from when none is given
+TEXT_COLUMN_HINTS = ('text', 'message', 'content', 'sentence', 'body')
+
+# Estimator of a batch worker process, built once by its initializer
+_worker_estimator: Optional[CEFRVocabularyEstimator] = None
+
+
+def iter_records(path: str, file_format: str) -> Iterator[dict]:
+    """
+    Stream the records of a CSV or JSON Lines file.
+    
+    Args:
+        path: Input file
+        file_format: 'csv' or 'jsonl'
+        
+    Yields:
+        One dict per row, column name to value
+    """
+    import csv
+    
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def guess_text_column(columns: List[str]) -> str:
+    """Name of the column that most likely holds the text, from TEXT_COLUMN_HINTS."""
+    for hint in TEXT_COLUMN_HINTS:
+        for column in columns:
+            if hint in column.lower():
+                return column
+    raise ValueError(f"Cannot tell which column holds the text, pass --column (columns: {', '.join(columns)})")
+
+
+def batch_columns(id_column: Optional[str], cefr_levels: List[str] = CEFR_LEVELS) -> List[Tuple[str, type]]:
+    """Output columns of batch mode and their types."""
+    columns = [('row', int)]
+    if id_column:
+        columns.append(('id', str))
+    columns += [('estimated_level', str), ('confidence_score', float), ('word_count', int),
+                ('sentence_count', int), ('avg_sentence_length', float)]
+    columns += [(f'{level}_percent', float) for level in cefr_levels]
+    columns += [(metric, float) for metric in BATCH_METRICS]
+    columns.append(('error', str))
+    return columns
+
+
+def result_row(result: TextAnalysisResult) -> dict:
+    """Flatten an analysis result into the level and metric columns of batch mode."""
+    row = {
+        'estimated_level': result.estimated_level,
+        'confidence_score': result.confidence_score,
+        'word_count': result.word_count,
+        'sentence_count': result.sentence_count,
+        'avg_sentence_length': result.avg_sentence_length,
+    }
+    for level, percent in result.level_percentages.items():
+        row[f'{level}_percent'] = percent
+    for metric in BATCH_METRICS:
+        row[metric] = result.complexity_metrics.get(metric)
+    return row
+
+
+def _init_batch_worker(options: dict):
+    """Process pool initializer: build and preload this worker's own estimator."""
+    global _worker_estimator
+    options = dict(options)
+    cache_path = options.pop('result_cache', None)
+    result_cache = ResultCache(cache_path) if cache_path else None
+    _worker_estimator = CEFRVocabularyEstimator(result_cache=result_cache, **options)
+    _worker_estimator.preload()
+
+
+def _analyze_batch(rows: List[Tuple[int, Optional[str], str]]) -> List[dict]:
+    """
+    Analyze a batch of rows in a worker.
+    
+    The usable texts go through the batched analysis of `analyze_many`
+    together; each unusable one gets its own error row.
+    
+    Args:
+        rows: (row number, id, text) tuples
+        
+    Returns:
+        Output rows, in input order
+    """
+    outcomes = _worker_estimator._analyze_outcomes([text for _, _, text in rows])
+    
+    output = []
+    for (number, row_id, _), outcome in zip(rows, outcomes):
+        row = {'row': number, 'id': row_id}
+        if isinstance(outcome, Exception):
+            row['error'] = str(outcome)
+        else:
+            row.update(result_row(outcome))
+        output.append(row)
+    return output
+
+
+class _BatchWriter:
+    """Appends output rows to a CSV or Parquet file as batches complete."""
+    
+    def __init__(self, path: str, columns: List[Tuple[str, type]]):
+        self.path = path
+        self.names = [name for name, _ in columns]
+        self.parquet = path.lower().endswith('.parquet')
+        if self.parquet:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ImportError(f"Missing required library: {e}. Run: pip install pyarrow") from e
+            types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+            self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+            self.writer = pq.ParquetWriter(path, self.schema)
+            self.table = pa.Table
+        else:
+            import csv
+            self.file = open(path, 'w', encoding='utf-8', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=self.names, extrasaction='ignore')
+            self.writer.writeheader()
+    
+    def write(self, rows: List[dict]):
+        """Append rows and push them to disk."""
+        if self.parquet:
+            columns = {name: [row.get(name) for row in rows] for name in self.names}
+            self.writer.write_table(self.table.from_pydict(columns, schema=self.schema))
+        else:
+            self.writer.writerows(rows)
+            self.file.flush()
+    
+    def close(self):
+        """Finish the file."""
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.file.close()
+
+
+def analyze_corpus(path: str, file_format: str, output: str, column: Optional[str] = None,
+                   id_column: Optional[str] = None, workers: Optional[int] = None,
+                   batch_size: int = 256, estimator_options: Optional[dict] = None) -> Tuple[int, int, float]:
+    """
+    Analyze every row of a CSV or JSON Lines dataset across a process pool.
+    
+    Rows are read as a stream and handed out in batches; each worker holds
+    its own estimator, loaded once. Results are written in input order as
+    soon as each batch is done, with at most two batches per worker in
+    flight, so memory stays flat however large the dataset is.
+    
+    Args:
+        path: Input file
+        file_format: 'csv' or 'jsonl'
+        output: Output file, Parquet if it ends in .parquet, CSV otherwise
+        column: Column holding the text (guessed from its name if omitted)
+        id_column: Column copied to the output to identify each row
+        workers: Worker processes (default: one per CPU); 1 analyzes in this process
+        batch_size: Rows per task
+        estimator_options: Keyword arguments for each worker's estimator,
+            with 'result_cache' as the path of a shared result cache file
+        
+    Returns:
+        Tuple of (rows, rows with errors, seconds)
+    """
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    
+    options = estimator_options or {}
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    
+    def batches():
+        records = iter_records(path, file_format)
+        text_column = column
+        batch = []
+        for number, record in enumerate(records, 1):
+            if text_column is None:
+                text_column = guess_text_column(list(record))
+            text = record.get(text_column)
+            row_id = record.get(id_column) if id_column else None
+            batch.append((number, None if row_id is None else str(row_id), text if isinstance(text, str) else ''))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    writer = _BatchWriter(output, batch_columns(id_column, CEFR_LEVELS))
+    rows = errors = 0
+    last_report = started
+    
+    def record(output_rows: List[dict]):
+        nonlocal rows, errors, last_report
+        writer.write(output_rows)
+        rows += len(output_rows)
+        errors += sum(1 for row in output_rows if row.get('error'))
+        now = time.perf_counter()
+        if now - last_report >= 2:
+            last_report = now
+            print(f"\r⏳ {rows:,} rows, {rows / (now - started):,.0f} rows/sec", end='', flush=True)
+    
+    try:
+        if workers == 1:
+            _init_batch_worker(options)
+            for batch in batches():
+                record(_analyze_batch(batch))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                     initargs=(options,)) as pool:
+                pending = deque()
+                for batch in batches():
+                    pending.append(pool.submit(_analyze_batch, batch))
+                    if len(pending) >= 2 * workers:
+                        record(pending.popleft().result())
+                while pending:
+                    record(pending.popleft().result())
+    finally:
+        writer.close()
+    
+    if last_report != started:
+        print()
+    return rows, errors, time.perf_counter() - started
+
+
 def main():
     """Main function for command-line interface."""
     import argparse
@@ -514,12 +1971,81 @@ def main():
     parser.add_argument("--text", type=str, help="Text to analyze")
     parser.add_argument("--file", type=str, help="File containing text to analyze")
     parser.add_argument("--interactive", action="store_true", help="Run in interactive mode")
+    parser.add_argument("--csv", type=str, help="Analyze every row of a CSV dataset")
+    parser.add_argument("--jsonl", type=str, help="Analyze every line of a JSON Lines dataset")
+    parser.add_argument("--column", type=str, help="Column holding the text in --csv/--jsonl (default: guessed)")
+    parser.add_argument("--id-column", type=str, help="Column copied to the output to identify each row")
+    parser.add_argument("--output", type=str,
+                        help="Where --csv/--jsonl results go; .parquet writes Parquet (default: <input>_levels.csv)")
+    parser.add_argument("--workers", type=int, help="Worker processes for --csv/--jsonl (default: one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Rows per worker task in --csv/--jsonl")
+    parser.add_argument("--chunk-size", type=int, default=100_000,
+                        help="Characters of --file read and analyzed at a time")
+    parser.add_argument("--cache-dir", type=str, help="Directory for local NLTK data and model copies")
+    parser.add_argument("--offline", action="store_true", help="Never download; use cached data and models only")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Load every component up front and report how long each one took")
+    parser.add_argument("--fast-tokenizer", action="store_true",
+                        help="Tokenize with regular expressions instead of spaCy or NLTK")
+    parser.add_argument("--no-result-cache", action="store_true",
+                        help="Always analyze from scratch instead of reusing results stored in the cache directory")
+    parser.add_argument("--backend", choices=CEFRVocabularyEstimator.BACKENDS, default='pytorch',
+                        help="Run the classifier in fp32 PyTorch, int8-quantized PyTorch or ONNX Runtime")
+    parser.add_argument("--backend-dir", type=str, help="Local model directory for --backend")
+    parser.add_argument("--threads", type=int, help="CPU threads for the classifier")
+    parser.add_argument("--export-onnx", type=str, metavar="DIR",
+                        help="Export the cached classifier to ONNX in DIR (for --backend onnx) and exit")
+    parser.add_argument("--quantize", action="store_true", help="Store --export-onnx weights as int8")
     
     args = parser.parse_args()
     
+    if args.export_onnx:
+        estimator = CEFRVocabularyEstimator(cache_dir=args.cache_dir, offline=args.offline, backend_dir=args.backend_dir)
+        if not estimator.classifier:
+            print("❌ No classifier to export")
+            return
+        source = args.backend_dir or estimator._local_model_dir()
+        try:
+            export_onnx(source, args.export_onnx, args.quantize)
+        except ImportError as e:
+            print(f"❌ Missing required library: {e}. Run: pip install torch onnx onnxruntime")
+            return
+        print(f"✅ Exported {source} to {args.export_onnx}" + (" (int8)" if args.quantize else ""))
+        return
+    
+    if args.csv or args.jsonl:
+        # Batch mode: workers build their own estimators, none is needed here
+        path, file_format = (args.csv, 'csv') if args.csv else (args.jsonl, 'jsonl')
+        output = args.output or f"{os.path.splitext(path)[0]}_levels.csv"
+        options = {'cache_dir': args.cache_dir, 'offline': args.offline, 'fast_tokenizer': args.fast_tokenizer,
+                   'backend': args.backend, 'backend_dir': args.backend_dir, 'threads': args.threads}
+        if not args.no_result_cache:
+            options['result_cache'] = os.path.join(args.cache_dir or DEFAULT_CACHE_DIR, "results.sqlite")
+        print(f"🚀 Analyzing {path} with {args.workers or os.cpu_count()} workers...")
+        try:
+            rows, errors, seconds = analyze_corpus(path, file_format, output, args.column, args.id_column,
+                                                   args.workers, args.batch_size, options)
+        except FileNotFoundError:
+            print(f"❌ File not found: {path}")
+            return
+        except (ValueError, ImportError) as e:
+            print(f"❌ Error: {e}")
+            return
+        print(f"✅ {rows:,} rows ({errors:,} without a result) in {seconds:.1f}s, "
+              f"{rows / seconds if seconds else 0:,.0f} rows/sec → {output}")
+        return
+    
     # Initialize estimator
     print("🚀 Initializing CEFR Vocabulary Level Estimator...")
-    estimator = CEFRVocabularyEstimator()
+    result_cache = None
+    if not args.no_result_cache:
+        result_cache = ResultCache(os.path.join(args.cache_dir or DEFAULT_CACHE_DIR, "results.sqlite"))
+    estimator = CEFRVocabularyEstimator(cache_dir=args.cache_dir, offline=args.offline, result_cache=result_cache,
+                                        fast_tokenizer=args.fast_tokenizer, backend=args.backend,
+                                        backend_dir=args.backend_dir, threads=args.threads)
+    if args.startup_report:
+        estimator.preload()
+        print(estimator.startup_report())
     print("✅ Estimator ready!")
     print()
     
@@ -553,10 +2079,8 @@ def main():
     elif args.file:
         # File mode
         try:
-            with open(args.file, 'r', encoding='utf-8') as f:
-                text = f.read()
-            
-            result = estimator.analyze_text(text)
+            # Streamed in sentence-aligned pieces, so memory stays flat for any file size
+            result = estimator.analyze_file(args.file, args.chunk_size)
             report = estimator.generate_report(result)
             print(report)
             
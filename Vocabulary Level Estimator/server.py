@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Pre-fork analysis server for the CEFR Vocabulary Level Estimator
+================================================================
+
+spaCy, NLTK data and the classifier are loaded once in the parent, which
+then forks the workers. The model weights stay in pages shared
+copy-on-write by every worker, so N workers use all cores without N
+copies of the model in memory.
+
+    python server.py --workers 4 --port 8765
+    python server.py --workers 4 --socket /tmp/cefr.sock
+
+Protocol: one JSON object per line on a stream socket, answered by one
+JSON line, any number of requests per connection.
+
+    {"text": "..."}          -> {"result": {...}}
+    {"texts": ["...", ...]}  -> {"results": [{...}, ...]}
+    failures                 -> {"error": "..."}
+
+A connection with no request for --idle-timeout seconds is closed, so idle
+clients cannot hold on to every worker.
+"""
+
+import os
+import gc
+import sys
+import json
+import signal
+import socket
+import logging
+from dataclasses import asdict
+from typing import Dict, List, Optional, Tuple, Union
+
+# Forked workers must not inherit the Rust tokenizer's thread pool
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+from main import DEFAULT_CACHE_DIR, CEFRVocabularyEstimator, ResultCache
+
+logger = logging.getLogger(__name__)
+
+Address = Union[str, Tuple[str, int]]
+
+
+def handle_request(estimator: CEFRVocabularyEstimator, request: dict) -> dict:
+    """
+    Answer one decoded request.
+
+    Args:
+        estimator: The worker's estimator
+        request: {"text": ...} or {"texts": [...]}
+
+    Returns:
+        Response object
+    """
+    if not isinstance(request, dict):
+        return {'error': "Request must be a JSON object"}
+    try:
+        if 'texts' in request:
+            texts = request['texts']
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                return {'error': "'texts' must be a list of strings"}
+            return {'results': [asdict(result) for result in estimator.analyze_many(texts)]}
+        if 'text' in request:
+            if not isinstance(request['text'], str):
+                return {'error': "'text' must be a string"}
+            return {'result': asdict(estimator.analyze_text(request['text']))}
+        return {'error': "Request must have 'text' or 'texts'"}
+    except ValueError as e:
+        return {'error': str(e)}
+    except MemoryError:
+        return {'error': "Text too large to analyze in one request, send it in parts"}
+
+
+def serve_connection(estimator: CEFRVocabularyEstimator, connection: socket.socket, idle_timeout: Optional[float] = None):
+    """Answer the requests of one client until it disconnects or stays idle for idle_timeout seconds."""
+    connection.settimeout(idle_timeout)
+    with connection, connection.makefile('rwb') as stream:
+        try:
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    response = handle_request(estimator, json.loads(line))
+                except json.JSONDecodeError:
+                    response = {'error': "Request must be one JSON object per line"}
+                except Exception as e:
+                    logger.exception(f"Error handling request: {e}")
+                    # The client learns what failed, the traceback stays in the worker's log
+                    response = {'error': f"Internal error: {type(e).__name__}: {e}"}
+                stream.write(json.dumps(response).encode('utf-8') + b'\n')
+                stream.flush()
+        except socket.timeout:
+            logger.info(f"Closing a connection idle for {idle_timeout}s")
+
+
+class PreforkServer:
+    """
+    Listening socket plus a fixed pool of forked workers that accept from it.
+
+    The kernel hands each new connection to one idle worker; the parent
+    only restarts workers that die and stops them all on shutdown.
+    """
+
+    def __init__(self, estimator: CEFRVocabularyEstimator, address: Address, workers: int = 4,
+                 threads: int = 1, result_cache: Optional[str] = None, idle_timeout: Optional[float] = 60.0):
+        """
+        Args:
+            estimator: Estimator to preload and share with the workers
+            address: Unix socket path, or (host, port) for TCP
+            workers: Worker processes to fork
+            threads: Torch threads per worker, so workers do not oversubscribe the cores
+            result_cache: Result cache file each worker opens after the fork
+            idle_timeout: Seconds a connection may wait between requests before it is closed, None for no limit
+        """
+        self.estimator = estimator
+        self.address = address
+        self.workers = workers
+        self.threads = threads
+        self.result_cache = result_cache
+        self.idle_timeout = idle_timeout
+        self.children: Dict[int, int] = {}  # pid -> worker slot
+        self.parent = os.getpid()
+        self.running = False
+        self.listener = self._listen(address)
+
+    @staticmethod
+    def _listen(address: Address) -> socket.socket:
+        """Bind the socket every worker accepts from."""
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+        listener.listen(128)
+        return listener
+
+    def preload(self):
+        """
+        Load every model once, before forking.
+
+        Afterwards the loaded objects are moved out of the garbage collector's
+        reach (`gc.freeze`), so collections in the workers do not write to
+        their pages and break the copy-on-write sharing.
+        """
+        self.estimator.preload()
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self, slot: int):
+        """Fork one worker into a slot."""
+        pid = os.fork()
+        if pid:
+            self.children[pid] = slot
+            return
+        # Worker process: never returns
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self._work()
+        except Exception as e:
+            logger.error(f"Worker {slot} failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _work(self):
+        """Worker loop: accept connections and answer them one at a time."""
+        try:
+            import torch
+            torch.set_num_threads(self.threads)
+        except ImportError:
+            pass
+        if self.result_cache:
+            # SQLite connections must not cross a fork, each worker opens its own
+            self.estimator.result_cache = ResultCache(self.result_cache)
+        # Wake up every second to notice a parent that died without stopping the workers
+        self.listener.settimeout(1.0)
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except socket.timeout:
+                if os.getppid() != self.parent:
+                    return
+                continue
+            try:
+                serve_connection(self.estimator, connection, self.idle_timeout)
+            except OSError as e:
+                logger.warning(f"Connection dropped: {e}")
+
+    def serve_forever(self):
+        """Fork the workers and keep the pool full until stopped."""
+        self.running = True
+        for slot in range(self.workers):
+            self._spawn(slot)
+        while self.running:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self.children.pop(pid, None)
+            if self.running and slot is not None:
+                logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+                self._spawn(slot)
+
+    def stop(self):
+        """Stop every worker and close the socket."""
+        self.running = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children.clear()
+        self.listener.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class CEFRClient:
+    """Connection to a running analysis server."""
+
+    def __init__(self, address: Address):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(address)
+        self.stream = self.connection.makefile('rwb')
+
+    def request(self, payload: dict) -> dict:
+        """Send one request and wait for its response."""
+        self.stream.write(json.dumps(payload).encode('utf-8') + b'\n')
+        self.stream.flush()
+        return json.loads(self.stream.readline())
+
+    def analyze(self, text: str) -> dict:
+        """Analysis result of one text, as a dict; raises ValueError on errors."""
+        response = self.request({'text': text})
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['result']
+
+    def analyze_many(self, texts: List[str]) -> List[dict]:
+        """Analysis results of several texts, as dicts; raises ValueError on errors."""
+        response = self.request({'texts': texts})
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['results']
+
+    def close(self):
+        """Close the connection."""
+        self.stream.close()
+        self.connection.close()
+
+
+def main():
+    """Run the pre-fork server."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CEFR Vocabulary Level Estimator pre-fork server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", type=str, help="Listen on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads per worker")
+    parser.add_argument("--cache-dir", type=str, help="Directory for local NLTK data and model copies")
+    parser.add_argument("--offline", action="store_true", help="Never download; use cached data and models only")
+    parser.add_argument("--fast-tokenizer", action="store_true",
+                        help="Tokenize with regular expressions instead of spaCy or NLTK")
+    parser.add_argument("--backend", choices=CEFRVocabularyEstimator.BACKENDS, default='pytorch',
+                        help="Run the classifier in fp32 PyTorch, int8-quantized PyTorch or ONNX Runtime")
+    parser.add_argument("--backend-dir", type=str, help="Local model directory for --backend")
+    parser.add_argument("--idle-timeout", type=float, default=60.0,
+                        help="Seconds a connection may stay idle before it is closed (0 for no limit)")
+    parser.add_argument("--no-result-cache", action="store_true",
+                        help="Always analyze from scratch instead of reusing results stored in the cache directory")
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("❌ The pre-fork server needs a platform with os.fork")
+        return 1
+
+    print("🚀 Loading models...")
+    if args.backend == 'onnx' and args.threads > 1:
+        # onnxruntime starts its thread pool when the session is created, and threads do not survive a fork
+        print("⚠️  The ONNX backend runs one thread per worker in the pre-fork server")
+        args.threads = 1
+    estimator = CEFRVocabularyEstimator(cache_dir=args.cache_dir, offline=args.offline,
+                                        fast_tokenizer=args.fast_tokenizer, backend=args.backend,
+                                        backend_dir=args.backend_dir, threads=args.threads)
+    result_cache = None
+    if not args.no_result_cache:
+        result_cache = os.path.join(args.cache_dir or DEFAULT_CACHE_DIR, "results.sqlite")
+    address = args.socket or (args.host, args.port)
+    server = PreforkServer(estimator, address, args.workers, args.threads, result_cache, args.idle_timeout or None)
+    server.preload()
+    print(estimator.startup_report())
+
+    def shut_down(signum, frame):
+        server.running = False
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shut_down)
+    where = args.socket or f"{args.host}:{args.port}"
+    print(f"✅ Serving on {where} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down...")
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
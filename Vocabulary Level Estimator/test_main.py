@@ -0,0 +1,443 @@
+"""
+Tests for the CEFR Vocabulary Level Estimator
+
+    python -m pytest -q test_main.py
+"""
+
+from collections import Counter
+from dataclasses import asdict
+
+import pytest
+
+from main import CEFR_LEVELS, CEFRVocabularyEstimator, ResultCache, export_onnx
+from benchmark import synthetic_text, tiny_model
+
+
+class WordTokenizer:
+    """Whitespace tokenizer with a small model limit, so long texts span many windows"""
+
+    model_max_length = 48
+
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        return {'input_ids': [text.split() for text in texts]}
+
+
+class LengthClassifier:
+    """Deterministic stand-in for the transformers pipeline: longer words push the distribution up the levels"""
+
+    tokenizer = WordTokenizer()
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, batch_size=32, truncation=True, top_k=1, **kwargs):
+        self.calls.append(len(texts))
+        results = []
+        for text in texts:
+            words = text.split()
+            mean = sum(len(word) for word in words) / len(words)
+            weights = [1 / (1 + abs(mean - (3 + index))) for index in range(len(CEFR_LEVELS))]
+            total = sum(weights)
+            results.append(sorted(({'label': level, 'score': weight / total} for level, weight in zip(CEFR_LEVELS, weights)),
+                                  key=lambda prediction: -prediction['score']))
+        return results
+
+
+@pytest.fixture
+def estimator(tmp_path, request):
+    estimator = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True,
+                                        fast_tokenizer=getattr(request, 'param', False))
+    estimator.classifier = None
+    return estimator
+
+
+@pytest.mark.parametrize('estimator', [False, True], indirect=True, ids=['default-tokenizer', 'regex-tokenizer'])
+@pytest.mark.parametrize('with_classifier', [False, True], ids=['vocabulary', 'classifier'])
+def test_streamed_file_matches_whole_text_analysis(tmp_path, estimator, with_classifier):
+    if with_classifier:
+        estimator.classifier = LengthClassifier()
+    text = synthetic_text(60_000, estimator, seed=7)
+    path = tmp_path / "long.txt"
+    path.write_text(text, encoding='utf-8')
+
+    whole = asdict(estimator.analyze_text(text))
+    for chunk_size in (997, 8_000, 100_000):
+        streamed = asdict(estimator.analyze_file(str(path), chunk_size=chunk_size))
+        assert streamed.pop('confidence_score') == pytest.approx(whole['confidence_score'])
+        assert streamed == {key: value for key, value in whole.items() if key != 'confidence_score'}
+    if with_classifier:
+        assert whole['estimated_level'] in CEFR_LEVELS
+
+
+def test_file_chunks_end_on_sentence_boundaries(tmp_path):
+    text = "One short sentence. " * 500 + "an unpunctuated run of words " * 400 + "The end."
+    path = tmp_path / "text.txt"
+    path.write_text(text, encoding='utf-8')
+    chunks = list(CEFRVocabularyEstimator.iter_text_chunks(str(path), chunk_size=256))
+    assert ''.join(chunks) == text
+    for chunk in chunks[:-1]:
+        # A chunk ends after a sentence end, or at whitespace once an unpunctuated run grows past four reads
+        assert chunk.endswith('. ') or (chunk.endswith(' ') and len(chunk) > 3 * 256)
+
+
+@pytest.mark.parametrize('backend, quantize, tolerance', [('onnx', False, 1e-4), ('int8', False, 0.05), ('onnx', True, 0.05)],
+                         ids=['onnx', 'int8', 'onnx-int8'])
+def test_backends_agree_with_fp32(tmp_path, backend, quantize, tolerance):
+    pytest.importorskip('torch')
+    pytest.importorskip('transformers')
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    probe = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True)
+    model_dir = str(tmp_path / "tiny")
+    tiny_model(model_dir, probe)
+    backend_dir = model_dir
+    if backend == 'onnx':
+        backend_dir = str(tmp_path / "onnx")
+        export_onnx(model_dir, backend_dir, quantize=quantize)
+
+    reference = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True, backend_dir=model_dir)
+    variant = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True, backend=backend,
+                                      backend_dir=backend_dir)
+    assert reference.classifier and variant.classifier
+    texts = [synthetic_text(size, probe, seed) for seed, size in enumerate([80, 200, 400] * 8)]
+
+    # Label distributions of single windows
+    expected = reference.classifier(texts, top_k=None)
+    actual = variant.classifier(texts, top_k=None)
+    for want, got in zip(expected, actual):
+        want_scores = {prediction['label']: prediction['score'] for prediction in want}
+        got_scores = {prediction['label']: prediction['score'] for prediction in got}
+        assert got_scores == pytest.approx(want_scores, abs=tolerance)
+        # A label within the tolerance of the runner-up may legitimately flip
+        if want[0]['score'] - want[1]['score'] > 2 * tolerance:
+            assert got[0]['label'] == want[0]['label']
+
+    # Whole texts through windowing and voting
+    for (want_level, want_score), (level, score) in zip(reference.estimate_levels_with_transformer(texts),
+                                                        variant.estimate_levels_with_transformer(texts)):
+        assert level in CEFR_LEVELS
+        assert score == pytest.approx(want_score, abs=tolerance)
+        if tolerance < 1e-3:
+            assert level == want_level
+
+
+def test_batch_rows_with_errors_keep_the_rest_batched(estimator, monkeypatch):
+    import main
+    estimator.classifier = LengthClassifier()
+    monkeypatch.setattr(main, '_worker_estimator', estimator)
+    good = [synthetic_text(150, estimator, seed) for seed in range(6)]
+    rows = [(1, 'a', good[0]), (2, 'b', ''), (3, 'c', good[1]), (4, 'd', '1234 5678'), (5, 'e', good[2]),
+            (6, 'f', '   '), *((number, None, text) for number, text in enumerate(good[3:], 7))]
+
+    output = main._analyze_batch(rows)
+    assert [row['row'] for row in output] == [number for number, _, _ in rows]
+    assert [bool(row.get('error')) for row in output] == [False, True, False, True, False, True, False, False, False]
+    assert output[1]['error'] == "Invalid input text"
+    # The six usable texts were classified in one call
+    assert estimator.classifier.calls == [6]
+    for row, text in zip([row for row in output if 'error' not in row], good):
+        assert row == {'row': row['row'], 'id': row['id'], **main.result_row(estimator.analyze_text(text))}
+
+    with pytest.raises(ValueError, match="Text 1: Invalid input text"):
+        estimator.analyze_many(good[:1] + [''])
+
+
+def reference_word_level(estimator, word):
+    """Word level as it was looked up before the precomputed tables: every list, word then lemma"""
+    lemma = estimator.lemmatizer.lemmatize(word) if estimator.lemmatizer else word
+    for level in estimator.cefr_levels:
+        if word in estimator.vocabulary_lists[level] or lemma in estimator.vocabulary_lists[level]:
+            return level
+    for limit, level in ((4, 'A1'), (6, 'A2'), (8, 'B1'), (10, 'B2'), (12, 'C1')):
+        if len(word) <= limit:
+            return level
+    return 'C2'
+
+
+class SuffixLemmatizer:
+    """Stand-in for the WordNet lemmatizer: strips a few inflections"""
+
+    def lemmatize(self, word):
+        for suffix in ('ing', 'ed', 's'):
+            if word.endswith(suffix) and len(word) > len(suffix) + 2:
+                return word[:-len(suffix)]
+        return word
+
+
+@pytest.mark.parametrize('with_lemmatizer', [False, True], ids=['words', 'lemmas'])
+def test_word_level_tables_match_the_list_lookup(estimator, with_lemmatizer):
+    # Set before the tables are first built from them
+    estimator.lemmatizer = SuffixLemmatizer() if with_lemmatizer else None
+    estimator.stop_words = {'the', 'and', 'with', 'about', 'would'}
+    listed = set().union(*estimator.vocabulary_lists.values())
+    unlisted = ['xyzzy', 'qwertyuiopasdf', 'ox', 'zzz', 'the', 'about']
+    words = sorted(listed | {word + suffix for word in listed for suffix in ('s', 'ed', 'ing')} | set(unlisted))
+
+    counted = [word for word in words if word not in estimator.stop_words and len(word) > 2]
+    for word in words:
+        want = reference_word_level(estimator, word)
+        assert estimator.get_word_cefr_level(word) == want, word
+        want_counted = want if word in counted else ''
+        assert estimator.word_profile(word) == (want_counted, len(word), estimator.count_syllables(word)), word
+        if word in estimator.token_levels:
+            assert estimator.token_levels[word] == want_counted, word
+
+    _, counts, representative = estimator.estimate_level_from_vocabulary(words)
+    want_levels = [reference_word_level(estimator, word) for word in counted]
+    assert counts == Counter(want_levels)
+    assert representative == {level: [word for word, word_level in zip(counted, want_levels) if word_level == level][:10]
+                              for level in counts}
+
+
+def test_sentence_windows_fit_the_model_and_keep_every_word(estimator):
+    estimator.classifier = LengthClassifier()
+    budget = estimator._window_budget()
+    long_sentence = ' '.join(f'word{index}' for index in range(3 * budget + 5)) + '.'
+    sentence_lists = [["A short one.", "Another short sentence here."], [], ["   "],
+                      [long_sentence, "After the long one."], ["Last of all."] * 40]
+
+    windows = list(estimator.sentence_windows(iter(sentence_lists)))
+    assert all(0 < tokens <= budget for _, tokens in windows)
+    assert all(len(text.split()) == tokens for text, tokens in windows)
+    assert [word for text, _ in windows for word in text.split()] == \
+        [word for sentences in sentence_lists for sentence in sentences for word in sentence.split()]
+    # The long sentence is cut into four runs of about equal length, alone in their windows
+    long_words = long_sentence.split()
+    pieces = [text for text, _ in windows if text.split()[0].startswith('word')]
+    assert len(pieces) == 4 and ' '.join(pieces) == ' '.join(long_words)
+    assert max(len(piece.split()) for piece in pieces) - min(len(piece.split()) for piece in pieces) <= 1
+
+
+def test_regex_tokenizer_finds_words_and_sentences():
+    words, sentences = CEFRVocabularyEstimator.regex_tokenize("Don't stop! Café au lait, 42 times?  Yes.\nNo_way")
+    assert words == ['don', 't', 'stop', 'café', 'au', 'lait', 'times', 'yes', 'no', 'way']
+    assert sentences == ["Don't stop!", "Café au lait, 42 times?", "Yes.", "No_way"]
+    assert CEFRVocabularyEstimator.regex_tokenize("") == ([], [])
+
+
+def test_single_pass_matches_the_separate_passes(estimator):
+    import main
+    text = synthetic_text(20_000, estimator, seed=3) + " Zymurgical oxidation, pseudopseudohypoparathyroidism."
+    words, sentences = estimator.tokenize_text(text)
+    level, counts, representative = estimator.estimate_level_from_vocabulary(words)
+    metrics = estimator.calculate_complexity_metrics(words, sentences)
+
+    # The whole text at once and in uneven pieces, as a streamed file is added
+    for cuts in ([], [1, 17, 500, 4_000]):
+        accumulator = main._AnalysisAccumulator(estimator)
+        bounds = [0, *cuts, len(words)]
+        for piece, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            accumulator.add(words[start:end], sentences if piece == 0 else [])
+        result = accumulator.result(text, None, 0.0)
+        assert result.vocabulary_distribution == counts
+        assert result.representative_words == representative
+        assert result.complexity_metrics == pytest.approx(metrics)
+        assert result.estimated_level == level
+        assert (result.word_count, result.sentence_count) == (len(words), len(sentences))
+
+
+@pytest.mark.parametrize('estimator', [False, True], indirect=True, ids=['default-tokenizer', 'regex-tokenizer'])
+@pytest.mark.parametrize('with_classifier', [False, True], ids=['vocabulary', 'classifier'])
+def test_analyze_many_matches_analyze_text(estimator, with_classifier):
+    texts = [synthetic_text(size, estimator, seed) for seed, size in enumerate((80, 400, 2_500, 150, 900))]
+    if with_classifier:
+        estimator.classifier = LengthClassifier()
+
+    many = [asdict(result) for result in estimator.analyze_many(texts, batch_size=2)]
+    if with_classifier:
+        # Every window of every text went through a single classifier call
+        assert len(estimator.classifier.calls) == 1
+        assert estimator.classifier.calls[0] >= len(texts)
+    one_by_one = [asdict(estimator.analyze_text(text)) for text in texts]
+    for batched, single in zip(many, one_by_one):
+        assert batched.pop('confidence_score') == pytest.approx(single.pop('confidence_score'))
+        assert batched == single
+    assert len(many) == len(texts)
+
+
+def test_result_cache_keeps_a_running_size(tmp_path, estimator):
+    path = str(tmp_path / "results.sqlite")
+    result = estimator.analyze_text(synthetic_text(300, estimator))
+    cache, other = ResultCache(path, memory_size=4, max_bytes=55_000), ResultCache(path, memory_size=4)
+    cache.RESYNC_PUTS = 10
+    statements = []
+    cache.db.set_trace_callback(statements.append)
+    for number in range(60):
+        # Replacing a key changes the total by the difference only
+        cache.put(f"key {number % 40}", result)
+        # Checked through the other connection, which is not traced
+        assert cache.stored_bytes == other._stored_size() <= 55_000
+    # 40 results fit, so the table is summed only every RESYNC_PUTS puts, not on every put
+    assert sum('SUM(size)' in statement for statement in statements) == 60 // cache.RESYNC_PUTS
+
+    # Results another process stored are counted at the next resync or eviction at the latest
+    for number in range(5):
+        other.put(f"other {number}", result)
+    for number in range(cache.RESYNC_PUTS):
+        cache.put(f"new {number}", result)
+    assert cache.stored_bytes == cache._stored_size() <= 55_000
+    # Least recently used first: "key 20" was last written before every other key
+    assert cache.get("key 20") is None and cache.get("new 9") is not None
+    cache.clear()
+    assert cache.stored_bytes == 0 == cache._stored_size()
+
+def test_cached_results_are_copies(tmp_path, estimator):
+    result = estimator.analyze_text(synthetic_text(200, estimator))
+    expected = asdict(result)
+    for cache in (ResultCache(), ResultCache(str(tmp_path / "results.sqlite"))):
+        cache.put("key", result)
+        result.vocabulary_distribution['A1'] += 1000
+        hit = cache.get("key")
+        hit.level_percentages.clear()
+        hit.representative_words['A1'].append("changed")
+        assert asdict(cache.get("key")) == expected
+        result.vocabulary_distribution['A1'] -= 1000
+        cache.close()
+
+
+def test_result_cache_access_times_are_written_in_batches(tmp_path, estimator):
+    path = str(tmp_path / "results.sqlite")
+    result = estimator.analyze_text(synthetic_text(100, estimator))
+    writer = ResultCache(path)
+    for number in range(10):
+        writer.put(f"key {number}", result)
+    accessed = dict(writer.db.execute("SELECT key, accessed FROM results"))
+    writer.close()
+
+    cache = ResultCache(path, memory_size=2)
+    cache.ACCESS_FLUSH = 4
+    statements = []
+    cache.db.set_trace_callback(statements.append)
+    for number in range(10):
+        assert cache.get(f"key {number}") is not None
+    assert sum(statement.startswith('UPDATE') for statement in statements) == 2 * 4
+    cache.close()
+    assert all(when > accessed[key] for key, when in ResultCache(path).db.execute("SELECT key, accessed FROM results"))
+
+
+def test_a_busy_or_broken_result_cache_file_is_a_miss_not_an_error(tmp_path, estimator):
+    path = str(tmp_path / "results.sqlite")
+    result = estimator.analyze_text(synthetic_text(100, estimator))
+    cache = ResultCache(path, memory_size=1)
+    cache.db.execute("PRAGMA busy_timeout = 0")
+    cache.put("stored", result)
+    other = ResultCache(path)
+
+    # Another process holds the write lock: the put stays in memory, WAL readers still get through
+    other.db.execute("BEGIN EXCLUSIVE")
+    cache.put("busy", result)
+    assert cache.get("busy") == result
+    assert cache.get("stored") == result
+    other.db.execute("ROLLBACK")
+    assert cache._stored_size() == cache.stored_bytes
+    assert [key for key, in other.db.execute("SELECT key FROM results")] == ["stored"]
+
+    # The table is gone: gets miss and puts are kept in memory
+    other.db.execute("DROP TABLE results")
+    assert cache.get("busy") is None
+    cache.put("dropped", result)
+    assert cache.get("dropped") == result
+    cache.close()
+    other.close()
+
+
+def test_results_without_the_classifier_are_cached_apart(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    text = synthetic_text(500, CEFRVocabularyEstimator(offline=True), seed=3)
+
+    def estimator_with(classifier):
+        estimator = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True,
+                                            result_cache=ResultCache(path))
+        estimator.classifier = classifier
+        return estimator
+
+    plain = estimator_with(None)
+    first = plain.analyze_text(text)
+    assert plain.analyze_many([text]) == [first]
+    assert plain.result_cache.hits == 1
+    # A later process without the classifier is answered from the file
+    again = estimator_with(None)
+    assert again.analyze_text(text) == first
+    assert again.result_cache.hits == 1
+    # One with the classifier never gets the vocabulary-only result
+    classifier = LengthClassifier()
+    classified = estimator_with(classifier)
+    classified.analyze_text(text)
+    assert classified.result_cache.hits == 0
+    assert classifier.calls
+
+
+def scheduled_estimator(tmp_path, window: float, max_batch: int, classifier=None) -> CEFRVocabularyEstimator:
+    estimator = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True, fast_tokenizer=True,
+                                        batch_window=window, max_batch=max_batch)
+    estimator.classifier = classifier or LengthClassifier()
+    return estimator
+
+
+def test_concurrent_submits_share_batches(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    estimator = scheduled_estimator(tmp_path, 0.05, 8)
+    texts = [synthetic_text(40, estimator, seed) for seed in range(24)]
+    with ThreadPoolExecutor(max_workers=24) as pool:
+        estimates = list(pool.map(estimator._estimate_one, texts))
+    assert estimates == estimator.estimate_levels_with_transformer(texts)
+    stats = estimator.scheduler.stats()
+    assert stats['texts'] == 24
+    assert stats['batches'] < 24
+    assert sum(estimator.classifier.calls[:-1]) == 24
+    estimator.scheduler.close()
+
+
+def test_a_full_batch_runs_without_waiting_out_the_window(tmp_path):
+    import time
+    estimator = scheduled_estimator(tmp_path, 30.0, 4)
+    texts = [synthetic_text(40, estimator, seed) for seed in range(4)]
+    started = time.perf_counter()
+    futures = [estimator.scheduler.submit(text) for text in texts]
+    assert [future.result(timeout=10) for future in futures] == estimator.estimate_levels_with_transformer(texts)
+    assert time.perf_counter() - started < 10
+    assert estimator.scheduler.stats()['fill_ratio'] == 1.0
+    estimator.scheduler.close()
+
+
+def test_a_failed_batch_fails_its_futures_and_the_scheduler_carries_on(tmp_path):
+    class Broken(LengthClassifier):
+        def __call__(self, texts, **kwargs):
+            raise MemoryError("out of memory")
+
+    estimator = scheduled_estimator(tmp_path, 0.01, 4, Broken())
+    text = synthetic_text(40, estimator)
+    future = estimator.scheduler.submit(text)
+    with pytest.raises(MemoryError):
+        future.result(timeout=10)
+    # The unbatched path has no prediction for a failed call either
+    assert estimator._estimate_one(text) == (None, 0.0)
+
+    estimator.classifier = LengthClassifier()
+    assert estimator.scheduler.thread.is_alive()
+    assert estimator._estimate_one(text) == estimator.estimate_levels_with_transformer([text])[0]
+    estimator.scheduler.close()
+    with pytest.raises(RuntimeError):
+        estimator.scheduler.submit(text)
+
+
+def test_concurrent_first_accesses_load_a_component_once(tmp_path, monkeypatch):
+    import threading
+    import time
+    estimator = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True)
+    loads = []
+
+    def slow_load():
+        loads.append(threading.get_ident())
+        time.sleep(0.05)
+        return {'the'}
+
+    monkeypatch.setattr(estimator, '_load_stop_words', slow_load)
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(estimator.stop_words)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(value is seen[0] for value in seen)
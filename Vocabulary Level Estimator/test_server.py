@@ -0,0 +1,81 @@
+"""
+Tests for the CEFR Vocabulary Level Estimator analysis server
+
+    python -m pytest -q test_server.py
+"""
+
+import json
+import time
+import socket
+import threading
+
+import pytest
+
+from main import CEFRVocabularyEstimator
+from server import handle_request, serve_connection
+
+
+@pytest.fixture
+def estimator(tmp_path):
+    estimator = CEFRVocabularyEstimator(cache_dir=str(tmp_path / "cache"), offline=True, fast_tokenizer=True)
+    estimator.classifier = None
+    return estimator
+
+
+def serving(estimator, idle_timeout=None):
+    """A client socket answered by serve_connection on a thread, and that thread"""
+    client, server_side = socket.socketpair()
+    thread = threading.Thread(target=serve_connection, args=(estimator, server_side, idle_timeout), daemon=True)
+    thread.start()
+    return client, thread
+
+
+def ask(stream, payload) -> dict:
+    """Send one request line and read its response line"""
+    stream.write((payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')) + b'\n')
+    stream.flush()
+    return json.loads(stream.readline())
+
+
+def test_requests_get_results_and_bad_requests_say_what_is_wrong(estimator, monkeypatch):
+    client, thread = serving(estimator)
+    with client, client.makefile('rwb') as stream:
+        text = "The cat sat on the mat. It was a sunny day."
+        assert ask(stream, {'text': text})['result']['word_count'] == estimator.analyze_text(text).word_count
+        assert len(ask(stream, {'texts': [text, text]})['results']) == 2
+        assert ask(stream, b'not json') == {'error': "Request must be one JSON object per line"}
+        assert ask(stream, [text]) == {'error': "Request must be a JSON object"}
+        assert ask(stream, {'text': 42}) == {'error': "'text' must be a string"}
+        assert ask(stream, {'texts': text}) == {'error': "'texts' must be a list of strings"}
+        assert ask(stream, {'body': text}) == {'error': "Request must have 'text' or 'texts'"}
+        assert 'error' in ask(stream, {'text': ''})
+
+        def failing(text):
+            raise RuntimeError("classifier crashed")
+
+        monkeypatch.setattr(estimator, 'analyze_text', failing)
+        assert ask(stream, {'text': text}) == {'error': "Internal error: RuntimeError: classifier crashed"}
+        # The connection carries on after a failed request
+        assert len(ask(stream, {'texts': [text]})['results']) == 1
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_an_idle_connection_is_closed(estimator):
+    client, thread = serving(estimator, idle_timeout=0.2)
+    with client, client.makefile('rwb') as stream:
+        assert 'result' in ask(stream, {'text': "A short request."})
+        started = time.monotonic()
+        # The worker gives up on the silent client and closes its end
+        assert stream.readline() == b''
+        assert time.monotonic() - started < 2
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_handle_request_maps_oversized_texts(estimator, monkeypatch):
+    def exhausted(text):
+        raise MemoryError
+
+    monkeypatch.setattr(estimator, 'analyze_text', exhausted)
+    assert handle_request(estimator, {'text': "x"}) == {'error': "Text too large to analyze in one request, send it in parts"}